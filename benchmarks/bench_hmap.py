@@ -0,0 +1,261 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import hmap_core as hm  # noqa: E402
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+DEFAULT_BASELINE = os.path.join(HERE, 'baseline.json')
+DEFAULT_SIZES = ['183x249', '1024x1024', '4096x4096']
+STAGES = ['parse_dat', 'update_dat', 'apply_patch', 'parse_hex', 'png_to_hex', 'normalize',
+          'query_nearest', 'query_bilinear']
+# World positions per batch in the query stages
+QUERY_BATCH = 1_000_000
+# Headless codecs and the GUI entry module, timed in fresh interpreters
+IMPORT_MODULES = ['hmap_core', 'height_tool_gui']
+# GUI-only dependencies the headless module must not pull in at import time
+GUI_ONLY_MODULES = ['tkinter', 'PIL']
+
+
+def make_synthetic_hmap(width, height, compressed=True, endian='>', sparsity=0.0, seed=0):
+    # HMAP bytes with smooth random terrain. sparsity is the share of each row
+    # (split between both ends) and of whole rows that is left empty, which
+    # shrinks the compressed row spans the way real coastlines do.
+    rng = np.random.default_rng(seed)
+    ramp = np.cumsum(rng.integers(-3, 4, size=(height, width)), axis=1)
+    ramp += np.cumsum(rng.integers(-3, 4, size=(height, 1)), axis=0)
+    max_arr = np.clip(ramp - ramp.min() + 1, 1, 255).astype(np.uint8)
+    min_arr = (max_arr // 2 + 1).astype(np.uint8)
+    if sparsity > 0:
+        cut = (rng.random(height) * sparsity * width).astype(int)
+        cols = np.arange(width)
+        empty = (cols[None, :] < cut[:, None] // 2) | (cols[None, :] >= width - (cut[:, None] + 1) // 2)
+        empty |= (rng.random(height) < sparsity)[:, None]
+        max_arr[empty] = 0
+        min_arr[empty] = 0
+    header = {'endian': endian, 'ver_major': 1, 'ver_minor': 1, 'pad': 0, 'compressed': int(compressed),
+              'bbmin': (-4000.0, -4000.0, -100.0), 'bbmax': (4000.0, 8000.0, 1500.0)}
+    return hm._encode_hmap(max_arr, min_arr, header)
+
+
+def write_synthetic_hmap(path, width, height, **kwargs):
+    data = make_synthetic_hmap(width, height, **kwargs)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return len(data)
+
+
+def _prepare(stage, tmp, width, height, args):
+    # Returns (callable, bytes processed) for one stage at one size
+    dat = os.path.join(tmp, f'bench_{width}x{height}.dat')
+    if not os.path.exists(dat):
+        write_synthetic_hmap(dat, width, height, compressed=not args.uncompressed,
+                             endian=args.endian, sparsity=args.sparsity)
+    size = os.path.getsize(dat)
+    cells = width * height
+    if stage == 'parse_dat':
+        return (lambda: hm.parse_dat_file(dat)), size
+    if stage == 'update_dat':
+        with open(dat, 'rb') as f:
+            data = f.read()
+        # Remap of every stored byte; rows the encoder stored once get the same new
+        # values, as the shared-span check requires
+        lut = np.random.default_rng(1).permutation(256).astype(np.uint8)
+        edit = lut[hm.parse_dat_file(dat)[0]]
+        return (lambda: hm._update_hmap_binary(data, edit, 'max')), size
+    if stage == 'apply_patch':
+        # Patch touching 1% of the cells; cost should follow the patch, not the map
+        with open(dat, 'rb') as f:
+            data = f.read()
+        max_arr = hm.parse_dat_file(dat)[0]
+        edit = max_arr.copy()
+        pick = np.random.default_rng(1).random(edit.shape) < 0.01
+        layout = hm.HmapLayout(data)
+        ranges = hm._shared_ranges(layout)
+        if ranges is not None:
+            # Random picks would edit rows that share bytes differently, which a
+            # patch may not do
+            pick[hm._aliased_rows(layout, ranges)] = False
+        layout.release()
+        edit[pick & (max_arr != 0)] ^= 1
+        patch = hm.HmapPatch(hm.make_patch({'max': max_arr}, {'max': edit}))
+        return (lambda: hm._apply_patch_binary(data, patch)), len(patch.new)
+    if stage == 'parse_hex':
+        txt = os.path.join(tmp, f'bench_{width}x{height}.txt')
+        if not os.path.exists(txt):
+            hm._save_array_as_hex(hm.parse_dat_file(dat)[0], txt)
+        return (lambda: hm.parse_hex_file(txt, width)), os.path.getsize(txt)
+    if stage == 'png_to_hex':
+        from PIL import Image
+        png = os.path.join(tmp, f'bench_{width}x{height}.png')
+        if not os.path.exists(png):
+            Image.fromarray(hm.parse_dat_file(dat)[0], mode='L').save(png)
+        out = os.path.join(tmp, 'out.txt')
+        return (lambda: hm.png_to_hex(png, out)), cells
+    if stage == 'normalize':
+        arr = hm.parse_dat_file(dat)[0]
+        return (lambda: hm._normalize_to_uint8(arr)), cells
+    if stage.startswith('query_'):
+        # Random world positions spread a little beyond the bounds, so some miss
+        with open(dat, 'rb') as f:
+            data = f.read()
+        layout = hm.HmapLayout(data)
+        header = layout.header()
+        layout.release()
+        field = hm.HeightField(*hm._parse_hmap_binary(data)[:2], header)
+        rng = np.random.default_rng(2)
+        (x0, y0, _z0), (x1, y1, _z1) = header['bbmin'], header['bbmax']
+        xs = rng.uniform(x0 - 0.05 * (x1 - x0), x1 + 0.05 * (x1 - x0), QUERY_BATCH)
+        ys = rng.uniform(y0 - 0.05 * (y1 - y0), y1 + 0.05 * (y1 - y0), QUERY_BATCH)
+        method = stage.split('_', 1)[1]
+        return (lambda: field.heights(xs, ys, 'max', method)), QUERY_BATCH * 16
+    raise ValueError(f'Unknown stage {stage}')
+
+
+def measure_imports(repeat):
+    # Cold import time of each module in a fresh interpreter (best of repeat)
+    # and which GUI-only packages the import loaded
+    code = ('import sys, time\n'
+            't = time.perf_counter()\n'
+            'import {mod}\n'
+            't = time.perf_counter() - t\n'
+            'print(t, *[int(m in sys.modules) for m in {gui!r}])')
+    out = {}
+    for mod in IMPORT_MODULES:
+        best = None
+        for _ in range(repeat):
+            proc = subprocess.run([sys.executable, '-c', code.format(mod=mod, gui=GUI_ONLY_MODULES)],
+                                  cwd=ROOT, capture_output=True, text=True, check=True)
+            fields = proc.stdout.split()
+            if best is None or float(fields[0]) < best[0]:
+                best = (float(fields[0]), fields[1:])
+        loaded = [m for m, flag in zip(GUI_ONLY_MODULES, best[1]) if flag == '1']
+        out[mod] = {'ms': best[0] * 1000, 'loads': loaded}
+        print(f"import       {mod:>15}  {best[0] * 1000:9.2f} ms  loads {', '.join(loaded) or '-'}", flush=True)
+    return out
+
+
+def _measure(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    # Separate pass for memory so tracing overhead stays out of the timings
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def run(args):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            width, height = (int(v) for v in size.lower().split('x'))
+            for stage in args.stages:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    fn, nbytes = _prepare(stage, tmp, width, height, args)
+                    seconds, peak = _measure(fn, args.repeat)
+                res = {'stage': stage, 'size': f'{width}x{height}', 'seconds': seconds,
+                       'mb_per_s': nbytes / seconds / 1e6 if seconds else None,
+                       'cells_per_s': width * height / seconds if seconds else None,
+                       'peak_bytes': peak}
+                if stage.startswith('query_'):
+                    res['queries_per_s'] = QUERY_BATCH / seconds if seconds else None
+                results.append(res)
+                print(f"{stage:<12} {res['size']:>11}  {seconds * 1000:9.2f} ms  "
+                      f"{res['mb_per_s'] or 0:9.1f} MB/s  peak {peak / 1e6:8.2f} MB"
+                      + (f"  {res['queries_per_s'] / 1e6:.2f} M queries/s" if 'queries_per_s' in res else ''),
+                      flush=True)
+    imports = measure_imports(args.repeat) if not args.skip_imports else {}
+    return {'meta': {'python': platform.python_version(), 'numpy': np.__version__,
+                     'machine': platform.machine(), 'repeat': args.repeat,
+                     'compressed': not args.uncompressed, 'endian': args.endian,
+                     'sparsity': args.sparsity},
+            'results': results,
+            'imports': imports}
+
+
+def check(report, baseline, time_tolerance, mem_tolerance):
+    # List of regression messages against a stored baseline report
+    base = {(r['stage'], r['size']): r for r in baseline['results']}
+    problems = []
+    for r in report['results']:
+        ref = base.get((r['stage'], r['size']))
+        if ref is None:
+            continue
+        if r['seconds'] > ref['seconds'] * time_tolerance:
+            problems.append(f"{r['stage']} {r['size']}: {r['seconds'] * 1000:.2f} ms > "
+                            f"{time_tolerance:g}x baseline {ref['seconds'] * 1000:.2f} ms")
+        if r['peak_bytes'] > ref['peak_bytes'] * mem_tolerance:
+            problems.append(f"{r['stage']} {r['size']}: peak {r['peak_bytes'] / 1e6:.2f} MB > "
+                            f"{mem_tolerance:g}x baseline {ref['peak_bytes'] / 1e6:.2f} MB")
+    budgets = baseline.get('import_budget_ms', {})
+    for mod, r in report.get('imports', {}).items():
+        if mod in budgets and r['ms'] > budgets[mod]:
+            problems.append(f"import {mod}: {r['ms']:.1f} ms > budget {budgets[mod]:.1f} ms")
+        if mod == 'hmap_core' and r['loads']:
+            problems.append(f"import hmap_core loads GUI-only modules: {', '.join(r['loads'])}")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Throughput and peak-memory benchmarks for the heightmap codecs')
+    parser.add_argument('--sizes', nargs='+', default=DEFAULT_SIZES, help='Grid sizes as WIDTHxHEIGHT')
+    parser.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES)
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per stage; the best is kept')
+    parser.add_argument('--uncompressed', action='store_true', help='Benchmark the uncompressed layout')
+    parser.add_argument('--endian', choices=['<', '>'], default='>')
+    parser.add_argument('--sparsity', type=float, default=0.2, help='Share of empty cells in synthetic maps')
+    parser.add_argument('--skip-imports', action='store_true', help='Do not measure module import times')
+    parser.add_argument('--json', dest='json_out', help='Write the report to this file')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--check', action='store_true', help='Fail when slower or larger than the baseline')
+    parser.add_argument('--update-baseline', action='store_true', help='Store this run as the new baseline')
+    parser.add_argument('--time-tolerance', type=float, default=2.0)
+    parser.add_argument('--mem-tolerance', type=float, default=1.5)
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    if args.json_out:
+        with open(args.json_out, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.update_baseline:
+        # Import budgets are hand-tuned limits; keep them across baseline refreshes
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                budgets = json.load(f).get('import_budget_ms')
+            if budgets:
+                report['import_budget_ms'] = budgets
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Baseline written to {args.baseline}')
+    if args.check:
+        with open(args.baseline) as f:
+            problems = check(report, json.load(f), args.time_tolerance, args.mem_tolerance)
+        for p in problems:
+            print(f'REGRESSION {p}')
+        if problems:
+            return 1
+        print('No regressions against baseline')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
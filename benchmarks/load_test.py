@@ -0,0 +1,152 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+# Share of tile, height and slice requests in the generated mix
+DEFAULT_MIX = {'tile': 0.7, 'height': 0.2, 'slice': 0.1}
+
+
+def make_urls(maps, count, mix, max_zoom, seed=0):
+    # Request targets drawn from the /maps listing: tiles at random zooms,
+    # height lookups of 64 points and 64x64 slices
+    rng = random.Random(seed)
+    kinds, weights = zip(*mix.items())
+    urls = []
+    for _ in range(count):
+        m = rng.choice(maps)
+        name, width, height = m['name'], m['width'], m['height']
+        layer = rng.choice(('max', 'min'))
+        kind = rng.choices(kinds, weights)[0]
+        if kind == 'tile':
+            z = rng.randint(0, max_zoom)
+            span = 256 >> z
+            tx, ty = rng.randrange(-(-width // span)), rng.randrange(-(-height // span))
+            urls.append(f'/maps/{name}/tile/{layer}/{z}/{tx}/{ty}.png')
+        elif kind == 'height':
+            (x0, y0, _), (x1, y1, _) = m['bbmin'], m['bbmax']
+            xs = ','.join(f'{rng.uniform(x0, x1):.2f}' for _ in range(64))
+            ys = ','.join(f'{rng.uniform(y0, y1):.2f}' for _ in range(64))
+            urls.append(f'/maps/{name}/height?layer={layer}&x={xs}&y={ys}')
+        else:
+            x, y = rng.randrange(max(width - 64, 1)), rng.randrange(max(height - 64, 1))
+            urls.append(f'/maps/{name}/slice/{layer}?x0={x}&y0={y}&x1={min(x + 64, width)}&y1={min(y + 64, height)}')
+    return urls
+
+
+async def _client(host, port, urls, latencies, errors):
+    # One keep-alive connection sending its requests back to back
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for url in urls:
+            t0 = time.perf_counter()
+            writer.write(f'GET {url} HTTP/1.1\r\nHost: {host}\r\n\r\n'.encode('latin-1'))
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b''):
+                    break
+                key, _, value = line.decode('latin-1').partition(':')
+                if key.lower() == 'content-length':
+                    length = int(value)
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - t0)
+            if status != 200:
+                errors[status] = errors.get(status, 0) + 1
+    finally:
+        writer.close()
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(int(q * len(sorted_values)), len(sorted_values) - 1)]
+
+
+async def run(host, port, urls, concurrency):
+    latencies, errors = [], {}
+    t0 = time.perf_counter()
+    await asyncio.gather(*[_client(host, port, urls[i::concurrency], latencies, errors) for i in range(concurrency)])
+    elapsed = time.perf_counter() - t0
+    latencies.sort()
+    return {'requests': len(latencies), 'concurrency': concurrency, 'seconds': elapsed,
+            'rps': len(latencies) / elapsed if elapsed else None,
+            'p50_ms': _percentile(latencies, 0.50) * 1000, 'p90_ms': _percentile(latencies, 0.90) * 1000,
+            'p99_ms': _percentile(latencies, 0.99) * 1000, 'max_ms': latencies[-1] * 1000,
+            'errors': {str(k): v for k, v in errors.items()}}
+
+
+def _wait_for(base, proc, timeout=30.0):
+    # The /maps listing once the server answers
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(base + '/maps', timeout=2) as r:
+                return json.loads(r.read())
+        except OSError:
+            if (proc is not None and proc.poll() is not None) or time.monotonic() > deadline:
+                raise SystemExit(f'Server at {base} did not come up')
+            time.sleep(0.2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test for hmap_server: requests/s and latency percentiles')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--spawn', nargs='+', metavar='DAT', help='Start hmap_server on these files for the run')
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=16, help='Parallel keep-alive connections')
+    parser.add_argument('--mix', default='tile=0.7,height=0.2,slice=0.1', help='Request mix as kind=weight,...')
+    parser.add_argument('--max-zoom', type=int, default=2)
+    parser.add_argument('--warmup', type=int, default=0, help='Untimed requests sent first to fill the tile cache')
+    parser.add_argument('--json', dest='json_out', help='Write the report to this file')
+    args = parser.parse_args(argv)
+
+    try:
+        mix = {k: float(v) for k, v in (item.split('=') for item in args.mix.split(','))}
+    except ValueError:
+        parser.error('--mix must look like tile=0.7,height=0.2,slice=0.1')
+    if not set(mix) <= set(DEFAULT_MIX):
+        parser.error(f"--mix kinds are {', '.join(DEFAULT_MIX)}")
+
+    proc = None
+    if args.spawn:
+        proc = subprocess.Popen([sys.executable, os.path.join(ROOT, 'hmap_server.py'), *args.spawn,
+                                 '--host', args.host, '--port', str(args.port)])
+    try:
+        maps = _wait_for(f'http://{args.host}:{args.port}', proc)['maps']
+        if not maps:
+            raise SystemExit('Server has no maps')
+        if args.warmup:
+            asyncio.run(run(args.host, args.port, make_urls(maps, args.warmup, mix, args.max_zoom, seed=1),
+                            args.concurrency))
+        report = asyncio.run(run(args.host, args.port, make_urls(maps, args.requests, mix, args.max_zoom),
+                                 args.concurrency))
+        with urllib.request.urlopen(f'http://{args.host}:{args.port}/maps') as r:
+            report['cache'] = json.loads(r.read())['cache']
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+    report['mix'] = mix
+    print(f"{report['requests']} requests in {report['seconds']:.2f} s  {report['rps']:.0f} req/s  "
+          f"p50 {report['p50_ms']:.2f} ms  p90 {report['p90_ms']:.2f} ms  p99 {report['p99_ms']:.2f} ms")
+    if report['errors']:
+        print(f"Errors by status: {report['errors']}")
+    if args.json_out:
+        with open(args.json_out, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 1 if report['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,558 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import hmap_core as hm
+import hmap_diff
+import hmap_mosaic
+
+# Exit codes
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_NO_INPUT = 3
+
+LAYERS = ('min', 'max')
+# Export formats and the file suffix each writes after <stem>_<layer>
+EXPORT_FORMATS = {'png': '.png', 'hex': '.txt', 'npy': '.npy', 'raw': '.raw', 'png16': '_16.png'}
+# Edited layer files looked up by repack / mkpatch, exact formats first
+EDIT_SUFFIXES = ('.npy', '.raw', '_16.png', '.png')
+PATCH_EXT = '.hmpt'
+
+
+def _stem(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def _collect(paths, exts):
+    # Expand directories into the files they contain with a matching extension
+    files = []
+    for p in paths:
+        if os.path.isdir(p):
+            for name in sorted(os.listdir(p)):
+                if name.lower().endswith(exts):
+                    files.append(os.path.join(p, name))
+        else:
+            files.append(p)
+    return files
+
+
+def _export_one(path, out_dir, layers, formats):
+    max_arr, min_arr, w, h = hm.parse_dat_file(path)
+    arrays = {'min': min_arr, 'max': max_arr}
+    outputs = []
+    for which in layers:
+        base = os.path.join(out_dir, f'{_stem(path)}_{which}')
+        if 'png' in formats:
+            img = hm._preview_image(arrays[which])
+            with hm._tracer.span('png write'):
+                img.save(base + '.png')
+            outputs.append(base + '.png')
+        if 'hex' in formats:
+            hm._save_array_as_hex(arrays[which], base + '.txt')
+            outputs.append(base + '.txt')
+        for fmt in ('npy', 'raw', 'png16'):
+            if fmt in formats:
+                hm.save_layer(arrays[which], base + EXPORT_FORMATS[fmt])
+                outputs.append(base + EXPORT_FORMATS[fmt])
+    return outputs
+
+
+def _find_edit(edits_dir, stem, which):
+    # First edited file for a layer, or None
+    for suffix in EDIT_SUFFIXES:
+        path = os.path.join(edits_dir, f'{stem}_{which}{suffix}')
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _hex2png_one(path, out_dir, width, scale):
+    out = os.path.join(out_dir, _stem(path) + '.png')
+    hm.hex_to_png(path, out, width_override=width, scale=scale)
+    return [out]
+
+
+def _png2hex_one(path, out_dir, leading_spaces, uppercase):
+    out = os.path.join(out_dir, _stem(path) + '.txt')
+    hm.png_to_hex(path, out, leading_spaces=leading_spaces, uppercase=uppercase)
+    return [out]
+
+
+def _repack_one(path, out_dir, edits_dir, apply_inverse, rebuild=False, endian=None):
+    # Apply <stem>_min.png / <stem>_max.png from edits_dir to a copy of the .dat.
+    # rebuild re-encodes the layout (optionally in another byte order).
+    with open(path, 'rb') as f:
+        data = f.read()
+    layout = hm.HmapLayout(data)
+    shape = (layout.height, layout.width)
+    layout.release()
+    applied = []
+    for which in LAYERS:
+        png = _find_edit(edits_dir, _stem(path), which)
+        if png:
+            arr = hm._load_edited_png(png, apply_inverse, shape)
+            if rebuild:
+                data = hm._rebuild_hmap_binary(data, arr, which, endian=endian)
+            else:
+                data = hm._update_hmap_binary(data, arr, which)
+            applied.append(which)
+    if not applied:
+        raise ValueError(f'No edited layers for {_stem(path)} in {edits_dir}')
+    out = os.path.join(out_dir, os.path.basename(path))
+    if os.path.exists(out) and os.path.samefile(out, path):
+        raise ValueError('Refusing to overwrite the input .dat; choose another --out directory')
+    with open(out, 'wb') as f:
+        f.write(data)
+    return [out]
+
+
+def _mkpatch_one(path, out_dir, edits_dir, target_dir, apply_inverse):
+    # Patch from <stem>.dat to its edited version: <stem>.dat in target_dir, or
+    # <stem>_min.png / <stem>_max.png in edits_dir
+    max_arr, min_arr, _w, _h = hm.parse_dat_file(path)
+    old = {'max': max_arr, 'min': min_arr}
+    if target_dir:
+        new_max, new_min, _w, _h = hm.parse_dat_file(os.path.join(target_dir, os.path.basename(path)))
+        new = {'max': new_max, 'min': new_min}
+    else:
+        new = {}
+        for which in LAYERS:
+            png = _find_edit(edits_dir, _stem(path), which)
+            if png:
+                new[which] = hm._load_edited_png(png, apply_inverse, max_arr.shape)
+        if not new:
+            raise ValueError(f'No edited layers for {_stem(path)} in {edits_dir}')
+    out = os.path.join(out_dir, _stem(path) + PATCH_EXT)
+    with open(out, 'wb') as f:
+        f.write(hm.make_patch(old, new))
+    return [out]
+
+
+def _applypatch_one(path, out_dir, patch_dir, force, rebuild=False):
+    # Apply <stem>.hmpt from patch_dir; without out_dir the .dat is patched in place.
+    # rebuild re-encodes the file instead of writing into its row spans.
+    with open(os.path.join(patch_dir, _stem(path) + PATCH_EXT), 'rb') as f:
+        patch = hm.HmapPatch(f.read())
+    if out_dir is None and not rebuild:
+        hm._apply_patch_file_inplace(path, patch, force)
+        return [path]
+    out = path if out_dir is None else os.path.join(out_dir, os.path.basename(path))
+    if out_dir is not None and os.path.exists(out) and os.path.samefile(out, path):
+        raise ValueError('Refusing to overwrite the input .dat; use --in-place')
+    with open(path, 'rb') as f:
+        data = f.read()
+    apply = hm._apply_patch_rebuild if rebuild else hm._apply_patch_binary
+    data = apply(data, patch, force)
+    tmp = out + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, out)
+    return [out]
+
+
+def _patchinfo(files, as_json):
+    # Print a summary of each patch file; not worth a process pool
+    status = EXIT_OK
+    for path in files:
+        try:
+            with open(path, 'rb') as f:
+                info = hm.HmapPatch(f.read()).info()
+        except (OSError, ValueError) as e:
+            status = EXIT_FAILED
+            info = {'error': f'{type(e).__name__}: {e}'}
+        info = {'path': path, 'bytes': os.path.getsize(path) if os.path.exists(path) else None, **info}
+        if as_json:
+            print(json.dumps(info), flush=True)
+        elif 'error' in info:
+            print(f"FAIL  {path}  {info['error']}", flush=True)
+        else:
+            print(f"{path}  {info['width']}x{info['height']}  {info['cells']} cells in {info['runs']} runs, "
+                  f"{info['bytes']} bytes", flush=True)
+            for which, st in info['layers'].items():
+                print(f"      {which}: {st['cells']} cells in {st['runs']} runs, bbox {st['bbox']}", flush=True)
+    return status
+
+
+def _mosaic(args):
+    files = _collect(args.inputs, ('.dat',))
+    if not files:
+        print('No input files found', file=sys.stderr)
+        return EXIT_NO_INPUT
+    if args.jobs is not None and args.jobs < 1:
+        print('--jobs must be at least 1', file=sys.stderr)
+        return EXIT_USAGE
+    if os.path.dirname(args.out):
+        os.makedirs(os.path.dirname(args.out), exist_ok=True)
+
+    def progress(path, done, total):
+        if not args.json:
+            print(f'{done}/{total}  {path}', flush=True)
+
+    t0 = time.perf_counter()
+    try:
+        desc = hmap_mosaic.build_mosaic(files, args.out, overlap=args.overlap, cell=args.cell, jobs=args.jobs,
+                                        write_hmap=args.hmap, progress=progress)
+    except (OSError, ValueError) as e:
+        print(f'Mosaic failed: {type(e).__name__}: {e}', file=sys.stderr)
+        return EXIT_FAILED
+    seconds = time.perf_counter() - t0
+    if args.json:
+        print(json.dumps(dict(desc, seconds=seconds)), flush=True)
+    else:
+        print(f"{len(files)} tiles -> {desc['width']}x{desc['height']} grid, cell {desc['cell'][0]:g} x "
+              f"{desc['cell'][1]:g}, written to {args.out}.json in {seconds:.2f} s")
+    return EXIT_OK
+
+
+def _diff(args):
+    if not os.path.isfile(args.baseline):
+        print(f'Baseline {args.baseline} not found', file=sys.stderr)
+        return EXIT_NO_INPUT
+    # A directory of variants may hold the baseline too
+    files = [f for f in _collect(args.inputs, ('.dat',)) if os.path.abspath(f) != os.path.abspath(args.baseline)]
+    if not files:
+        print('No input files found', file=sys.stderr)
+        return EXIT_NO_INPUT
+    if args.jobs is not None and args.jobs < 1:
+        print('--jobs must be at least 1', file=sys.stderr)
+        return EXIT_USAGE
+    if args.heatmaps:
+        os.makedirs(args.heatmaps, exist_ok=True)
+
+    def progress(res, done, total):
+        if args.json:
+            print(json.dumps(res), flush=True)
+        elif not res['ok']:
+            print(f"FAIL  {res['path']}  {res['error']}", flush=True)
+        elif res['identical']:
+            print(f"SAME  {res['path']}", flush=True)
+        else:
+            layers = '  '.join(f"{which} {st['changed_cells']} cells (+{st['raised_cells']}/-{st['lowered_cells']}) "
+                               f"bbox {st['bbox']}" for which, st in res['layers'].items())
+            header = f"  header: {', '.join(res['header_changes'])}" if res['header_changes'] else ''
+            print(f"DIFF  {res['path']}  {res['rows_compared']}/{res['rows_hashed']} rows  {layers}{header}",
+                  flush=True)
+
+    t0 = time.perf_counter()
+    try:
+        results = hmap_diff.diff_many(args.baseline, files, heatmap_dir=args.heatmaps, heatmap_layer=args.layer,
+                                      jobs=args.jobs, progress=progress)
+    except (OSError, ValueError) as e:
+        print(f'Diff failed: {type(e).__name__}: {e}', file=sys.stderr)
+        return EXIT_FAILED
+    failed = sum(1 for r in results if not r['ok'])
+    summary = {'files': len(results), 'identical': sum(1 for r in results if r.get('identical')),
+               'failed': failed, 'seconds': time.perf_counter() - t0}
+    if args.json:
+        print(json.dumps({'summary': summary}), flush=True)
+    else:
+        print(f"{summary['files']} variants: {summary['files'] - summary['identical'] - failed} differ, "
+              f"{summary['identical']} identical, {failed} failed in {summary['seconds']:.2f} s")
+    return EXIT_FAILED if failed else EXIT_OK
+
+
+def _file_state(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def _watch_apply(out, which, png, applied, apply_inverse):
+    # Import one edited PNG and write only the rows that differ from the last import
+    t0 = time.perf_counter()
+    arr = hm._load_edited_png(png, apply_inverse, applied[which].shape)
+    rows = np.flatnonzero((arr != applied[which]).any(axis=1))
+    rebuilt = False
+    try:
+        written = hm._update_hmap_file_inplace(out, arr, which, rows) if len(rows) else 0
+    except hm.SharedSpanError:
+        # Rows that share bytes were edited apart; only a re-encoded layout holds that
+        with open(out, 'rb') as f:
+            data = hm._rebuild_hmap_binary(f.read(), arr, which)
+        tmp = out + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, out)
+        written, rebuilt = len(data), True
+    applied[which] = arr
+    return {'layer': which, 'png': png, 'ok': True, 'rows': len(rows), 'bytes': written, 'rebuilt': rebuilt,
+            'seconds': time.perf_counter() - t0}
+
+
+def _watch_report(res, as_json):
+    if as_json:
+        print(json.dumps(res), flush=True)
+    elif res['ok']:
+        latency = f", {res['latency'] * 1000:.0f} ms after save" if 'latency' in res else ''
+        how = 'rebuilt file' if res.get('rebuilt') else 'written'
+        print(f"{time.strftime('%H:%M:%S')}  {res['layer']}: {res['rows']} rows changed, {res['bytes']} bytes "
+              f"{how} in {res['seconds'] * 1000:.1f} ms{latency}", flush=True)
+    else:
+        print(f"{time.strftime('%H:%M:%S')}  {res['layer']}: FAIL {res['error']}", flush=True)
+
+
+def _watch(args):
+    # Poll the edited PNGs and re-apply each burst of saves once it has settled
+    if not os.path.exists(args.dat):
+        print(f'{args.dat} not found', file=sys.stderr)
+        return EXIT_NO_INPUT
+    if args.interval <= 0 or args.debounce < 0:
+        print('--interval must be positive and --debounce not negative', file=sys.stderr)
+        return EXIT_USAGE
+    edits = args.edits or os.path.dirname(os.path.abspath(args.dat))
+    pngs = {'min': args.min or os.path.join(edits, f'{_stem(args.dat)}_min.png'),
+            'max': args.max or os.path.join(edits, f'{_stem(args.dat)}_max.png')}
+    try:
+        if not (os.path.exists(args.out) and os.path.samefile(args.out, args.dat)):
+            if os.path.dirname(args.out):
+                os.makedirs(os.path.dirname(args.out), exist_ok=True)
+            shutil.copyfile(args.dat, args.out)
+        max_arr, min_arr, _w, _h = hm.parse_dat_file(args.out)
+    except (OSError, ValueError) as e:
+        print(f'Watch failed: {type(e).__name__}: {e}', file=sys.stderr)
+        return EXIT_FAILED
+    applied = {'max': max_arr, 'min': min_arr}
+    apply_inverse = not args.no_inverse
+
+    def apply(which, state):
+        try:
+            res = _watch_apply(args.out, which, pngs[which], applied, apply_inverse)
+            res['latency'] = time.time() - state[0] / 1e9
+        except Exception as e:
+            res = {'layer': which, 'png': pngs[which], 'ok': False, 'error': f'{type(e).__name__}: {e}'}
+        _watch_report(res, args.json)
+        return res['ok']
+
+    if args.once:
+        states = {w: _file_state(p) for w, p in pngs.items()}
+        if not any(states.values()):
+            print('No edited PNGs found', file=sys.stderr)
+            return EXIT_NO_INPUT
+        ok = [apply(w, st) for w, st in states.items() if st]
+        return EXIT_OK if all(ok) else EXIT_FAILED
+
+    # handled: file state last applied; current/changed_at: last state seen and when it changed
+    handled = {w: None for w in pngs}
+    current = {w: _file_state(p) for w, p in pngs.items()}
+    changed_at = {w: 0.0 for w in pngs}
+    if not args.json:
+        print(f"Watching {pngs['min']} and {pngs['max']} -> {args.out} (Ctrl+C to stop)", flush=True)
+    try:
+        while True:
+            now = time.monotonic()
+            for which, png in pngs.items():
+                state = _file_state(png)
+                if state != current[which]:
+                    current[which] = state
+                    changed_at[which] = now
+                if state is not None and state != handled[which] and now - changed_at[which] >= args.debounce:
+                    # A failed import (e.g. a half-written file) waits for the next save
+                    handled[which] = state
+                    apply(which, state)
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    return EXIT_OK
+
+
+def _run_task(func, path, args):
+    # Worker entry point; never raises so one bad file cannot stop the batch
+    t0 = time.perf_counter()
+    mark = hm._tracer.mark()
+    try:
+        outputs = func(path, *args)
+        res = {'path': path, 'ok': True, 'seconds': time.perf_counter() - t0, 'outputs': outputs}
+        if hm._tracer.enabled:
+            res['stages'] = hm._tracer.summary(mark)
+        return res
+    except Exception as e:
+        return {'path': path, 'ok': False, 'seconds': time.perf_counter() - t0, 'error': f'{type(e).__name__}: {e}'}
+
+
+def _report(res, as_json):
+    if as_json:
+        print(json.dumps(res), flush=True)
+    elif res['ok']:
+        print(f"OK    {res['path']}  {res['seconds'] * 1000:.1f} ms  -> {', '.join(res['outputs'])}", flush=True)
+        if 'stages' in res:
+            stages = sorted(res['stages'].items(), key=lambda kv: -kv[1]['total_ms'])
+            print('      ' + ', '.join(f"{name} {st['total_ms']:.1f} ms" for name, st in stages), flush=True)
+    else:
+        print(f"FAIL  {res['path']}  {res['seconds'] * 1000:.1f} ms  {res['error']}", flush=True)
+
+
+def run_batch(func, files, args, jobs=None, as_json=False):
+    # Run func over files on a process pool, reporting each result as it completes
+    jobs = jobs or os.cpu_count() or 1
+    results = []
+    t0 = time.perf_counter()
+    if jobs == 1 or len(files) == 1:
+        for path in files:
+            res = _run_task(func, path, args)
+            _report(res, as_json)
+            results.append(res)
+    else:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(files))) as pool:
+            futures = [pool.submit(_run_task, func, path, args) for path in files]
+            for fut in as_completed(futures):
+                res = fut.result()
+                _report(res, as_json)
+                results.append(res)
+    failed = sum(1 for r in results if not r['ok'])
+    summary = {'files': len(results), 'ok': len(results) - failed, 'failed': failed,
+               'seconds': time.perf_counter() - t0}
+    if as_json:
+        print(json.dumps({'summary': summary}), flush=True)
+    else:
+        print(f"{summary['ok']}/{summary['files']} succeeded, {failed} failed in {summary['seconds']:.2f} s")
+    return EXIT_FAILED if failed else EXIT_OK
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Headless batch tools for GTAV heightmap files')
+    parser.add_argument('-v', '--verbose', action='count', default=0, help='Log info messages (-vv: debug)')
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('inputs', nargs='+', help='Files or directories to process')
+    common.add_argument('-o', '--out', help='Output directory (required unless noted)')
+    common.add_argument('-j', '--jobs', type=int, default=None, help='Worker processes (default: CPU count)')
+    common.add_argument('--json', action='store_true', help='Print one JSON object per result')
+    common.add_argument('--trace', action='store_true', help='Report per-stage timings for every file')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('export', parents=[common], help='Export Min/Max layers of .dat files')
+    p.add_argument('--layers', default='min,max', help='Comma separated layers (default: min,max)')
+    p.add_argument('--format', default='png,hex', help='Comma separated formats: png, hex, npy, raw, png16 (default: png,hex)')
+
+    p = sub.add_parser('hex2png', parents=[common], help='Convert HEX text files to PNG')
+    p.add_argument('--width', type=int, default=None, help='Row width (default: values on the first line)')
+    p.add_argument('--scale', type=int, default=1, help='Nearest-neighbour upscale factor')
+
+    p = sub.add_parser('png2hex', parents=[common], help='Convert PNG files to HEX text')
+    p.add_argument('--no-leading-spaces', action='store_true', help='Do not indent rows')
+    p.add_argument('--lowercase', action='store_true', help='Write lowercase hex digits')
+
+    p = sub.add_parser('repack', parents=[common], help='Apply edited PNGs to copies of .dat files')
+    p.add_argument('--edits', required=True, help='Directory holding <stem>_min / <stem>_max as .npy, .raw, _16.png or .png')
+    p.add_argument('--no-inverse', action='store_true', help='Edited PNGs are already in raw orientation')
+    p.add_argument('--rebuild', action='store_true', help='Re-encode the layout so edits outside the old row spans are kept')
+    p.add_argument('--byte-order', choices=['big', 'little'], default=None,
+                   help='Byte order of rebuilt files (default: same as input)')
+
+    p = sub.add_parser('mkpatch', parents=[common], help='Write compact .hmpt patches of the changes to .dat files')
+    src = p.add_mutually_exclusive_group(required=True)
+    src.add_argument('--edits', help='Directory holding <stem>_min / <stem>_max as .npy, .raw, _16.png or .png')
+    src.add_argument('--target', help='Directory holding the edited <stem>.dat files')
+    p.add_argument('--no-inverse', action='store_true', help='Edited PNGs are already in raw orientation')
+
+    p = sub.add_parser('applypatch', parents=[common], help='Apply .hmpt patches to .dat files')
+    p.add_argument('--patches', required=True, help='Directory holding <stem>.hmpt')
+    p.add_argument('--in-place', action='store_true', help='Patch the input files instead of writing to --out')
+    p.add_argument('--force', action='store_true', help='Apply even if cells no longer hold the patch source values')
+    p.add_argument('--rebuild', action='store_true',
+                   help='Re-encode the layout, for patches outside the row spans or into bytes rows share')
+
+    p = sub.add_parser('mosaic', help='Place georeferenced .dat tiles on one world grid')
+    p.add_argument('inputs', nargs='+', help='Tiles or directories')
+    p.add_argument('-o', '--out', required=True,
+                   help='Output prefix; writes <out>_max.npy, <out>_min.npy and <out>.json')
+    p.add_argument('-j', '--jobs', type=int, default=None, help='Worker processes (default: CPU count)')
+    p.add_argument('--overlap', choices=hmap_mosaic.OVERLAPS, default='max', help='Height kept where tiles overlap')
+    p.add_argument('--cell', type=float, default=None, help='Grid cell size in world units (default: finest tile)')
+    p.add_argument('--hmap', action='store_true', help='Also write the mosaic as <out>.dat')
+    p.add_argument('--json', action='store_true', help='Print the mosaic description as JSON')
+
+    p = sub.add_parser('diff', help='Compare .dat variants against a baseline')
+    p.add_argument('baseline', help='Baseline .dat')
+    p.add_argument('inputs', nargs='+', help='Variant .dat files or directories')
+    p.add_argument('-j', '--jobs', type=int, default=None, help='Worker processes (default: CPU count)')
+    p.add_argument('--heatmaps', default=None, help='Directory for <stem>_diff.png heatmaps')
+    p.add_argument('--layer', choices=hmap_diff.LAYERS, default='max', help='Layer drawn in the heatmaps')
+    p.add_argument('--json', action='store_true', help='Print one JSON object per variant')
+
+    p = sub.add_parser('watch', help='Re-apply edited PNGs to a .dat whenever they are saved')
+    p.add_argument('dat', help='Source .dat')
+    p.add_argument('-o', '--out', required=True, help='.dat to keep updated (may be the source itself)')
+    p.add_argument('--edits', default=None, help='Directory holding <stem>_min.png / <stem>_max.png (default: next to the .dat)')
+    p.add_argument('--min', default=None, help='Edited Min PNG (overrides --edits)')
+    p.add_argument('--max', default=None, help='Edited Max PNG (overrides --edits)')
+    p.add_argument('--no-inverse', action='store_true', help='Edited PNGs are already in raw orientation')
+    p.add_argument('--interval', type=float, default=0.1, help='Seconds between polls (default: 0.1)')
+    p.add_argument('--debounce', type=float, default=0.3, help='Quiet time after a save before applying (default: 0.3)')
+    p.add_argument('--once', action='store_true', help='Apply the current PNGs once and exit')
+    p.add_argument('--json', action='store_true', help='Print one JSON object per update')
+
+    p = sub.add_parser('patchinfo', help='Summarize .hmpt patch files')
+    p.add_argument('inputs', nargs='+', help='Patch files or directories')
+    p.add_argument('--json', action='store_true', help='Print one JSON object per patch')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    hm._setup_logging(args.verbose)
+    if args.command == 'mosaic':
+        return _mosaic(args)
+    if args.command == 'watch':
+        return _watch(args)
+    if args.command == 'diff':
+        return _diff(args)
+    if args.command == 'patchinfo':
+        files = _collect(args.inputs, (PATCH_EXT,))
+        if not files:
+            print('No input files found', file=sys.stderr)
+            return EXIT_NO_INPUT
+        return _patchinfo(files, args.json)
+    in_place = args.command == 'applypatch' and args.in_place
+    if in_place == bool(args.out):
+        print('--in-place and --out are mutually exclusive' if in_place else '--out is required', file=sys.stderr)
+        return EXIT_USAGE
+    if args.jobs is not None and args.jobs < 1:
+        print('--jobs must be at least 1', file=sys.stderr)
+        return EXIT_USAGE
+    if args.trace:
+        # Inherited by spawned workers, which enable tracing on import
+        os.environ['HMAP_TRACE'] = '1'
+        hm._tracer.enable()
+
+    if args.command == 'export':
+        layers = [l for l in args.layers.split(',') if l]
+        formats = [f for f in args.format.split(',') if f]
+        if not layers or set(layers) - set(LAYERS) or not formats or set(formats) - set(EXPORT_FORMATS):
+            print('Invalid --layers or --format', file=sys.stderr)
+            return EXIT_USAGE
+        func, exts, task_args = _export_one, ('.dat',), (args.out, layers, formats)
+    elif args.command == 'hex2png':
+        func, exts, task_args = _hex2png_one, ('.txt', '.hex'), (args.out, args.width, args.scale)
+    elif args.command == 'png2hex':
+        func, exts, task_args = _png2hex_one, ('.png',), (args.out, not args.no_leading_spaces, not args.lowercase)
+    elif args.command == 'mkpatch':
+        func, exts, task_args = _mkpatch_one, ('.dat',), (args.out, args.edits, args.target, not args.no_inverse)
+    elif args.command == 'applypatch':
+        func, exts, task_args = _applypatch_one, ('.dat',), (args.out, args.patches, args.force, args.rebuild)
+    else:
+        if args.byte_order and not args.rebuild:
+            print('--byte-order requires --rebuild', file=sys.stderr)
+            return EXIT_USAGE
+        endian = {'big': '>', 'little': '<', None: None}[args.byte_order]
+        func, exts, task_args = _repack_one, ('.dat',), (args.out, args.edits, not args.no_inverse, args.rebuild, endian)
+
+    files = _collect(args.inputs, exts)
+    if not files:
+        print('No input files found', file=sys.stderr)
+        return EXIT_NO_INPUT
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+    return run_batch(func, files, task_args, jobs=args.jobs, as_json=args.json)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,230 +1,140 @@
-import re
 import os
+import time
+import threading
 import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image, ImageTk
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-import zlib
-
-# GTAV Heightmap dimensions
-WIDTH = 183
-HEIGHT = 249
-
-
-def parse_hex_file(path, forced_width=None):
-    with open(path, "r") as f:
-        raw = f.read()
-    tokens = [t for t in re.split(r'[\s,;:]+', raw) if t]
-    try:
-        values = [int(t, 16) for t in tokens]
-    except ValueError:
-        raise ValueError("File contains non-hex tokens")
-
-    if forced_width:
-        width = int(forced_width)
-    else:
-        width = WIDTH
-
-    if width <= 0:
-        raise ValueError("Could not determine width")
-
-    if len(values) % width != 0:
-        height = len(values) // width
-        values = values[: height * width]
-    else:
-        height = len(values) // width
-
-    arr = np.array(values, dtype=np.uint8).reshape((height, width))
-    return arr
-
-
-def parse_dat_file(path):
-    print(f"[parse_dat_file] Reading: {path}")
-    with open(path, 'rb') as f:
-        raw = f.read()
-    if len(raw) >= 4 and raw[:4] == b'HMAP':
-        print('[parse_dat_file] Detected HMAP binary format')
-        return _parse_hmap_binary(raw)
-    raise ValueError('Unsupported file format: expected HMAP .dat')
-
-    raise RuntimeError('Unexpected state')
-
-
-def _parse_hmap_binary(data: bytes):
-    # Parse GTA V Heightmap HMAP binary
-    import struct
-    off = 0
-    if len(data) < 32:
-        raise ValueError('HMAP file too small to contain header')
-    magic_bytes = data[off:off+4]; off += 4
-    if magic_bytes != b'HMAP':
-        raise ValueError('Not an HMAP file')
-    little_val = int.from_bytes(magic_bytes, byteorder='little')
-    magic_const = 0x484D4150
-    is_little = (little_val == magic_const)
-    endian_prefix = '<' if is_little else '>'
-    if off + 2 > len(data):
-        raise ValueError('Corrupt HMAP: missing version bytes')
-    verMajor = data[off]; verMinor = data[off+1]; off += 2
-    if off + 2 > len(data):
-        raise ValueError('Corrupt HMAP: missing pad')
-    pad = struct.unpack(endian_prefix + 'H', data[off:off+2])[0]; off += 2
-    if off + 4 > len(data):
-        raise ValueError('Corrupt HMAP: missing compressed flag')
-    compressed = struct.unpack(endian_prefix + 'I', data[off:off+4])[0]; off += 4
-    if off + 4 > len(data):
-        raise ValueError('Corrupt HMAP: missing width/height')
-    width = struct.unpack(endian_prefix + 'H', data[off:off+2])[0]; off += 2
-    height = struct.unpack(endian_prefix + 'H', data[off:off+2])[0]; off += 2
-    if off + 24 > len(data):
-        raise ValueError('Corrupt HMAP: missing BBMin/BBMax vectors')
-    bbmin = struct.unpack(endian_prefix + 'fff', data[off:off+12]); off += 12
-    bbmax = struct.unpack(endian_prefix + 'fff', data[off:off+12]); off += 12
-    if off + 4 > len(data):
-        raise ValueError('Corrupt HMAP: missing data length')
-    length = struct.unpack(endian_prefix + 'I', data[off:off+4])[0]; off += 4
-
-    # Read comp headers if compressed
-    comp_headers = []
-    if compressed > 0:
-        needed = height * 8
-        if off + needed > len(data):
-            raise ValueError('Corrupt HMAP: not enough bytes for compression headers')
-        for _ in range(height):
-            start = struct.unpack(endian_prefix + 'H', data[off:off+2])[0]; off += 2
-            count = struct.unpack(endian_prefix + 'H', data[off:off+2])[0]; off += 2
-            data_offset = struct.unpack(endian_prefix + 'i', data[off:off+4])[0]; off += 4
-            comp_headers.append((start, count, data_offset))
-
-    # Read data blob of indicated length minus headers
-    dlen = length
-    remaining = len(data) - off
-    if dlen > remaining:
-        print(f"[HMAP] Length {dlen} exceeds remaining {remaining}; clamping")
-        dlen = remaining
-    blob = data[off:off+dlen]
-
-    max_arr = np.zeros((height, width), dtype=np.uint8)
-    min_arr = np.zeros((height, width), dtype=np.uint8)
-
-    if compressed > 0:
-        h2off = dlen // 2
-        for y in range(height):
-            start, count, data_offset = comp_headers[y]
-            for i in range(count):
-                x = start + i
-                o = data_offset + x
-                if 0 <= o < dlen and 0 <= (o + h2off) < dlen:
-                    max_arr[y, x] = blob[o]
-                    min_arr[y, x] = blob[o + h2off]
-    else:
-        flat_len = width * height
-        if len(blob) >= flat_len:
-            max_arr = np.frombuffer(blob[:flat_len], dtype=np.uint8).reshape((height, width))
-        if len(blob) >= 2 * flat_len:
-            min_arr = np.frombuffer(blob[flat_len:flat_len*2], dtype=np.uint8).reshape((height, width))
-
-    return max_arr, min_arr, width, height
-
-
-def _update_hmap_binary(data: bytes, new_arr: np.ndarray, which: str):
-    # Replace either Max or Min array in existing HMAP blob
-    import struct
-    if data[:4] != b'HMAP':
-        raise ValueError('Not an HMAP file')
-    little_val = int.from_bytes(data[:4], 'little')
-    magic_const = 0x484D4150
-    is_little = (little_val == magic_const)
-    endian = '<' if is_little else '>'
-    off = 4
-    verMajor = data[off]; verMinor = data[off+1]; off += 2
-    pad = struct.unpack(endian + 'H', data[off:off+2])[0]; off += 2
-    compressed = struct.unpack(endian + 'I', data[off:off+4])[0]; off += 4
-    width = struct.unpack(endian + 'H', data[off:off+2])[0]; off += 2
-    height = struct.unpack(endian + 'H', data[off:off+2])[0]; off += 2
-    bbmin = struct.unpack(endian + 'fff', data[off:off+12]); off += 12
-    bbmax = struct.unpack(endian + 'fff', data[off:off+12]); off += 12
-    length = struct.unpack(endian + 'I', data[off:off+4])[0]; off += 4
-
-    if new_arr.shape != (height, width):
-        raise ValueError(f'Edited image must be {width}x{height}')
-    new_arr = np.array(new_arr, dtype=np.uint8)
-
-    comp_headers = []
-    comp_headers_off = off
-    if compressed > 0:
-        for _ in range(height):
-            start = struct.unpack(endian + 'H', data[off:off+2])[0]; off += 2
-            count = struct.unpack(endian + 'H', data[off:off+2])[0]; off += 2
-            data_offset = struct.unpack(endian + 'i', data[off:off+4])[0]; off += 4
-            comp_headers.append((start, count, data_offset))
-
-    blob_off = off
-    dlen = length
-    remaining = len(data) - blob_off
-    if dlen > remaining:
-        dlen = remaining
-    blob = bytearray(data[blob_off:blob_off+dlen])
-
-    if compressed > 0:
-        half = dlen // 2
-        for y in range(height):
-            start, count, data_offset = comp_headers[y]
-            for i in range(count):
-                x = start + i
-                o = data_offset + x
-                if 0 <= o < dlen and 0 <= (o + half) < dlen:
-                    val = int(new_arr[y, x])
-                    if which == 'max':
-                        blob[o] = val
-                    else:
-                        blob[o + half] = val
-    else:
-        flat_len = width * height
-        if which == 'max':
-            blob[:flat_len] = new_arr.astype(np.uint8).tobytes()
-        else:
-            blob[flat_len:flat_len*2] = new_arr.astype(np.uint8).tobytes()
-
-    # Reassemble file
-    new_data = bytearray(data)
-    new_data[blob_off:blob_off+dlen] = blob[:dlen]
-    return bytes(new_data)
-
-
-def _normalize_to_uint8(arr):
-    a = arr.astype(np.float32)
-    mn = float(a.min())
-    mx = float(a.max())
-    if mx <= mn:
-        return (a * 0).astype(np.uint8)
-    out = ((a - mn) / (mx - mn) * 255.0).astype(np.uint8)
-    return out
-
-
-def hex_to_png(in_path, out_path, width_override=None, scale=1):
-    # always use fixed width
-    arr = parse_hex_file(in_path, width_override or WIDTH)
-    img = Image.fromarray(arr, mode='L')
-    if scale and int(scale) > 1:
-        img = img.resize((img.width * int(scale), img.height * int(scale)), Image.NEAREST)
-    img.save(out_path)
 
+# Codecs live in hmap_core; the old names stay importable from here for existing scripts
+from hmap_core import (
+    WIDTH, HEIGHT, HmapLayout, HmapReader, DecodeCache, log, _tracer, _decode_cache,
+    parse_hex_file, parse_dat_file, hex_to_png, png_to_hex, _parse_hmap_binary,
+    _update_hmap_binary, _update_hmap_file_inplace, _rebuild_hmap_binary, _encode_hmap,
+    _normalize_to_uint8, _save_array_as_hex, _write_png, _preview_image, _load_edited_png,
+    _normalize_lut, BRUSH_MODES, brush_dab, _undo_box, EditHistory, make_patch, _apply_patch_binary,
+    _apply_patch_file_inplace, save_layer,
+)
+
+# Open dialogs for edited layers accept every format load_layer reads
+EDITED_LAYER_TYPES = [('Edited layer', '*.png;*.npy;*.raw'), ('PNG', '*.png'), ('NumPy', '*.npy'), ('Raw bytes', '*.raw')]
+
+# Preview zoom levels larger than this many pixels are rendered viewport-only
+PREVIEW_FULL_PIXELS = 4_000_000
+# Memoized full-size preview images kept across zoom changes
+PREVIEW_CACHE_LEVELS = 6
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+class _Task:
+    # Handle passed to background work for cooperative cancellation and progress
+    __slots__ = ('label', 'message', 'started', 'trace_mark', '_cancel')
+
+    def __init__(self, label):
+        self.label = label
+        self.message = ''
+        self.started = time.perf_counter()
+        self.trace_mark = _tracer.mark()
+        self._cancel = threading.Event()
+
+    def progress(self, message):
+        self.message = message
+
+    def check(self):
+        if self._cancel.is_set():
+            raise TaskCancelled()
+
+    def cancel(self):
+        self._cancel.set()
+
+
+class _TaskRunner:
+    # Runs blocking work on a thread pool and hands results back on the Tk loop.
+    # Each task has a key; submitting a key that is still running is refused.
+    POLL_MS = 50
+
+    def __init__(self, root, status, workers=2):
+        self._root = root
+        self._status = status
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='hmap-task')
+        self._active = {}
+        self._polling = False
+
+    def busy(self, key):
+        return key in self._active
+
+    def submit(self, key, label, fn, on_done=None, on_error=None):
+        # fn(task) runs on a worker; on_done(result) / on_error(exc) run on the Tk thread
+        if key in self._active:
+            self._status.config(text=f'{self._active[key][0].label} is already running')
+            return False
+        task = _Task(label)
+        self._active[key] = (task, self._pool.submit(fn, task), on_done, on_error)
+        self._show()
+        if not self._polling:
+            self._polling = True
+            self._root.after(self.POLL_MS, self._poll)
+        return True
+
+    def cancel_all(self):
+        for task, fut, _done, _err in self._active.values():
+            task.cancel()
+            fut.cancel()
+
+    def shutdown(self):
+        self.cancel_all()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _poll(self):
+        try:
+            for key, (task, fut, on_done, on_error) in list(self._active.items()):
+                if fut.done():
+                    del self._active[key]
+                    self._finish(task, fut, on_done, on_error)
+        finally:
+            if self._active:
+                self._show()
+                self._root.after(self.POLL_MS, self._poll)
+            else:
+                self._polling = False
+
+    def _finish(self, task, fut, on_done, on_error):
+        exc = None if fut.cancelled() else fut.exception()
+        if fut.cancelled() or isinstance(exc, TaskCancelled):
+            self._status.config(text=f'{task.label} cancelled')
+        elif exc is not None:
+            self._status.config(text=f'{task.label} failed')
+            if on_error:
+                on_error(exc)
+            else:
+                messagebox.showerror(f'{task.label} failed', str(exc))
+        else:
+            self._status.config(text=f'{task.label} done')
+            if on_done:
+                on_done(fut.result())
+            if _tracer.enabled:
+                # Stage breakdown of this operation, including its Tk-side work
+                text = self._status.cget('text')
+                self._status.config(text=f'{text} | {_tracer.breakdown(task.trace_mark)}')
 
-def png_to_hex(in_path, out_path, width_override=None, height_override=None, scale=1, leading_spaces=True, uppercase=True):
-    img = Image.open(in_path).convert('L')
-    img = img.resize((WIDTH, HEIGHT), Image.Resampling.BICUBIC)
+    def _show(self):
+        now = time.perf_counter()
+        parts = []
+        for task, _fut, _done, _err in self._active.values():
+            msg = f' — {task.message}' if task.message else ''
+            parts.append(f'{task.label}{msg} ({now - task.started:.1f} s)')
+        self._status.config(text='Working: ' + ' | '.join(parts))
 
-    arr = np.array(img, dtype=np.uint8).flatten()
-    width = WIDTH
 
-    with open(out_path, "w") as f:
-        for i in range(0, len(arr), width):
-            line = ' '.join(f'{h:02X}' for h in arr[i:i+width])
-            if leading_spaces:
-                f.write('  ' + line + '\n')
-            else:
-                f.write(line + '\n')
+def _union_box(a, b):
+    if a is None:
+        return b
+    return min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])
 
 
 class App(tk.Tk):
@@ -316,6 +226,25 @@ class App(tk.Tk):
         # I had some issues with inversion so I added this to make it easier or any issues
         self.edited_png_is_preview = tk.BooleanVar(value=True)
         ttk.Checkbutton(opts, text='Apply Inverse)', variable=self.edited_png_is_preview).grid(row=1, column=3, columnspan=3, sticky='e', padx=6)
+        # Re-encode the .dat instead of patching the existing row spans
+        self.rebuild_layout = tk.BooleanVar(value=False)
+        ttk.Checkbutton(opts, text='Rebuild layout', variable=self.rebuild_layout).grid(row=2, column=0, columnspan=3, sticky='w', padx=6, pady=(0, 6))
+        # Brush editing on the previews; Off keeps clicks from changing heights
+        ttk.Label(opts, text='Brush:').grid(row=3, column=0, sticky='w', padx=6, pady=(0, 6))
+        self.brush_var = tk.StringVar(value='Off')
+        ttk.Combobox(opts, textvariable=self.brush_var, values=['Off'] + [m.capitalize() for m in BRUSH_MODES],
+                     width=8, state='readonly').grid(row=3, column=1, sticky='w', padx=6, pady=(0, 6))
+        ttk.Label(opts, text='Radius:').grid(row=3, column=2, sticky='w', padx=6, pady=(0, 6))
+        self.brush_radius_var = tk.StringVar(value='4')
+        ttk.Spinbox(opts, from_=1, to=256, textvariable=self.brush_radius_var, width=6).grid(row=3, column=3, sticky='w', padx=6, pady=(0, 6))
+        ttk.Label(opts, text='Strength %:').grid(row=3, column=4, sticky='w', padx=6, pady=(0, 6))
+        self.brush_strength_var = tk.StringVar(value='50')
+        ttk.Spinbox(opts, from_=1, to=100, textvariable=self.brush_strength_var, width=6).grid(row=3, column=5, sticky='w', padx=6, pady=(0, 6))
+        edit_btns = ttk.Frame(opts)
+        edit_btns.grid(row=4, column=0, columnspan=6, sticky='w', padx=6, pady=(0, 6))
+        ttk.Button(edit_btns, text='Undo', command=self.undo_edit).grid(row=0, column=0, sticky='w')
+        ttk.Button(edit_btns, text='Redo', command=self.redo_edit).grid(row=0, column=1, sticky='w', padx=(6, 0))
+        ttk.Button(edit_btns, text='Write Edits to DAT', command=self.save_edits_to_dat).grid(row=0, column=2, sticky='w', padx=(6, 0))
 
         # Previews for Min / Max images
         pv = ttk.LabelFrame(frm, text='Previews')
@@ -326,7 +255,7 @@ class App(tk.Tk):
         # Preview zoom control
         ttk.Label(pv, text='Preview Zoom:').grid(row=1, column=0, sticky='e', padx=8)
         self.preview_scale_var = tk.StringVar(value='2')
-        zoom = ttk.Combobox(pv, textvariable=self.preview_scale_var, values=['1','2','3','4'], width=4, state='readonly')
+        zoom = ttk.Combobox(pv, textvariable=self.preview_scale_var, values=['1','2','3','4','6','8','12','16'], width=4, state='readonly')
         zoom.grid(row=1, column=1, sticky='w', padx=8)
         zoom.bind('<<ComboboxSelected>>', lambda e: self._refresh_previews())
 
@@ -342,7 +271,8 @@ class App(tk.Tk):
         self.min_canvas.grid(row=0, column=0, sticky='nsew', padx=6, pady=(6, 0))
         self.min_vscroll = ttk.Scrollbar(left, orient='vertical', command=self.min_canvas.yview)
         self.min_hscroll = ttk.Scrollbar(left, orient='horizontal', command=self.min_canvas.xview)
-        self.min_canvas.configure(yscrollcommand=self.min_vscroll.set, xscrollcommand=self.min_hscroll.set)
+        self.min_canvas.configure(yscrollcommand=lambda *a: self._on_preview_view('min', self.min_vscroll, *a),
+                                  xscrollcommand=lambda *a: self._on_preview_view('min', self.min_hscroll, *a))
         self.min_vscroll.grid(row=0, column=1, sticky='ns', padx=(0, 6), pady=(6, 0))
         self.min_hscroll.grid(row=1, column=0, sticky='ew', padx=6)
         # Controls
@@ -357,6 +287,8 @@ class App(tk.Tk):
         btn_min_png2hex.grid(row=2, column=0, sticky='ew', pady=(6, 0))
         btn_min_update_dat = ttk.Button(controls_left, text='Update DAT with Edited Min PNG', command=lambda: self.update_dat_with_png(which='min'))
         btn_min_update_dat.grid(row=3, column=0, sticky='ew', pady=(6, 0))
+        btn_min_exact = ttk.Button(controls_left, text='Save Exact Min (NPY/RAW/16-bit PNG)', command=lambda: self._save_exact('min'))
+        btn_min_exact.grid(row=4, column=0, sticky='ew', pady=(6, 0))
 
         right = ttk.LabelFrame(pv, text='MaxHeights')
         right.grid(row=0, column=1, padx=8, pady=8, sticky='nsew')
@@ -369,7 +301,8 @@ class App(tk.Tk):
         self.max_canvas.grid(row=0, column=0, sticky='nsew', padx=6, pady=(6, 0))
         self.max_vscroll = ttk.Scrollbar(right, orient='vertical', command=self.max_canvas.yview)
         self.max_hscroll = ttk.Scrollbar(right, orient='horizontal', command=self.max_canvas.xview)
-        self.max_canvas.configure(yscrollcommand=self.max_vscroll.set, xscrollcommand=self.max_hscroll.set)
+        self.max_canvas.configure(yscrollcommand=lambda *a: self._on_preview_view('max', self.max_vscroll, *a),
+                                  xscrollcommand=lambda *a: self._on_preview_view('max', self.max_hscroll, *a))
         self.max_vscroll.grid(row=0, column=1, sticky='ns', padx=(0, 6), pady=(6, 0))
         self.max_hscroll.grid(row=1, column=0, sticky='ew', padx=6)
         # Controls
@@ -384,17 +317,40 @@ class App(tk.Tk):
         btn_max_png2hex.grid(row=2, column=0, sticky='ew', pady=(6, 0))
         btn_max_update_dat = ttk.Button(controls_right, text='Update DAT with Edited Max PNG', command=lambda: self.update_dat_with_png(which='max'))
         btn_max_update_dat.grid(row=3, column=0, sticky='ew', pady=(6, 0))
+        btn_max_exact = ttk.Button(controls_right, text='Save Exact Max (NPY/RAW/16-bit PNG)', command=lambda: self._save_exact('max'))
+        btn_max_exact.grid(row=4, column=0, sticky='ew', pady=(6, 0))
+
+        for which, canvas in (('min', self.min_canvas), ('max', self.max_canvas)):
+            canvas.bind('<ButtonPress-1>', lambda e, w=which: self._stroke_begin(w, e))
+            canvas.bind('<B1-Motion>', lambda e, w=which: self._stroke_move(w, e))
+            canvas.bind('<ButtonRelease-1>', lambda e, w=which: self._stroke_end(w, e))
+        self.bind_all('<Control-z>', lambda e: self.undo_edit())
+        self.bind_all('<Control-y>', lambda e: self.redo_edit())
 
         actions = ttk.Frame(frm)
         actions.grid(row=5, column=0, columnspan=5, sticky='ew', pady=12)
         actions.columnconfigure(0, weight=1)
         actions.columnconfigure(1, weight=0)
         ttk.Button(actions, text='Load & Preview', command=self.run).grid(row=0, column=0, sticky='w')
-        ttk.Button(actions, text='Quit', command=self.destroy).grid(row=0, column=1, sticky='e')
+        ttk.Button(actions, text='Cancel', command=lambda: self._tasks.cancel_all()).grid(row=0, column=1, sticky='e', padx=(0, 8))
+        ttk.Button(actions, text='Quit', command=self.destroy).grid(row=0, column=2, sticky='e')
 
         self.status = ttk.Label(frm, text='Ready')
         self.status.grid(row=6, column=0, columnspan=5, sticky='w')
+        # Parsing, conversion and file I/O run here so the window stays responsive
+        self._tasks = _TaskRunner(self, self.status)
         self._preview_images = {'min': None, 'max': None}
+        # Full-size PhotoImages per (layer, zoom), dropped on reload
+        self._preview_cache = OrderedDict()
+        # Layers currently drawn viewport-only, with the last rendered (box, scale)
+        self._viewport = {'min': None, 'max': None}
+        self._viewport_pending = set()
+        # Canvas position of each preview's top-left pixel
+        self._preview_origin = {'min': (0, 0), 'max': (0, 0)}
+        # Brush editing: undo steps, the stroke in progress and boxes waiting to be redrawn
+        self._history = EditHistory()
+        self._stroke = None
+        self._dirty = {}
 
     def browse_input(self):
         # only allow .dat files
@@ -403,6 +359,11 @@ class App(tk.Tk):
             self.input_entry.delete(0, tk.END)
             self.input_entry.insert(0, p)
 
+    def destroy(self):
+        if hasattr(self, '_tasks'):
+            self._tasks.shutdown()
+        super().destroy()
+
     def run(self):
         inp = self.input_entry.get().strip()
         if inp == getattr(self, 'input_placeholder', ''):
@@ -411,37 +372,45 @@ class App(tk.Tk):
             messagebox.showerror('Missing path', 'Please set an input .dat path')
             return
 
-        try:
-            print(f"[GUI] Loading DAT: {inp}")
-            max_arr, min_arr, w, h = parse_dat_file(inp)
-        except Exception as e:
-            messagebox.showerror('Error parsing .dat', str(e))
-            return
-
-        # Create preview images
-        try:
-            self._full_max_array = max_arr
-            self._full_min_array = min_arr
-
-            # Build normalized images for preview/PNG export
-            vis_max = _normalize_to_uint8(max_arr)
-            vis_min = _normalize_to_uint8(min_arr)
-            print(f"[GUI] Max range: ({int(max_arr.min())}, {int(max_arr.max())}) | Min range: ({int(min_arr.min())}, {int(min_arr.max())})")
-            # Convert to RGB for preview
-            img_max_vis = Image.fromarray(vis_max, mode='L').rotate(180).transpose(Image.FLIP_LEFT_RIGHT).convert('RGB')
-            img_min_vis = Image.fromarray(vis_min, mode='L').rotate(180).transpose(Image.FLIP_LEFT_RIGHT).convert('RGB')
-        except Exception as e:
-            messagebox.showerror('Error creating images', str(e))
-            return
+        log.info('Loading DAT: %s', inp)
+
+        def work(task):
+            task.progress('decoding')
+            max_arr, min_arr, w, h, _header = _decode_cache.load(inp)
+            task.check()
+            # Build normalized images for preview/PNG export; single channel is enough for both
+            task.progress('building previews')
+            img_max_vis = _preview_image(max_arr)
+            img_min_vis = _preview_image(min_arr)
+            return inp, max_arr, min_arr, w, h, img_max_vis, img_min_vis
+
+        self._tasks.submit('load', f'Loading {os.path.basename(inp)}', work, self._on_loaded,
+                           lambda e: messagebox.showerror('Error parsing .dat', str(e)))
+
+    def _on_loaded(self, result):
+        inp, max_arr, min_arr, w, h, img_max_vis, img_min_vis = result
+        self._full_max_array = max_arr
+        self._full_min_array = min_arr
+        # Layers as decoded (shared with the cache, read-only); edits work on copies
+        self._loaded_path = inp
+        self._loaded_arrays = {'max': max_arr, 'min': min_arr}
+        self.width_var.set(str(w))
+        self.height_var.set(str(h))
+        self._history.clear()
+        self._stroke = None
+        self._dirty.clear()
 
         # Store visual images for saving and previewing
         self._full_max_vis = img_max_vis
         self._full_min_vis = img_min_vis
+        rng_max = (int(max_arr.min()), int(max_arr.max()))
+        rng_min = (int(min_arr.min()), int(min_arr.max()))
+        # Edited cells are redrawn with the same normalization as the loaded preview
+        self._vis_luts = {'max': _normalize_lut(*rng_max), 'min': _normalize_lut(*rng_min)}
 
+        self._preview_cache.clear()
         self._update_preview('min', img_min_vis)
         self._update_preview('max', img_max_vis)
-        rng_max = (int(max_arr.min()), int(max_arr.max()))
-        rng_min = (int(min_arr.min()), int(min_arr.max()))
         self.status.config(text=f'Loaded {os.path.basename(inp)} — {w}x{h} | Max range {rng_max} | Min range {rng_min}')
 
     # Placeholder handlers for the input path field
@@ -453,30 +422,88 @@ class App(tk.Tk):
         if not self.input_entry.get():
             self.input_entry.insert(0, getattr(self, 'input_placeholder', ''))
 
-    def _update_preview(self, which, pil_img):
-        # Show preview at scaled size, centered, without affecting saved PNGs
-        img = pil_img.copy()
+    def _preview_scale(self):
         try:
-            scale = int(self.preview_scale_var.get()) if hasattr(self, 'preview_scale_var') else 1
+            return max(int(self.preview_scale_var.get()), 1)
         except Exception:
-            scale = 1
-        if scale > 1:
-            img = img.resize((img.width * scale, img.height * scale), Image.NEAREST)
-        tkimg = ImageTk.PhotoImage(img)
-        def draw_centered(canvas, key):
-            self._preview_images[key] = tkimg
-            canvas.delete('all')
-            cw = max(canvas.winfo_width(), 1)
-            ch = max(canvas.winfo_height(), 1)
-            ox = 0 if img.width >= cw else (cw - img.width) // 2
-            oy = 0 if img.height >= ch else (ch - img.height) // 2
-            canvas.create_image(ox, oy, image=tkimg, anchor='nw')
-            canvas.configure(scrollregion=(0, 0, img.width, img.height))
-
-        if which == 'min':
-            draw_centered(self.min_canvas, 'min')
+            return 1
+
+    def _update_preview(self, which, pil_img):
+        # Show preview at scaled size, centered, without affecting saved PNGs.
+        # Small zoom levels are memoized as full PhotoImages; large ones only
+        # render the part of the canvas that is visible.
+        scale = self._preview_scale()
+        canvas = self.min_canvas if which == 'min' else self.max_canvas
+        w, h = pil_img.width * scale, pil_img.height * scale
+        canvas.delete('all')
+        cw = max(canvas.winfo_width(), 1)
+        ch = max(canvas.winfo_height(), 1)
+        ox = 0 if w >= cw else (cw - w) // 2
+        oy = 0 if h >= ch else (ch - h) // 2
+        canvas.configure(scrollregion=(0, 0, w, h))
+        self._preview_origin[which] = (ox, oy)
+
+        if w * h > PREVIEW_FULL_PIXELS:
+            self._preview_images[which] = None
+            self._viewport[which] = {'origin': (ox, oy), 'drawn': None}
+            self._render_viewport(which)
+            return
+
+        self._viewport[which] = None
+        key = (which, scale)
+        tkimg = self._preview_cache.get(key)
+        if tkimg is None:
+            with _tracer.span('resize'):
+                img = pil_img if scale == 1 else pil_img.resize((w, h), Image.NEAREST)
+            with _tracer.span('photoimage'):
+                tkimg = ImageTk.PhotoImage(img)
+            self._preview_cache[key] = tkimg
+            while len(self._preview_cache) > PREVIEW_CACHE_LEVELS:
+                self._preview_cache.popitem(last=False)
         else:
-            draw_centered(self.max_canvas, 'max')
+            self._preview_cache.move_to_end(key)
+        self._preview_images[which] = tkimg
+        canvas.create_image(ox, oy, image=tkimg, anchor='nw')
+
+    def _on_preview_view(self, which, scrollbar, first, last):
+        # Canvas view changed (scroll or resize); re-render the viewport once idle
+        scrollbar.set(first, last)
+        if self._viewport.get(which) is not None and which not in self._viewport_pending:
+            self._viewport_pending.add(which)
+            self.after_idle(self._render_viewport, which)
+
+    def _render_viewport(self, which):
+        self._viewport_pending.discard(which)
+        state = self._viewport.get(which)
+        pil_img = getattr(self, '_full_min_vis' if which == 'min' else '_full_max_vis', None)
+        if state is None or pil_img is None:
+            return
+        canvas = self.min_canvas if which == 'min' else self.max_canvas
+        scale = self._preview_scale()
+        ox, oy = state['origin']
+        # Visible canvas area mapped back to source pixels
+        vx = canvas.canvasx(0) - ox
+        vy = canvas.canvasy(0) - oy
+        vw = max(canvas.winfo_width(), 1)
+        vh = max(canvas.winfo_height(), 1)
+        sx0 = min(max(int(vx // scale), 0), pil_img.width)
+        sy0 = min(max(int(vy // scale), 0), pil_img.height)
+        sx1 = min(max(-(-int(vx + vw) // scale), sx0), pil_img.width)
+        sy1 = min(max(-(-int(vy + vh) // scale), sy0), pil_img.height)
+        box = (sx0, sy0, sx1, sy1)
+        if state['drawn'] == (box, scale):
+            return
+        state['drawn'] = (box, scale)
+        canvas.delete('viewport')
+        self._preview_images[which] = None
+        if sx1 <= sx0 or sy1 <= sy0:
+            return
+        with _tracer.span('resize'):
+            crop = pil_img.crop(box).resize(((sx1 - sx0) * scale, (sy1 - sy0) * scale), Image.NEAREST)
+        with _tracer.span('photoimage'):
+            tkimg = ImageTk.PhotoImage(crop)
+        self._preview_images[which] = tkimg
+        canvas.create_image(ox + sx0 * scale, oy + sy0 * scale, image=tkimg, anchor='nw', tags='viewport')
 
     def _refresh_previews(self):
         if hasattr(self, '_full_min_vis'):
@@ -484,122 +511,348 @@ class App(tk.Tk):
         if hasattr(self, '_full_max_vis'):
             self._update_preview('max', self._full_max_vis)
 
-    def save_min_png(self):
-        if not hasattr(self, '_full_min_vis'):
-            messagebox.showerror('No image', 'No Min image loaded')
+    def _layer(self, which, writable=False):
+        arr = getattr(self, f'_full_{which}_array', None)
+        if writable and arr is not None and not arr.flags.writeable:
+            # Decoded layers are shared with the cache; edit a private copy
+            arr = arr.copy()
+            setattr(self, f'_full_{which}_array', arr)
+        return arr
+
+    def _brush_params(self):
+        try:
+            radius = max(float(self.brush_radius_var.get()), 0.5)
+        except ValueError:
+            radius = 4.0
+        try:
+            strength = min(max(float(self.brush_strength_var.get()) / 100.0, 0.0), 1.0)
+        except ValueError:
+            strength = 0.5
+        return radius, strength
+
+    def _canvas_cell(self, which, event):
+        # Layer cell coordinates (fractional, cell centres on integers) under the pointer.
+        # Preview rows run bottom-up, so the row is mirrored.
+        canvas = self.min_canvas if which == 'min' else self.max_canvas
+        scale = self._preview_scale()
+        ox, oy = self._preview_origin[which]
+        px = (canvas.canvasx(event.x) - ox) / scale
+        py = (canvas.canvasy(event.y) - oy) / scale
+        return px - 0.5, self._layer(which).shape[0] - py - 0.5
+
+    def _stroke_begin(self, which, event):
+        mode = self.brush_var.get().lower()
+        if mode not in BRUSH_MODES or self._layer(which) is None or self._stroke is not None:
             return
-        p = filedialog.asksaveasfilename(defaultextension='.png', filetypes=[('PNG', '*.png')])
-        if p:
-            self._full_min_vis.convert('RGB').save(p)
-            messagebox.showinfo('Saved', f'Saved {p}')
+        arr = self._layer(which, writable=True)
+        cx, cy = self._canvas_cell(which, event)
+        target = None
+        if mode == 'flatten':
+            # Whole stroke flattens towards the height where it started
+            target = arr[min(max(int(round(cy)), 0), arr.shape[0] - 1), min(max(int(round(cx)), 0), arr.shape[1] - 1)]
+        # Each dab keeps a copy of the cells it is about to change, so undo costs
+        # follow the stroke rather than the layer
+        self._stroke = {'which': which, 'mode': mode, 'target': target, 'dabs': [], 'box': None, 'last': None}
+        self._stroke_move(which, event)
+
+    def _stroke_move(self, which, event):
+        stroke = self._stroke
+        if stroke is None or stroke['which'] != which:
+            return
+        arr = self._layer(which)
+        radius, strength = self._brush_params()
+        cx, cy = self._canvas_cell(which, event)
+        # Dabs every half radius so fast drags leave a continuous stroke
+        lx, ly = stroke['last'] if stroke['last'] is not None else (cx, cy)
+        steps = max(int(np.hypot(cx - lx, cy - ly) / max(radius / 2, 0.5)), 1)
+        with _tracer.span('brush'):
+            for i in range(1, steps + 1):
+                t = i / steps
+                box = brush_dab(arr, lx + (cx - lx) * t, ly + (cy - ly) * t, radius, stroke['mode'], strength,
+                                stroke['target'], undo=stroke['dabs'])
+                if box is not None:
+                    stroke['box'] = _union_box(stroke['box'], box)
+                    self._mark_dirty(which, box)
+        stroke['last'] = (cx, cy)
+
+    def _stroke_end(self, which, event):
+        stroke = self._stroke
+        if stroke is None or stroke['which'] != which:
+            return
+        self._stroke = None
+        self._flush_dirty()
+        if stroke['box'] is None:
+            return
+        x0, y0, x1, y1 = stroke['box']
+        after = self._layer(which)[y0:y1, x0:x1].copy()
+        self._history.push(which, stroke['box'], _undo_box(stroke['box'], after, stroke['dabs']), after)
+        self.status.config(text=f'{stroke["mode"].capitalize()} on {which.capitalize()} rows {y0}-{y1 - 1}, '
+                                f'columns {x0}-{x1 - 1} | {len(self._history)} edits to undo')
+
+    def _mark_dirty(self, which, box):
+        # Coalesce boxes until idle so a burst of motion events redraws once
+        pending = bool(self._dirty)
+        self._dirty[which] = _union_box(self._dirty.get(which), box)
+        if not pending:
+            self.after_idle(self._flush_dirty)
+
+    def _flush_dirty(self):
+        dirty, self._dirty = self._dirty, {}
+        for which, box in dirty.items():
+            self._patch_preview(which, box)
+
+    def _patch_preview(self, which, box):
+        # Redraw one box of a layer: the PIL preview (used for export and other zoom
+        # levels) and only the matching pixels of the shown PhotoImage
+        arr = self._layer(which)
+        pil_img = getattr(self, f'_full_{which}_vis', None)
+        if arr is None or pil_img is None:
+            return
+        x0, y0, x1, y1 = box
+        # Raw rows y0..y1 land upside down at preview rows h-y1..h-y0
+        vis = self._vis_luts[which][arr[y0:y1, x0:x1][::-1]]
+        py0 = arr.shape[0] - y1
+        pil_img.paste(Image.fromarray(vis, mode='L'), (x0, py0))
+        scale = self._preview_scale()
+        for key in [k for k in self._preview_cache if k[0] == which and k[1] != scale]:
+            del self._preview_cache[key]
+        tkimg = self._preview_images[which]
+        if tkimg is None:
+            return
+        state = self._viewport.get(which)
+        if state is not None:
+            if state['drawn'] is None:
+                return
+            bx0, by0, bx1, by1 = state['drawn'][0]
+        else:
+            bx0, by0, bx1, by1 = 0, 0, pil_img.width, pil_img.height
+        cx0, cy0 = max(x0, bx0), max(py0, by0)
+        cx1, cy1 = min(x1, bx1), min(py0 + y1 - y0, by1)
+        if cx1 <= cx0 or cy1 <= cy0:
+            return
+        part = vis[cy0 - py0:cy1 - py0, cx0 - x0:cx1 - x0]
+        if scale > 1:
+            part = part.repeat(scale, axis=0).repeat(scale, axis=1)
+        with _tracer.span('photoimage put'):
+            data = b'P5 %d %d 255\n' % (part.shape[1], part.shape[0]) + part.tobytes()
+            self.tk.call(str(tkimg), 'put', data, '-format', 'ppm', '-to', (cx0 - bx0) * scale, (cy0 - by0) * scale)
+
+    def undo_edit(self):
+        self._step_history(self._history.undo, 'undo')
+
+    def redo_edit(self):
+        self._step_history(self._history.redo, 'redo')
+
+    def _step_history(self, step, name):
+        if self._stroke is not None:
+            return
+        layers = {w: self._layer(w) for w in ('min', 'max') if self._layer(w) is not None}
+        res = step(layers) if layers else None
+        if res is None:
+            self.status.config(text=f'Nothing to {name}')
+            return
+        which, box = res
+        self._patch_preview(which, box)
+        self.status.config(text=f'{name.capitalize()}: {which.capitalize()} rows {box[1]}-{box[3] - 1} | '
+                                f'{len(self._history)} edits to undo')
+
+    def save_edits_to_dat(self):
+        inp_dat = getattr(self, '_loaded_path', None)
+        edited = [w for w in ('min', 'max') if inp_dat and self._layer(w) is not self._loaded_arrays[w]]
+        if not edited:
+            messagebox.showerror('No edits', 'Load a .dat and paint on a preview first')
+            return
+        if self._tasks.busy('save-edits'):
+            self.status.config(text='Edits are already being written')
+            return
+        out_path = filedialog.asksaveasfilename(defaultextension='.dat', filetypes=[('DAT', '*.dat')])
+        if not out_path:
+            return
+        rebuild = self.rebuild_layout.get()
+        # Snapshots, so strokes made while writing do not race the worker
+        new = {w: self._layer(w).copy() for w in edited}
+        old = {w: self._loaded_arrays[w] for w in edited}
+
+        def work(task):
+            same = os.path.exists(out_path) and os.path.samefile(out_path, inp_dat)
+            if not rebuild and same:
+                # Only the painted cells are written
+                written = _apply_patch_file_inplace(out_path, make_patch(old, new))
+                return same, f'Patched {written} bytes in place: {out_path}'
+            with open(inp_dat, 'rb') as f:
+                data = f.read()
+            task.check()
+            if rebuild:
+                for w, arr in new.items():
+                    data = _rebuild_hmap_binary(data, arr, which=w)
+            else:
+                data = _apply_patch_binary(data, make_patch(old, new))
+            with open(out_path, 'wb') as f:
+                f.write(data)
+            return same, f'Wrote edited DAT: {out_path}'
+
+        def done(result):
+            same, msg = result
+            if same:
+                # The file on disk now holds these layers; later saves patch from here
+                for w, arr in new.items():
+                    arr.flags.writeable = False
+                    self._loaded_arrays[w] = arr
+            self.status.config(text=msg)
+            messagebox.showinfo('Updated', msg)
+
+        def failed(e):
+            hint = '\n\nEnable "Rebuild layout" to keep edits outside the stored row spans.' if 'row span' in str(e) else ''
+            messagebox.showerror('Write failed', f'{e}{hint}')
+
+        self._tasks.submit('save-edits', f'Writing {os.path.basename(out_path)}', work, done, failed)
+
+    def save_min_png(self):
+        self._save_png('min')
 
     def save_max_png(self):
-        if not hasattr(self, '_full_max_vis'):
-            messagebox.showerror('No image', 'No Max image loaded')
+        self._save_png('max')
+
+    def _save_png(self, which):
+        img = getattr(self, f'_full_{which}_vis', None)
+        if img is None:
+            messagebox.showerror('No image', f'No {which.capitalize()} image loaded')
             return
         p = filedialog.asksaveasfilename(defaultextension='.png', filetypes=[('PNG', '*.png')])
         if p:
-            self._full_max_vis.convert('RGB').save(p)
-            messagebox.showinfo('Saved', f'Saved {p}')
+            img = img.copy()
+            self._tasks.submit(f'save-{which}-png', f'Saving {os.path.basename(p)}',
+                               lambda task: _write_png(img, p),
+                               lambda _r: messagebox.showinfo('Saved', f'Saved {p}'))
+
+    def _save_exact(self, which):
+        # Lossless export of the layer bytes (including brush edits) in preview orientation
+        arr = self._layer(which)
+        if arr is None:
+            messagebox.showerror('No data', f'No {which.capitalize()} data loaded')
+            return
+        p = filedialog.asksaveasfilename(defaultextension='.npy', filetypes=[
+            ('NumPy', '*.npy'), ('Raw bytes', '*.raw'), ('16-bit PNG', '*.png')])
+        if p:
+            arr = arr.copy()
+            self._tasks.submit(f'save-{which}-exact', f'Saving {os.path.basename(p)}',
+                               lambda task: save_layer(arr, p),
+                               lambda _r: messagebox.showinfo('Saved', f'Saved {p}'),
+                               lambda e: messagebox.showerror('Save failed', str(e)))
 
     def _save_array_as_hex(self, arr, path):
-        with open(path, 'w') as f:
-            for i in range(0, arr.size, arr.shape[1]):
-                line = ' '.join(f'{h:02X}' for h in arr.flatten()[i:i+arr.shape[1]])
-                f.write('  ' + line + '\n')
+        _save_array_as_hex(arr, path)
 
-    def _edited_png_to_hex(self):
-        p_in = filedialog.askopenfilename(filetypes=[('PNG', '*.png')])
+    def _edited_png_to_hex(self, label):
+        p_in = filedialog.askopenfilename(filetypes=EDITED_LAYER_TYPES)
         if not p_in:
             return None, None
-        try:
-            img = Image.open(p_in).convert('L')
-        except Exception as e:
-            messagebox.showerror('Error', f'Failed to open PNG: {e}')
-            return None, None
-        img = img.resize((WIDTH, HEIGHT), Image.Resampling.BICUBIC)
-        if self.edited_png_is_preview.get():
-            img_raw_oriented = img.transpose(Image.FLIP_LEFT_RIGHT).rotate(180)
-        else:
-            img_raw_oriented = img
-        arr = np.array(img_raw_oriented, dtype=np.uint8)
         p_out = filedialog.asksaveasfilename(defaultextension='.txt', filetypes=[('Text', '*.txt')])
         if not p_out:
             return None, None
-        self._save_array_as_hex(arr, p_out)
+        apply_inverse = self.edited_png_is_preview.get()
+        # Match the loaded map when there is one; otherwise keep the file's own size
+        loaded = getattr(self, '_loaded_arrays', None)
+        shape = loaded['max'].shape if loaded else None
+
+        def work(task):
+            try:
+                arr = _load_edited_png(p_in, apply_inverse, shape)
+            except Exception as e:
+                raise ValueError(f'Failed to open PNG: {e}')
+            task.check()
+            self._save_array_as_hex(arr, p_out)
+
+        self._tasks.submit(f'png2hex-{label}', f'Converting {os.path.basename(p_in)}', work,
+                           lambda _r: messagebox.showinfo('Converted', f'Edited {label} PNG converted to HEX: {p_out}'),
+                           lambda e: messagebox.showerror('Error', str(e)))
         return p_in, p_out
 
     def convert_min_png_to_hex(self):
-        res = self._edited_png_to_hex()
-        if res and res[1]:
-            messagebox.showinfo('Converted', f'Edited Min PNG converted to HEX: {res[1]}')
+        self._edited_png_to_hex('Min')
 
     def convert_max_png_to_hex(self):
-        res = self._edited_png_to_hex()
-        if res and res[1]:
-            messagebox.showinfo('Converted', f'Edited Max PNG converted to HEX: {res[1]}')
+        self._edited_png_to_hex('Max')
 
     def update_dat_with_png(self, which: str):
         inp_dat = self.input_entry.get().strip()
         if not inp_dat:
             messagebox.showerror('Missing DAT', 'Please set an input .dat path')
             return
-        p_png = filedialog.askopenfilename(filetypes=[('PNG', '*.png')])
-        if not p_png:
+        key = f'update-{which}'
+        if self._tasks.busy(key):
+            self.status.config(text=f'{which.capitalize()} update is already running')
             return
-        try:
-            img = Image.open(p_png).convert('L')
-            img = img.resize((WIDTH, HEIGHT), Image.Resampling.BICUBIC)
-            if self.edited_png_is_preview.get():
-                img_raw = img.transpose(Image.FLIP_LEFT_RIGHT).rotate(180)
-            else:
-                img_raw = img
-            arr = np.array(img_raw, dtype=np.uint8)
-        except Exception as e:
-            messagebox.showerror('Error', f'Failed to process PNG: {e}')
+        p_png = filedialog.askopenfilename(filetypes=EDITED_LAYER_TYPES)
+        if not p_png:
             return
-
-        # Read DAT bytes, update, and write to new file. I just replace the heightmap I am editing...
-        try:
+        apply_inverse = self.edited_png_is_preview.get()
+        rebuild = self.rebuild_layout.get()
+
+        def prepare(task):
+            with HmapReader(inp_dat) as r:
+                shape = (r.height, r.width)
+            try:
+                arr = _load_edited_png(p_png, apply_inverse, shape)
+            except Exception as e:
+                raise ValueError(f'Failed to process PNG: {e}')
+            return arr
+
+        def write(arr, out_path, task):
+            task.check()
+            # Overwriting the source: patch only the changed bytes in place, without
+            # building the updated file in memory
+            if not rebuild and os.path.exists(out_path) and os.path.samefile(out_path, inp_dat):
+                written = _update_hmap_file_inplace(out_path, arr, which=which)
+                return f'Patched {written} bytes in place: {out_path}'
+            task.progress('repacking')
             with open(inp_dat, 'rb') as f:
                 data = f.read()
-            new_data = _update_hmap_binary(data, arr, which=which)
-        except Exception as e:
-            messagebox.showerror('Update failed', str(e))
-            return
-
-        out_path = filedialog.asksaveasfilename(defaultextension='.dat', filetypes=[('DAT', '*.dat')])
-        if not out_path:
-            return
-        try:
+            if rebuild:
+                new_data = _rebuild_hmap_binary(data, arr, which=which)
+            else:
+                new_data = _update_hmap_binary(data, arr, which=which)
+            del data
+            task.check()
             with open(out_path, 'wb') as f:
                 f.write(new_data)
-        except Exception as e:
-            messagebox.showerror('Write failed', str(e))
-            return
-        messagebox.showinfo('Updated', f'Wrote updated DAT: {out_path}')
+            return f'Wrote updated DAT: {out_path}'
+
+        def prepared(arr):
+            out_path = filedialog.asksaveasfilename(defaultextension='.dat', filetypes=[('DAT', '*.dat')])
+            if not out_path:
+                self.status.config(text='Update cancelled')
+                return
+            self._tasks.submit(key, f'Writing {os.path.basename(out_path)}',
+                               lambda task: write(arr, out_path, task),
+                               lambda msg: (self.status.config(text=msg), messagebox.showinfo('Updated', msg)),
+                               lambda e: messagebox.showerror('Write failed', str(e)))
+
+        self._tasks.submit(key, f'Reading {os.path.basename(p_png)}', prepare, prepared,
+                           lambda e: messagebox.showerror('Update failed', str(e)))
 
     def save_min_hex(self):
-        if not hasattr(self, '_full_min_array'):
-            messagebox.showerror('No data', 'No Min data loaded')
-            return
-        p = filedialog.asksaveasfilename(defaultextension='.txt', filetypes=[('Text', '*.txt')])
-        if p:
-            arr = np.array(self._full_min_array, dtype=np.uint8)
-            self._save_array_as_hex(arr, p)
-            messagebox.showinfo('Saved', f'Saved {p}')
+        self._save_hex('min')
 
     def save_max_hex(self):
-        if not hasattr(self, '_full_max_array'):
-            messagebox.showerror('No data', 'No Max data loaded')
+        self._save_hex('max')
+
+    def _save_hex(self, which):
+        arr = getattr(self, f'_full_{which}_array', None)
+        if arr is None:
+            messagebox.showerror('No data', f'No {which.capitalize()} data loaded')
             return
         p = filedialog.asksaveasfilename(defaultextension='.txt', filetypes=[('Text', '*.txt')])
         if p:
-            arr = np.array(self._full_max_array, dtype=np.uint8)
-            self._save_array_as_hex(arr, p)
-            messagebox.showinfo('Saved', f'Saved {p}')
+            arr = arr.copy()
+            self._tasks.submit(f'save-{which}-hex', f'Saving {os.path.basename(p)}',
+                               lambda task: self._save_array_as_hex(arr, p),
+                               lambda _r: messagebox.showinfo('Saved', f'Saved {p}'))
 
 
 if __name__ == '__main__':
+    import sys
+    from hmap_core import _setup_logging
+    _setup_logging(1 if '--verbose' in sys.argv[1:] else 0)
     app = App()
     app.mainloop()
@@ -0,0 +1,1514 @@
+# Headless HMAP / HEX / PNG codecs shared by the GUI, the batch CLI and scripts.
+# Pillow is imported on first use, so decoding .dat files needs neither Pillow
+# nor tkinter nor a display.
+import os
+import numpy as np
+import zlib
+import threading
+import time
+import json
+import logging
+import contextlib
+from collections import deque
+from collections import OrderedDict
+
+# Size of the stock GTAV heightmap. Files carry their own size in the header;
+# these are only shown before anything is loaded.
+WIDTH = 183
+HEIGHT = 249
+# Cells per row block in decode, scatter and normalize passes, which bounds the
+# index arrays they build regardless of the map size
+_CHUNK_CELLS = 1 << 20
+
+log = logging.getLogger('heightmap')
+
+
+class _Tracer:
+    # Span timings for the hot stages. While disabled, span() hands back one shared
+    # no-op context manager, so instrumented code costs a single attribute check.
+    # HMAP_TRACE=1 enables it; HMAP_TRACE=<file>.json also writes a trace at exit.
+    MAX_EVENTS = 100_000
+
+    def __init__(self):
+        self.enabled = False
+        self._events = deque(maxlen=self.MAX_EVENTS)
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def enable(self, on=True):
+        self.enabled = on
+
+    def span(self, name):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def _record(self, name, start, seconds):
+        with self._lock:
+            self._events.append((self._count, name, start, seconds, threading.get_ident()))
+            self._count += 1
+
+    def mark(self):
+        # Position to pass to summary()/breakdown() for "everything after this point"
+        return self._count
+
+    def summary(self, since=0):
+        out = {}
+        with self._lock:
+            events = [e for e in self._events if e[0] >= since]
+        for _i, name, _start, sec, _tid in events:
+            st = out.setdefault(name, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            st['count'] += 1
+            st['total_ms'] += sec * 1000
+            st['max_ms'] = max(st['max_ms'], sec * 1000)
+        return out
+
+    def breakdown(self, since=0, top=6):
+        stats = sorted(self.summary(since).items(), key=lambda kv: -kv[1]['total_ms'])[:top]
+        return ', '.join(f"{name} {st['total_ms']:.1f} ms" for name, st in stats)
+
+    def dump(self, path):
+        # Chrome trace-event JSON (chrome://tracing, Perfetto) plus the summary
+        with self._lock:
+            events = list(self._events)
+        trace = [{'name': name, 'ph': 'X', 'ts': start * 1e6, 'dur': sec * 1e6, 'pid': os.getpid(), 'tid': tid}
+                 for _i, name, start, sec, tid in events]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': trace, 'summary': self.summary()}, f)
+
+
+class _Span:
+    __slots__ = ('tracer', 'name', 't0')
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        t1 = time.perf_counter()
+        self.tracer._record(self.name, self.t0, t1 - self.t0)
+        log.debug('%s took %.2f ms', self.name, (t1 - self.t0) * 1000)
+
+
+_NULL_SPAN = contextlib.nullcontext()
+_tracer = _Tracer()
+
+
+def _setup_tracing_from_env():
+    value = os.environ.get('HMAP_TRACE', '')
+    if not value or value == '0':
+        return
+    _tracer.enable()
+    if value.lower().endswith('.json'):
+        import atexit
+        atexit.register(_tracer.dump, value)
+
+
+_setup_tracing_from_env()
+
+
+def _setup_logging(verbose=0):
+    # Root logging for the entry points. verbose 1 shows info, 2 debug; otherwise
+    # HMAP_LOG names the level (info, debug, ...) and warnings are the default.
+    if verbose:
+        level = logging.DEBUG if verbose > 1 else logging.INFO
+    else:
+        level = logging.getLevelName(os.environ.get('HMAP_LOG', 'warning').upper())
+        if not isinstance(level, int):
+            level = logging.WARNING
+    logging.basicConfig(level=level, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+
+# HEX parsing: digit value per input byte, 16 marks a separator, 17 the x of a
+# 0x prefix, 255 anything else
+_HEX_SEP = 16
+_HEX_X = 17
+_HEX_BAD = 255
+_HEX_LUT = np.full(256, _HEX_BAD, dtype=np.uint8)
+_HEX_LUT[np.frombuffer(b'0123456789', dtype=np.uint8)] = np.arange(10)
+_HEX_LUT[np.frombuffer(b'abcdef', dtype=np.uint8)] = np.arange(10, 16)
+_HEX_LUT[np.frombuffer(b'ABCDEF', dtype=np.uint8)] = np.arange(10, 16)
+_HEX_LUT[np.frombuffer(b' \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f,;:', dtype=np.uint8)] = _HEX_SEP
+_HEX_LUT[np.frombuffer(b'xX', dtype=np.uint8)] = _HEX_X
+_HEX_CHUNK = 1 << 22
+
+
+def _decode_hex_block(block, final):
+    # Decode the complete tokens of a block into uint8 values.
+    # Returns (values, rest) where rest is a token cut off at the block end.
+    d = _HEX_LUT[np.frombuffer(block, dtype=np.uint8)]
+    rest = b''
+    if not final:
+        seps = np.flatnonzero(d == _HEX_SEP)
+        cut = int(seps[-1]) + 1 if len(seps) else 0
+        rest = block[cut:]
+        d = d[:cut]
+    x = np.flatnonzero(d == _HEX_X)
+    if len(x):
+        # A 0x at the start of a token followed by a digit is dropped, as int(t, 16) does
+        prev = d[np.maximum(x - 1, 0)]
+        before = d[np.maximum(x - 2, 0)]
+        after = d[np.minimum(x + 1, len(d) - 1)]
+        ok = (x >= 1) & (prev == 0) & ((x == 1) | (before == _HEX_SEP)) & (x + 1 < len(d)) & (after < _HEX_SEP)
+        if not ok.all():
+            raise ValueError("File contains non-hex tokens")
+        d[x - 1] = d[x] = _HEX_SEP
+    if (d == _HEX_BAD).any():
+        raise ValueError("File contains non-hex tokens")
+    digit = d != _HEX_SEP
+    edges = np.diff(digit.view(np.int8), prepend=np.int8(0), append=np.int8(0))
+    starts = np.flatnonzero(edges == 1)
+    lengths = np.flatnonzero(edges == -1) - starts
+    if len(starts) and (lengths == 2).all():
+        # Common case: every token is a two-character pair
+        return (d[starts] << 4) | d[starts + 1], rest
+    # Mixed widths: weigh each digit by its position from the end of its token
+    digits = d[digit]
+    ends = np.repeat(starts + lengths, lengths)
+    exp = ends - 1 - np.flatnonzero(digit)
+    if (digits[exp >= 2] != 0).any():
+        raise ValueError("Hex value out of byte range")
+    vals = np.zeros(len(starts), dtype=np.uint8)
+    tok = np.repeat(np.arange(len(starts)), lengths)
+    low = exp < 2
+    np.add.at(vals, tok[low], digits[low] << (4 * exp[low]).astype(np.uint8))
+    return vals, rest
+
+
+def _hex_row_width(path):
+    # Number of values on the first non-empty line, the row width of a HEX export.
+    # Read in blocks, so a file written as one long line is never loaded whole.
+    n = 0
+    rest = b''
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(_HEX_CHUNK)
+            if not block:
+                return n + len(_decode_hex_block(rest, final=True)[0])
+            *lines, tail = block.split(b'\n')
+            for line in lines:
+                n += len(_decode_hex_block(rest + line, final=True)[0])
+                rest = b''
+                if n:
+                    return n
+            vals, rest = _decode_hex_block(rest + tail, final=False)
+            n += len(vals)
+
+
+def parse_hex_file(path, forced_width=None):
+    # Stream the file in chunks; separators are whitespace , ; :
+    parts = []
+    rest = b''
+    with _tracer.span('hex parse'), open(path, 'rb') as f:
+        while True:
+            block = f.read(_HEX_CHUNK)
+            vals, rest = _decode_hex_block(rest + block, final=not block)
+            parts.append(vals)
+            if not block:
+                break
+    values = np.concatenate(parts) if len(parts) > 1 else parts[0]
+    if not len(values):
+        # Nothing to measure a row on; an empty file is an empty map
+        return np.zeros((0, int(forced_width) if forced_width else WIDTH), dtype=np.uint8)
+
+    if forced_width:
+        width = int(forced_width)
+    else:
+        width = _hex_row_width(path)
+        if width >= len(values):
+            # A single line (or a dump with no row breaks) carries no row width
+            width = WIDTH
+
+    if width <= 0:
+        raise ValueError("Could not determine width")
+
+    height = len(values) // width
+    arr = values[: height * width].reshape((height, width))
+    return arr
+
+
+def parse_dat_file(path):
+    log.debug('Reading %s', path)
+    with _tracer.span('read'), open(path, 'rb') as f:
+        raw = f.read()
+    if len(raw) >= 4 and raw[:4] in HmapLayout.MAGICS:
+        return _parse_hmap_binary(raw)
+    raise ValueError('Unsupported file format: expected HMAP .dat')
+
+    raise RuntimeError('Unexpected state')
+
+
+class HmapLayout:
+    # Parsed HMAP header. Row headers and blob are views into the source buffer,
+    # so parsing never copies the file or allocates per row.
+    __slots__ = ('endian', 'ver_major', 'ver_minor', 'pad', 'compressed', 'width', 'height',
+                 'bbmin', 'bbmax', 'length', 'headers_offset', 'blob_offset', 'dlen', 'rows', 'blob')
+
+    # Magic as stored on disk: big-endian files read 'HMAP', little-endian 'PAMH'
+    MAGIC = b'HMAP'
+    MAGIC_LE = b'PAMH'
+    MAGICS = (MAGIC, MAGIC_LE)
+    HEADER_SIZE = 44
+
+    def __init__(self, data):
+        import struct
+        size = len(data)
+        if size < 32:
+            raise ValueError('HMAP file too small to contain header')
+        magic_bytes = struct.unpack_from('4s', data, 0)[0]
+        if magic_bytes not in self.MAGICS:
+            raise ValueError('Not an HMAP file')
+        little_val = int.from_bytes(magic_bytes, byteorder='little')
+        magic_const = 0x484D4150
+        e = '<' if little_val == magic_const else '>'
+        self.endian = e
+        self.ver_major, self.ver_minor, self.pad, self.compressed, self.width, self.height = \
+            struct.unpack_from(e + 'BBHIHH', data, 4)
+        if size < 40:
+            raise ValueError('Corrupt HMAP: missing BBMin/BBMax vectors')
+        if size < self.HEADER_SIZE:
+            raise ValueError('Corrupt HMAP: missing data length')
+        self.bbmin = struct.unpack_from(e + 'fff', data, 16)
+        self.bbmax = struct.unpack_from(e + 'fff', data, 28)
+        self.length = struct.unpack_from(e + 'I', data, 40)[0]
+        off = self.headers_offset = self.HEADER_SIZE
+
+        # Compression headers: one (start, count, data_offset) record per row
+        row_dtype = np.dtype([('start', e + 'u2'), ('count', e + 'u2'), ('data_offset', e + 'i4')])
+        if self.compressed > 0:
+            if off + self.height * 8 > size:
+                raise ValueError('Corrupt HMAP: not enough bytes for compression headers')
+            self.rows = np.frombuffer(data, dtype=row_dtype, count=self.height, offset=off)
+            off += self.height * 8
+        else:
+            self.rows = np.zeros(0, dtype=row_dtype)
+
+        self.blob_offset = off
+        self.dlen = min(self.length, size - off)
+        self.blob = memoryview(data)[off:off + self.dlen]
+
+    def header(self):
+        # Plain copy of the scalar header fields, safe to keep after the buffer is gone
+        return {'endian': self.endian, 'ver_major': self.ver_major, 'ver_minor': self.ver_minor,
+                'pad': self.pad, 'compressed': self.compressed, 'width': self.width,
+                'height': self.height, 'bbmin': self.bbmin, 'bbmax': self.bbmax, 'length': self.length}
+
+    def release(self):
+        # Drop the views so an mmap backing them can be closed
+        self.rows = None
+        self.blob.release()
+
+
+def _compressed_index(rows, dlen, half, x0=0, x1=None):
+    # Flatten the (start, count, data_offset) row headers into one gather index.
+    # Cells whose Max or Min byte would fall outside the blob are skipped.
+    # x0/x1 clip every row span to a column window before the index is built.
+    starts = rows['start'].astype(np.int64)
+    counts = rows['count'].astype(np.int64)
+    offsets = rows['data_offset'].astype(np.int64)
+    if x0 > 0 or x1 is not None:
+        ends = starts + counts if x1 is None else np.minimum(starts + counts, x1)
+        starts = np.maximum(starts, x0)
+        counts = np.maximum(ends - starts, 0)
+    total = int(counts.sum())
+    ys = np.repeat(np.arange(len(rows), dtype=np.int64), counts)
+    # Position of each cell inside its row span
+    row_first = np.repeat(np.cumsum(counts) - counts, counts)
+    xs = np.arange(total, dtype=np.int64) - row_first + np.repeat(starts, counts)
+    offs = np.repeat(offsets, counts) + xs
+    keep = (offs >= 0) & (offs < dlen) & (offs + half >= 0) & (offs + half < dlen)
+    return ys[keep], xs[keep], offs[keep]
+
+
+class SharedSpanError(ValueError):
+    # An edit would write different values into bytes that several rows share
+    pass
+
+
+def _shared_ranges(layout):
+    # Sorted, disjoint [lo, hi) blob ranges that more than one row span points at
+    # (the encoder stores identical rows once), or None when no spans overlap.
+    # Only the row headers are read.
+    if layout.compressed <= 0:
+        return None
+    rows = layout.rows
+    counts = rows['count'].astype(np.int64)
+    used = counts > 0
+    begins = (rows['data_offset'].astype(np.int64) + rows['start'])[used]
+    ends = begins + counts[used]
+    if len(begins) < 2:
+        return None
+    order = np.argsort(begins, kind='stable')
+    begins, ends = begins[order], ends[order]
+    # Each span overlaps the earlier ones up to the furthest end seen so far
+    lo = begins[1:]
+    hi = np.minimum(ends[1:], np.maximum.accumulate(ends)[:-1])
+    keep = hi > lo
+    if not keep.any():
+        return None
+    lo, hi = lo[keep], np.maximum.accumulate(hi[keep])
+    first = np.flatnonzero(np.concatenate(([True], lo[1:] > hi[:-1])))
+    return lo[first], hi[np.append(first[1:] - 1, len(lo) - 1)]
+
+
+def _in_ranges(ranges, offs):
+    # (mask of the offsets inside one of the [lo, hi) ranges, index of that range)
+    lo, hi = ranges
+    k = np.searchsorted(lo, offs, side='right') - 1
+    return (k >= 0) & (offs < hi[np.maximum(k, 0)]), k
+
+
+def _aliased_rows(layout, ranges):
+    # Indices of the rows whose span covers at least one shared byte
+    rows = layout.rows
+    begins = rows['data_offset'].astype(np.int64) + rows['start']
+    ends = begins + rows['count']
+    lo, hi = ranges
+    k = np.searchsorted(lo, ends, side='left') - 1
+    return np.flatnonzero((rows['count'] > 0) & (k >= 0) & (hi[np.maximum(k, 0)] > begins))
+
+
+def _shared_targets(layout, new_arr, which, ranges, aliased, rows=None, command='repack'):
+    # (offsets, values) of the cells of the aliased rows, one entry per byte; rows
+    # (sorted) limits them to the bytes the listed rows cover. Raises
+    # SharedSpanError when rows sharing a byte want different values, which an
+    # in-place write cannot represent; the layout has to be rebuilt for that edit.
+    # Only the shared ranges get scratch space: any other byte has a single span.
+    dlen = layout.dlen
+    half = dlen // 2
+    aliased, reps = _span_groups(layout, new_arr, which, aliased, command)
+    lo, hi = ranges
+    base = np.cumsum(hi - lo) - (hi - lo)
+    size = int((hi - lo).sum())
+    at = np.zeros(size, dtype=np.uint8)
+    claimed = np.zeros(size, dtype=bool)
+    covered = claimed if rows is None else np.zeros(size, dtype=bool)
+    listed = None if rows is None else np.unique(reps[np.isin(aliased, rows)])
+    distinct = np.unique(reps)
+    own_offs, own_vals = [], []
+    for a, b in _row_chunks(0, len(distinct), layout.width):
+        part = distinct[a:b]
+        spans = layout.rows[part]
+        ys, xs, offs = _compressed_index(spans, dlen, half)
+        vals = new_arr[part[ys], xs]
+        del xs
+        # Most spans lie inside one range, found once per row
+        begins = spans['data_offset'].astype(np.int64) + spans['start']
+        k = np.searchsorted(lo, begins, side='right') - 1
+        whole = (k >= 0) & (begins + spans['count'] <= hi[np.maximum(k, 0)])
+        if whole.all():
+            slot = offs
+            slot += (base - lo)[k][ys]
+        else:
+            shared, k = _in_ranges(ranges, offs)
+            own = ~shared if listed is None else ~shared & np.isin(part, listed)[ys]
+            own_offs.append(offs[own])
+            own_vals.append(vals[own])
+            ys, vals, k = ys[shared], vals[shared], k[shared]
+            slot = offs[shared] + base[k] - lo[k]
+        del offs
+        # A byte claimed by an earlier block, or twice in this one, must get the
+        # same value from every row
+        prior = claimed[slot]
+        clash = np.zeros(len(slot), dtype=bool)
+        clash[prior] = at[slot[prior]] != vals[prior]
+        at[slot] = vals
+        claimed[slot] = True
+        clash |= at[slot] != vals
+        if clash.any():
+            i = int(np.argmax(clash))
+            r = int(np.searchsorted(base, slot[i], side='right')) - 1
+            o = int(slot[i] - base[r] + lo[r])
+            _raise_shared_conflict(layout, new_arr, which, aliased, o, int(part[ys[i]]), command)
+        if listed is not None:
+            covered[slot[np.isin(part, listed)[ys]]] = True
+    slot = np.flatnonzero(covered)
+    offs = np.concatenate(own_offs + [slot + np.repeat(lo - base, hi - lo)[slot]])
+    vals = np.concatenate(own_vals + [at[slot]])
+    if which != 'max':
+        offs += half
+    return offs, vals
+
+
+def _span_groups(layout, new_arr, which, aliased, command='repack'):
+    # Rows the encoder stored once have identical row headers. Within each such
+    # group the edit is compared row against row, and the group is represented by
+    # its first row. Returns (aliased, representative of each aliased row).
+    rows = layout.rows[aliased]
+    starts = rows['start'].astype(np.int64)
+    counts = rows['count'].astype(np.int64)
+    offsets = rows['data_offset'].astype(np.int64)
+    order = np.lexsort((offsets, counts, starts))
+    aliased, starts, counts, offsets = aliased[order], starts[order], counts[order], offsets[order]
+    # Spans with a byte outside the blob keep their own entry; the scatter skips those cells
+    inside = (offsets + starts >= 0) & (offsets + starts + counts + layout.dlen // 2 <= layout.dlen)
+    same = np.concatenate(([False], (starts[1:] == starts[:-1]) & (counts[1:] == counts[:-1])
+                           & (offsets[1:] == offsets[:-1]) & inside[1:] & inside[:-1]))
+    first = np.flatnonzero(~same)
+    reps = aliased[first][np.cumsum(~same) - 1]
+    for g in np.flatnonzero(np.diff(np.append(first, len(aliased))) > 1).tolist():
+        a = first[g]
+        b = first[g + 1] if g + 1 < len(first) else len(aliased)
+        s0, c = int(starts[a]), int(counts[a])
+        block = new_arr[aliased[a:b], s0:s0 + c]
+        diff = (block != block[0]).any(axis=1)
+        if diff.any():
+            o = int(offsets[a]) + s0 + int(np.argmax(block[np.argmax(diff)] != block[0]))
+            _raise_shared_conflict(layout, new_arr, which, aliased, o, int(aliased[a]), command)
+    return aliased, reps
+
+
+def _raise_shared_conflict(layout, new_arr, which, aliased, o, y, command='repack'):
+    # Name row y and another row that wants a different value in shared byte o;
+    # command is the CLI subcommand whose --rebuild writes the edit instead
+    rows = layout.rows[aliased]
+    xs = o - rows['data_offset'].astype(np.int64)
+    inside = (xs >= rows['start']) & (xs < rows['start'].astype(np.int64) + rows['count'])
+    ys, xs = aliased[inside], xs[inside]
+    other = int(ys[np.argmax(new_arr[ys, xs] != new_arr[y, o - int(layout.rows[y]['data_offset'])])])
+    y0, y1 = sorted((y, other))
+    raise SharedSpanError(f'{which.capitalize()} rows {y0} and {y1} share stored bytes '
+                          f'but are edited differently; rebuild the layout ({command} --rebuild, or '
+                          f'"Rebuild layout" in the GUI) to write this edit')
+
+
+def _row_chunks(y0, y1, width):
+    # [a, b) row blocks of about _CHUNK_CELLS cells covering rows y0..y1-1
+    step = max(1, _CHUNK_CELLS // max(width, 1))
+    for a in range(y0, y1, step):
+        yield a, min(a + step, y1)
+
+
+def _parse_hmap_binary(data: bytes):
+    # Parse GTA V Heightmap HMAP binary
+    with _tracer.span('header'):
+        layout = HmapLayout(data)
+    width, height, dlen = layout.width, layout.height, layout.dlen
+    if dlen < layout.length:
+        log.warning('HMAP length %d exceeds remaining %d bytes; clamping', layout.length, dlen)
+    blob = np.frombuffer(layout.blob, dtype=np.uint8)
+
+    max_arr = np.zeros((height, width), dtype=np.uint8)
+    min_arr = np.zeros((height, width), dtype=np.uint8)
+
+    with _tracer.span('decode'):
+        if layout.compressed > 0:
+            h2off = dlen // 2
+            for y0, y1 in _row_chunks(0, height, width):
+                ys, xs, offs = _compressed_index(layout.rows[y0:y1], dlen, h2off)
+                ys += y0
+                max_arr[ys, xs] = blob[offs]
+                min_arr[ys, xs] = blob[offs + h2off]
+        else:
+            flat_len = width * height
+            if dlen >= flat_len:
+                max_arr = blob[:flat_len].reshape((height, width))
+            if dlen >= 2 * flat_len:
+                min_arr = blob[flat_len:flat_len*2].reshape((height, width))
+
+    return max_arr, min_arr, width, height
+
+
+# World space: columns run along X from bbmin.x, rows along Y from bbmin.y, and a
+# byte v stands for height bbmin.z + v * (bbmax.z - bbmin.z) / 255. 0 marks no data.
+
+def _cell_size(header):
+    # (dx, dy) world size of one cell
+    w, h = header['width'], header['height']
+    if w <= 0 or h <= 0:
+        raise ValueError('Heightmap has no cells')
+    return ((header['bbmax'][0] - header['bbmin'][0]) / w, (header['bbmax'][1] - header['bbmin'][1]) / h)
+
+
+def _z_scale(header):
+    # (z0, dz) so that world Z = z0 + byte * dz
+    z0, z1 = header['bbmin'][2], header['bbmax'][2]
+    return z0, (z1 - z0) / 255.0
+
+
+def _world_to_grid(header, x, y):
+    # Fractional (column, row) of world coordinates, cell centres at .5
+    dx, dy = _cell_size(header)
+    return ((np.asarray(x, dtype=np.float64) - header['bbmin'][0]) / dx,
+            (np.asarray(y, dtype=np.float64) - header['bbmin'][1]) / dy)
+
+
+def _requantize_lut(header, z_min, z_max):
+    # 256-entry table mapping this map's bytes onto a z_min..z_max byte scale.
+    # 0 stays 0 (no data); real heights never round down to it.
+    z0, dz = _z_scale(header)
+    z = z0 + np.arange(256) * dz
+    span = z_max - z_min
+    q = np.rint((z - z_min) * (255.0 / span)) if span > 0 else np.full(256, 255.0)
+    lut = np.clip(q, 1, 255).astype(np.uint8)
+    lut[0] = 0
+    return lut
+
+
+class HeightField:
+    # World-space height queries on decoded layers. Cells cover
+    # [bbmin + i * cell, bbmin + (i + 1) * cell); nearest returns the height of the
+    # cell holding the point, bilinear blends the four surrounding cell centres
+    # (edges clamp, cells without data drop out of the blend). Points outside the
+    # bounds or with no data come back as NaN.
+    __slots__ = ('header', 'layers', 'zlut')
+
+    METHODS = ('nearest', 'bilinear')
+
+    def __init__(self, max_arr, min_arr, header):
+        if max_arr.shape != (header['height'], header['width']) or min_arr.shape != max_arr.shape:
+            raise ValueError(f"Layers must be {header['width']}x{header['height']}")
+        _cell_size(header)
+        self.header = header
+        self.layers = {'max': max_arr, 'min': min_arr}
+        z0, dz = _z_scale(header)
+        self.zlut = z0 + np.arange(256) * dz
+        self.zlut[0] = np.nan
+
+    @classmethod
+    def open(cls, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        layout = HmapLayout(data)
+        header = layout.header()
+        layout.release()
+        max_arr, min_arr, _w, _h = _parse_hmap_binary(data)
+        return cls(max_arr, min_arr, header)
+
+    def heights(self, x, y, which='max', method='nearest'):
+        # World Z (float64, same shape as x/y) of layer which at world (x, y)
+        if which not in self.layers:
+            raise ValueError("layer must be 'min' or 'max'")
+        if method not in self.METHODS:
+            raise ValueError(f"method must be one of {', '.join(self.METHODS)}")
+        arr = self.layers[which]
+        height, width = arr.shape
+        with _tracer.span('height query'):
+            gx, gy = _world_to_grid(self.header, x, y)
+            gx, gy = np.broadcast_arrays(gx, gy)
+            inside = (gx >= 0) & (gx < width) & (gy >= 0) & (gy < height)
+            out = np.full(gx.shape, np.nan)
+            gx, gy = gx[inside], gy[inside]
+            if method == 'nearest':
+                out[inside] = self.zlut[arr[gy.astype(np.intp), gx.astype(np.intp)]]
+                return out
+            # Offsets from the cell centres, clamped so edge half-cells take the edge value
+            u = np.clip(gx - 0.5, 0, width - 1)
+            v = np.clip(gy - 0.5, 0, height - 1)
+            c0 = u.astype(np.intp)
+            r0 = v.astype(np.intp)
+            c1 = np.minimum(c0 + 1, width - 1)
+            r1 = np.minimum(r0 + 1, height - 1)
+            fu = u - c0
+            fv = v - r0
+            total = np.zeros(len(u))
+            weight = np.zeros(len(u))
+            for r, c, w in ((r0, c0, (1 - fu) * (1 - fv)), (r0, c1, fu * (1 - fv)),
+                            (r1, c0, (1 - fu) * fv), (r1, c1, fu * fv)):
+                z = self.zlut[arr[r, c]]
+                valid = ~np.isnan(z)
+                total += np.where(valid, z, 0) * w
+                weight += np.where(valid, w, 0)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                out[inside] = np.where(weight > 0, total / weight, np.nan)
+        return out
+
+
+class HmapReader:
+    # Memory-mapped .dat reader: only the header is parsed up front and cells are
+    # decoded on demand, so memory follows the requested window, not the file.
+    def __init__(self, path):
+        import mmap
+        self.path = path
+        self.layout = None
+        self._file = open(path, 'rb')
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+        try:
+            self.layout = HmapLayout(self._mm)
+        except Exception:
+            self._mm.close()
+            self._file.close()
+            raise
+        self.width = self.layout.width
+        self.height = self.layout.height
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.layout is not None:
+            self.layout.release()
+            self.layout = None
+            self._mm.close()
+            self._file.close()
+
+    def rows(self, y0, y1):
+        # (max, min) for rows y0..y1-1
+        return self._decode(0, y0, self.width, y1, ('max', 'min'))
+
+    def tile(self, x0, y0, w, h):
+        # (max, min) for the w x h window at column x0, row y0
+        return self._decode(x0, y0, x0 + w, y0 + h, ('max', 'min'))
+
+    def layer(self, which):
+        if which not in ('min', 'max'):
+            raise ValueError("layer must be 'min' or 'max'")
+        return self._decode(0, 0, self.width, self.height, (which,))[0]
+
+    def _decode(self, x0, y0, x1, y1, layers):
+        if self.layout is None:
+            raise ValueError('Reader is closed')
+        layout = self.layout
+        if not (0 <= x0 <= x1 <= layout.width and 0 <= y0 <= y1 <= layout.height):
+            raise ValueError(f'Window ({x0}, {y0})-({x1}, {y1}) outside {layout.width}x{layout.height}')
+        dlen = layout.dlen
+        out = [np.zeros((y1 - y0, x1 - x0), dtype=np.uint8) for _ in layers]
+        blob = np.frombuffer(layout.blob, dtype=np.uint8)
+        try:
+            if layout.compressed > 0:
+                half = dlen // 2
+                for a, b in _row_chunks(y0, y1, x1 - x0):
+                    ys, xs, offs = _compressed_index(layout.rows[a:b], dlen, half, x0, x1)
+                    ys += a - y0
+                    xs -= x0
+                    for arr, which in zip(out, layers):
+                        arr[ys, xs] = blob[offs if which == 'max' else offs + half]
+            else:
+                flat_len = layout.width * layout.height
+                for arr, which in zip(out, layers):
+                    first = 0 if which == 'max' else flat_len
+                    if dlen >= first + flat_len:
+                        grid = blob[first:first + flat_len].reshape((layout.height, layout.width))
+                        arr[:] = grid[y0:y1, x0:x1]
+                        del grid
+        finally:
+            del blob
+        return tuple(out)
+
+
+class DecodeCache:
+    # Decoded layers keyed on file identity (path, size, mtime, CRC32 of the content).
+    # In-memory LRU bounded by max_bytes; disk_dir adds a zlib-compressed store that
+    # survives restarts. Cached arrays are read-only, copy them before editing.
+    DISK_MAGIC = b'HMC1'
+
+    def __init__(self, max_bytes=256 << 20, disk_dir=None):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def load(self, path):
+        # Returns (max_arr, min_arr, width, height, header)
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        with _tracer.span('read'), open(path, 'rb') as f:
+            data = f.read()
+        with _tracer.span('hash'):
+            key = (path, st.st_size, st.st_mtime_ns, zlib.crc32(data))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None and self.disk_dir:
+            entry = self._disk_load(key)
+            if entry is not None:
+                self._remember(key, entry)
+        if entry is None:
+            if data[:4] not in HmapLayout.MAGICS:
+                raise ValueError('Unsupported file format: expected HMAP .dat')
+            max_arr, min_arr, _w, _h = _parse_hmap_binary(data)
+            entry = (max_arr, min_arr, HmapLayout(data).header())
+            for arr in entry[:2]:
+                arr.flags.writeable = False
+            self._remember(key, entry)
+            if self.disk_dir:
+                self._disk_store(key, entry)
+        max_arr, min_arr, header = entry
+        return max_arr, min_arr, header['width'], header['height'], header
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remember(self, key, entry):
+        size = entry[0].nbytes + entry[1].nbytes
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = entry
+            self._bytes += size
+            # Evict least recently used, always keeping the newest entry
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _k, old = self._entries.popitem(last=False)
+                self._bytes -= old[0].nbytes + old[1].nbytes
+
+    def _disk_path(self, key):
+        import hashlib
+        return os.path.join(self.disk_dir, hashlib.sha1(repr(key).encode()).hexdigest() + '.hmc')
+
+    def _disk_load(self, key):
+        import json
+        import struct
+        try:
+            with open(self._disk_path(key), 'rb') as f:
+                raw = f.read()
+            if raw[:4] != self.DISK_MAGIC:
+                return None
+            n = struct.unpack_from('<I', raw, 4)[0]
+            meta = json.loads(raw[8:8 + n])
+            if meta['key'] != list(key):
+                return None
+            header = meta['header']
+            h, w = header['height'], header['width']
+            payload = zlib.decompress(raw[8 + n:])
+            arrs = np.frombuffer(payload, dtype=np.uint8).reshape((2, h, w))
+        except (OSError, ValueError, KeyError, zlib.error):
+            return None
+        header['bbmin'] = tuple(header['bbmin'])
+        header['bbmax'] = tuple(header['bbmax'])
+        return arrs[0], arrs[1], header
+
+    def _disk_store(self, key, entry):
+        import json
+        import struct
+        max_arr, min_arr, header = entry
+        meta = json.dumps({'key': list(key), 'header': header}).encode()
+        payload = zlib.compress(max_arr.tobytes() + min_arr.tobytes(), 1)
+        dest = self._disk_path(key)
+        tmp = dest + '.tmp'
+        try:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            with open(tmp, 'wb') as f:
+                f.write(self.DISK_MAGIC + struct.pack('<I', len(meta)) + meta + payload)
+            os.replace(tmp, dest)
+        except OSError:
+            pass
+
+
+# Shared by the GUI; set HMAP_CACHE_DIR to also keep decoded files on disk
+_decode_cache = DecodeCache(disk_dir=os.environ.get('HMAP_CACHE_DIR') or None)
+
+
+def _layer_targets(layout, new_arr, which, rows=None):
+    # Blob offsets (relative to the blob start) and values for one layer, one
+    # (offsets, values) pair per row block; rows (sorted, unique) limits it to those
+    # rows. No offset is yielded twice: bytes shared by several rows come once, in
+    # a final pair, after the check that those rows agree, so a conflicting edit
+    # fails before anything is written.
+    dlen, width = layout.dlen, layout.width
+    n = layout.height if rows is None else len(rows)
+    if layout.compressed > 0:
+        half = dlen // 2
+        ranges = _shared_ranges(layout)
+        aliased = None if ranges is None else _aliased_rows(layout, ranges)
+        tail = None
+        if aliased is not None:
+            tail = _shared_targets(layout, new_arr, which, ranges, aliased, rows)
+            plain = np.ones(layout.height, dtype=bool)
+            plain[aliased] = False
+        for a, b in _row_chunks(0, n, width):
+            part = slice(a, b) if rows is None else rows[a:b]
+            if aliased is not None:
+                # Aliased rows are written once, through tail
+                part = np.arange(a, b) if rows is None else part
+                part = part[plain[part]]
+            ys, xs, offs = _compressed_index(layout.rows[part], dlen, half)
+            ys = ys + a if isinstance(part, slice) else part[ys]
+            if which != 'max':
+                offs += half
+            yield offs, new_arr[ys, xs]
+        if tail is not None:
+            yield tail
+        return
+    flat_len = width * layout.height
+    first = 0 if which == 'max' else flat_len
+    stored = max(0, min(flat_len, dlen - first))
+    flat = new_arr.reshape(-1)
+    for a, b in _row_chunks(0, n, width):
+        if rows is None:
+            lo, hi = a * width, min(b * width, stored)
+            if lo >= hi:
+                break
+            yield np.arange(first + lo, first + hi, dtype=np.int64), flat[lo:hi]
+            continue
+        cells = (rows[a:b, None] * width + np.arange(width, dtype=np.int64)).reshape(-1)
+        cells = cells[cells < stored]
+        yield first + cells, flat[cells]
+
+
+def _update_hmap_binary(data: bytes, new_arr: np.ndarray, which: str):
+    # Replace either Max or Min array in existing HMAP blob
+    layout = HmapLayout(data)
+    if new_arr.shape != (layout.height, layout.width):
+        raise ValueError(f'Edited image must be {layout.width}x{layout.height}')
+    new_arr = np.asarray(new_arr, dtype=np.uint8)
+    # Single copy of the file; the layer is scattered straight into it
+    with _tracer.span('scatter'):
+        new_data = bytearray(data)
+        blob = np.frombuffer(new_data, dtype=np.uint8, count=layout.dlen, offset=layout.blob_offset)
+        for offs, vals in _layer_targets(layout, new_arr, which):
+            blob[offs] = vals
+        del blob
+    return new_data
+
+
+def _update_hmap_file_inplace(path, new_arr: np.ndarray, which: str, rows=None):
+    # Patch a .dat on disk through mmap, writing only the bytes whose value changed.
+    # rows limits the write to those row indices. Returns the number of bytes written.
+    import mmap
+    if rows is not None:
+        rows = np.unique(np.asarray(rows, dtype=np.int64))
+    with open(path, 'r+b') as f, mmap.mmap(f.fileno(), 0) as mm:
+        layout = HmapLayout(mm)
+        try:
+            if new_arr.shape != (layout.height, layout.width):
+                raise ValueError(f'Edited image must be {layout.width}x{layout.height}')
+            if rows is not None and len(rows) and (rows[0] < 0 or rows[-1] >= layout.height):
+                raise ValueError(f'Row index outside 0..{layout.height - 1}')
+            new_arr = np.asarray(new_arr, dtype=np.uint8)
+            blob = np.frombuffer(mm, dtype=np.uint8, count=layout.dlen, offset=layout.blob_offset)
+            written = 0
+            try:
+                with _tracer.span('scatter'):
+                    for offs, vals in _layer_targets(layout, new_arr, which, rows):
+                        changed = blob[offs] != vals
+                        blob[offs[changed]] = vals[changed]
+                        written += int(np.count_nonzero(changed))
+            finally:
+                del blob
+        finally:
+            layout.release()
+        if written:
+            mm.flush()
+    return written
+
+
+def _encode_hmap(max_arr, min_arr, header, compressed=None, endian=None):
+    # Build a complete HMAP file from both layers. Compressed output stores each
+    # row's tight non-zero span once; identical rows share one data_offset.
+    # header supplies version, pad and bounds (see HmapLayout.header()).
+    import struct
+    max_arr = np.asarray(max_arr, dtype=np.uint8)
+    min_arr = np.asarray(min_arr, dtype=np.uint8)
+    if max_arr.shape != min_arr.shape or max_arr.ndim != 2:
+        raise ValueError('Max and Min layers must be 2D arrays of the same shape')
+    height, width = max_arr.shape
+    if width > 0xFFFF or height > 0xFFFF:
+        raise ValueError(f'Heightmap {width}x{height} exceeds the HMAP size limit')
+    e = header['endian'] if endian is None else endian
+    if e not in ('<', '>'):
+        raise ValueError("endian must be '<' or '>'")
+    flag = header['compressed'] if compressed is None else int(bool(compressed))
+    row_dtype = np.dtype([('start', e + 'u2'), ('count', e + 'u2'), ('data_offset', e + 'i4')])
+    magic = HmapLayout.MAGIC if e == '>' else HmapLayout.MAGIC_LE
+    with _tracer.span('encode'):
+        if flag > 0:
+            import hashlib
+            starts = np.zeros(height, dtype=np.int64)
+            counts = np.zeros(height, dtype=np.int64)
+            for y0, y1 in _row_chunks(0, height, width):
+                used = (max_arr[y0:y1] != 0) | (min_arr[y0:y1] != 0)
+                has = used.any(axis=1)
+                first = np.argmax(used, axis=1)
+                last = width - 1 - np.argmax(used[:, ::-1], axis=1)
+                starts[y0:y1] = np.where(has, first, 0)
+                counts[y0:y1] = np.where(has, last - first + 1, 0)
+
+            rows = np.zeros(height, dtype=row_dtype)
+            rows['start'] = starts
+            rows['count'] = counts
+            # Spans are matched by digest and confirmed by comparison, so the
+            # table keeps no copy of the row data
+            spans = []
+            seen = {}
+            pos = 0
+            for y in np.flatnonzero(counts):
+                s0, c = int(starts[y]), int(counts[y])
+                mx, mn = max_arr[y, s0:s0 + c], min_arr[y, s0:s0 + c]
+                digest = hashlib.blake2b(mx.tobytes(), digest_size=16)
+                digest.update(mn.tobytes())
+                key = (s0, c, digest.digest())
+                hit = seen.get(key)
+                if hit is not None and np.array_equal(max_arr[hit[1], s0:s0 + c], mx) \
+                        and np.array_equal(min_arr[hit[1], s0:s0 + c], mn):
+                    at = hit[0]
+                else:
+                    at = pos
+                    seen.setdefault(key, (pos, y))
+                    spans.append((pos, y, s0, c))
+                    pos += c
+                rows['data_offset'][y] = at - s0
+            half = pos
+            blob_offset = HmapLayout.HEADER_SIZE + rows.nbytes
+            out = bytearray(blob_offset + 2 * half)
+            out[HmapLayout.HEADER_SIZE:blob_offset] = rows.tobytes()
+            buf = np.frombuffer(out, dtype=np.uint8)
+            for at, y, s0, c in spans:
+                buf[blob_offset + at:blob_offset + at + c] = max_arr[y, s0:s0 + c]
+                buf[blob_offset + half + at:blob_offset + half + at + c] = min_arr[y, s0:s0 + c]
+            blob_len = 2 * half
+        else:
+            flat_len = width * height
+            blob_offset = HmapLayout.HEADER_SIZE
+            out = bytearray(blob_offset + 2 * flat_len)
+            buf = np.frombuffer(out, dtype=np.uint8)
+            for first, arr in ((blob_offset, max_arr), (blob_offset + flat_len, min_arr)):
+                for y0, y1 in _row_chunks(0, height, width):
+                    buf[first + y0 * width:first + y1 * width] = arr[y0:y1].reshape(-1)
+            blob_len = 2 * flat_len
+        del buf
+
+    struct.pack_into(e + '4sBBHIHH3f3fI', out, 0, magic, header['ver_major'], header['ver_minor'], header['pad'],
+                     flag, width, height, *header['bbmin'], *header['bbmax'], blob_len)
+    return out
+
+
+def _rebuild_hmap_binary(data: bytes, new_arr: np.ndarray, which: str, endian=None):
+    # Like _update_hmap_binary, but re-encodes the file so edits outside the old
+    # row spans are kept and the layout is recomputed
+    layout = HmapLayout(data)
+    if new_arr.shape != (layout.height, layout.width):
+        raise ValueError(f'Edited image must be {layout.width}x{layout.height}')
+    header = layout.header()
+    layout.release()
+    max_arr, min_arr, _w, _h = _parse_hmap_binary(data)
+    if which == 'max':
+        max_arr = new_arr
+    else:
+        min_arr = new_arr
+    return _encode_hmap(max_arr, min_arr, header, endian=endian)
+
+
+class HmapPatch:
+    # Changed cells between two versions of a heightmap, as row runs. Layout
+    # (little-endian): magic, version, flags, width, height, run count, cell count,
+    # CRC32 of the body; then the body (zlib when flags & 1): the run table, the
+    # old values and the new values of every cell. Old values let apply verify it
+    # is patching the file the patch was made from.
+    __slots__ = ('width', 'height', 'runs', 'old', 'new')
+
+    MAGIC = b'HMPT'
+    VERSION = 1
+    FLAG_ZLIB = 1
+    HEAD = '<4sBBHHIII'
+    HEADER_SIZE = 22
+    LAYERS = ('max', 'min')
+    RUN_DTYPE = np.dtype([('layer', 'u1'), ('y', '<u2'), ('x', '<u2'), ('count', '<u2')])
+
+    def __init__(self, data):
+        import struct
+        if len(data) < self.HEADER_SIZE:
+            raise ValueError('Patch too small to contain header')
+        magic, version, flags, self.width, self.height, nruns, ncells, crc = \
+            struct.unpack_from(self.HEAD, data, 0)
+        if magic != self.MAGIC:
+            raise ValueError('Not an HMAP patch')
+        if version != self.VERSION:
+            raise ValueError(f'Unsupported patch version {version}')
+        body = bytes(data[self.HEADER_SIZE:])
+        if flags & self.FLAG_ZLIB:
+            try:
+                body = zlib.decompress(body)
+            except zlib.error as e:
+                raise ValueError(f'Corrupt patch: {e}') from None
+        table = nruns * self.RUN_DTYPE.itemsize
+        if len(body) != table + 2 * ncells or zlib.crc32(body) != crc:
+            raise ValueError('Corrupt patch: body does not match header')
+        self.runs = np.frombuffer(body, dtype=self.RUN_DTYPE, count=nruns)
+        self.old = np.frombuffer(body, dtype=np.uint8, count=ncells, offset=table)
+        self.new = np.frombuffer(body, dtype=np.uint8, count=ncells, offset=table + ncells)
+        runs = self.runs
+        if (int(runs['count'].sum(dtype=np.int64)) != ncells or (runs['layer'] >= len(self.LAYERS)).any()
+                or (runs['y'] >= self.height).any()
+                or (runs['x'].astype(np.int64) + runs['count'] > self.width).any()):
+            raise ValueError('Corrupt patch: run outside the heightmap')
+
+    def info(self):
+        # Per-layer changed cells, run counts and bounding box (x0, y0, x1, y1), exclusive
+        out = {'width': self.width, 'height': self.height, 'runs': len(self.runs),
+               'cells': len(self.new), 'layers': {}}
+        for code, which in enumerate(self.LAYERS):
+            r = self.runs[self.runs['layer'] == code]
+            if not len(r):
+                continue
+            ends = r['x'].astype(np.int64) + r['count']
+            out['layers'][which] = {'runs': len(r), 'cells': int(r['count'].sum(dtype=np.int64)),
+                                    'bbox': (int(r['x'].min()), int(r['y'].min()),
+                                             int(ends.max()), int(r['y'].max()) + 1)}
+        return out
+
+
+def make_patch(old, new, compress=True):
+    # Patch bytes turning the layers in old into those in new. Both are dicts of
+    # layer name ('max' / 'min') -> 2D uint8 array; layers missing from either are skipped.
+    import struct
+    runs, old_vals, new_vals = [], [], []
+    shape = None
+    with _tracer.span('patch diff'):
+        for code, which in enumerate(HmapPatch.LAYERS):
+            if which not in old or which not in new:
+                continue
+            a = np.asarray(old[which], dtype=np.uint8)
+            b = np.asarray(new[which], dtype=np.uint8)
+            if a.shape != b.shape or a.ndim != 2 or (shape is not None and a.shape != shape):
+                raise ValueError('Patch layers must be 2D arrays of the same shape')
+            shape = a.shape
+            height, width = shape
+            # A padding column keeps runs from wrapping into the next row
+            changed = np.zeros((height, width + 1), dtype=np.int8)
+            changed[:, :width] = a != b
+            edges = np.diff(changed.reshape(-1), prepend=0)
+            first = np.flatnonzero(edges == 1)
+            r = np.zeros(len(first), dtype=HmapPatch.RUN_DTYPE)
+            r['layer'] = code
+            r['y'], r['x'] = np.divmod(first, width + 1)
+            r['count'] = np.flatnonzero(edges == -1) - first
+            mask = changed[:, :width].astype(bool)
+            runs.append(r)
+            old_vals.append(a[mask])
+            new_vals.append(b[mask])
+    if shape is None:
+        raise ValueError('No layer present in both versions')
+    if shape[0] > 0xFFFF or shape[1] > 0xFFFF:
+        raise ValueError(f'Heightmap {shape[1]}x{shape[0]} exceeds the patch size limit')
+    runs = np.concatenate(runs)
+    old_vals = np.concatenate(old_vals)
+    body = runs.tobytes() + old_vals.tobytes() + np.concatenate(new_vals).tobytes()
+    head = struct.pack(HmapPatch.HEAD, HmapPatch.MAGIC, HmapPatch.VERSION,
+                       HmapPatch.FLAG_ZLIB if compress else 0, shape[1], shape[0],
+                       len(runs), len(old_vals), zlib.crc32(body))
+    return head + (zlib.compress(body, 6) if compress else body)
+
+
+def _patch_targets(layout, patch):
+    # Blob offsets of every patched cell, built from the run table so the cost
+    # follows the number of changed cells, not the size of the map
+    if (patch.width, patch.height) != (layout.width, layout.height):
+        raise ValueError(f'Patch is for a {patch.width}x{patch.height} map, file is {layout.width}x{layout.height}')
+    runs = patch.runs
+    ys = runs['y'].astype(np.int64)
+    xs = runs['x'].astype(np.int64)
+    counts = runs['count'].astype(np.int64)
+    is_min = runs['layer'] == HmapPatch.LAYERS.index('min')
+    dlen = layout.dlen
+    if layout.compressed > 0:
+        half = dlen // 2
+        rows = layout.rows[ys]
+        starts = rows['start'].astype(np.int64)
+        base = rows['data_offset'].astype(np.int64) + xs
+        bad = (xs < starts) | (xs + counts > starts + rows['count']) \
+            | (base < 0) | (base + counts - 1 + half >= dlen)
+        base += np.where(is_min, half, 0)
+    else:
+        flat_len = layout.width * layout.height
+        base = ys * layout.width + xs + np.where(is_min, flat_len, 0)
+        bad = base + counts > dlen
+    if bad.any():
+        r = runs[np.argmax(bad)]
+        raise ValueError(f"Patch writes {HmapPatch.LAYERS[r['layer']]} cells at row {r['y']}, "
+                         f"columns {r['x']}-{int(r['x']) + int(r['count']) - 1}, outside the stored row span")
+    # Expand each run into consecutive offsets
+    run_first = np.cumsum(counts) - counts
+    offs = np.arange(int(counts.sum()), dtype=np.int64) + np.repeat(base - run_first, counts)
+    ranges = _shared_ranges(layout)
+    if ranges is not None:
+        # Bytes other rows also point at take the patch only when every row sharing
+        # them ends up with the same value, the rule _update_hmap_binary follows
+        cell_min = np.repeat(is_min, counts)
+        hit = _in_ranges(ranges, offs - np.where(cell_min, dlen // 2, 0))[0]
+        if hit.any():
+            _check_shared_patch(layout, patch, ranges, cell_min, hit)
+    return offs
+
+
+def _check_shared_patch(layout, patch, ranges, cell_min, hit):
+    # Rebuild the aliased rows of each layer the patch writes shared bytes in, with
+    # the patch applied, and run the shared-span check on them. Rows that are not
+    # aliased stay zero and are never read.
+    runs = patch.runs
+    counts = runs['count'].astype(np.int64)
+    run_first = np.cumsum(counts) - counts
+    ys = np.repeat(runs['y'].astype(np.int64), counts)
+    xs = np.arange(len(cell_min), dtype=np.int64) + np.repeat(runs['x'].astype(np.int64) - run_first, counts)
+    aliased = _aliased_rows(layout, ranges)
+    dlen = layout.dlen
+    half = dlen // 2
+    blob = np.frombuffer(layout.blob, dtype=np.uint8)
+    try:
+        for which, sel in (('max', ~cell_min), ('min', cell_min)):
+            if not hit[sel].any():
+                continue
+            arr = np.zeros((layout.height, layout.width), dtype=np.uint8)
+            for a, b in _row_chunks(0, len(aliased), layout.width):
+                rys, rxs, roffs = _compressed_index(layout.rows[aliased[a:b]], dlen, half)
+                arr[aliased[a:b][rys], rxs] = blob[roffs + (half if which == 'min' else 0)]
+            arr[ys[sel], xs[sel]] = patch.new[sel]
+            _shared_targets(layout, arr, which, ranges, aliased, command='applypatch')
+    finally:
+        del blob
+
+
+def _patch_changes(current, patch, force):
+    # Which patched cells differ from the patch's new values. Unless forced, every
+    # cell must still hold the value the patch was made from.
+    if not force:
+        stale = np.count_nonzero(current != patch.old)
+        if stale:
+            raise ValueError(f'{stale} patched cells no longer match the patch source')
+    return current != patch.new
+
+
+def _apply_patch_binary(data: bytes, patch, force=False):
+    # Apply an HmapPatch (or patch bytes) to HMAP bytes; returns the new file
+    if not isinstance(patch, HmapPatch):
+        patch = HmapPatch(patch)
+    layout = HmapLayout(data)
+    offs = _patch_targets(layout, patch)
+    with _tracer.span('patch apply'):
+        new_data = bytearray(data)
+        blob = np.frombuffer(new_data, dtype=np.uint8, count=layout.dlen, offset=layout.blob_offset)
+        changed = _patch_changes(blob[offs], patch, force)
+        blob[offs[changed]] = patch.new[changed]
+        del blob
+    return new_data
+
+
+def _apply_patch_file_inplace(path, patch, force=False):
+    # Apply a patch to a .dat on disk through mmap; returns the number of bytes written.
+    # Nothing is written when any run falls outside the layout or the source check fails.
+    import mmap
+    if not isinstance(patch, HmapPatch):
+        patch = HmapPatch(patch)
+    with open(path, 'r+b') as f, mmap.mmap(f.fileno(), 0) as mm:
+        layout = HmapLayout(mm)
+        try:
+            offs = _patch_targets(layout, patch)
+            blob = np.frombuffer(mm, dtype=np.uint8, count=layout.dlen, offset=layout.blob_offset)
+            try:
+                with _tracer.span('patch apply'):
+                    changed = _patch_changes(blob[offs], patch, force)
+                    blob[offs[changed]] = patch.new[changed]
+                    written = int(np.count_nonzero(changed))
+            finally:
+                del blob
+        finally:
+            layout.release()
+        if written:
+            mm.flush()
+    return written
+
+
+def _apply_patch_rebuild(data: bytes, patch, force=False, endian=None):
+    # Apply a patch to the decoded layers and re-encode the file, so cells outside
+    # the stored row spans or in bytes shared between rows can be patched too
+    if not isinstance(patch, HmapPatch):
+        patch = HmapPatch(patch)
+    layout = HmapLayout(data)
+    if (patch.width, patch.height) != (layout.width, layout.height):
+        raise ValueError(f'Patch is for a {patch.width}x{patch.height} map, file is {layout.width}x{layout.height}')
+    header = layout.header()
+    layout.release()
+    max_arr, min_arr, _w, _h = _parse_hmap_binary(data)
+    runs = patch.runs
+    counts = runs['count'].astype(np.int64)
+    run_first = np.cumsum(counts) - counts
+    ys = np.repeat(runs['y'].astype(np.int64), counts)
+    xs = np.arange(int(counts.sum()), dtype=np.int64) + np.repeat(runs['x'].astype(np.int64) - run_first, counts)
+    is_min = np.repeat(runs['layer'] == HmapPatch.LAYERS.index('min'), counts)
+    with _tracer.span('patch apply'):
+        layers = [max_arr.copy(), min_arr.copy()]
+        current = np.where(is_min, layers[1][ys, xs], layers[0][ys, xs])
+        _patch_changes(current, patch, force)
+        for arr, sel in zip(layers, (~is_min, is_min)):
+            arr[ys[sel], xs[sel]] = patch.new[sel]
+    return _encode_hmap(layers[0], layers[1], header, endian=endian)
+
+
+BRUSH_MODES = ('raise', 'lower', 'flatten', 'smooth')
+# Largest change of one raise/lower dab at full strength, in height bytes
+BRUSH_STEP = 8
+
+
+def brush_dab(arr, cx, cy, radius, mode, strength=0.5, target=None, undo=None):
+    # One dab of a round brush centred on cell (cx, cy), edited in place with a
+    # linear falloff to the rim. strength is 0..1; flatten pulls towards target
+    # (default: the centre value). Returns the touched box (x0, y0, x1, y1),
+    # exclusive, or None when the dab misses the layer. undo, a list, gets
+    # (box, copy of the box before the dab) appended.
+    if mode not in BRUSH_MODES:
+        raise ValueError(f"mode must be one of {', '.join(BRUSH_MODES)}")
+    height, width = arr.shape
+    r = max(float(radius), 0.5)
+    x0, y0 = max(int(np.floor(cx - r)), 0), max(int(np.floor(cy - r)), 0)
+    x1, y1 = min(int(np.ceil(cx + r)) + 1, width), min(int(np.ceil(cy + r)) + 1, height)
+    if x1 <= x0 or y1 <= y0:
+        return None
+    yy, xx = np.ogrid[y0:y1, x0:x1]
+    weight = np.clip(1.0 - np.hypot(xx - cx, yy - cy) / r, 0.0, 1.0) * min(max(strength, 0.0), 1.0)
+    region = arr[y0:y1, x0:x1]
+    if undo is not None:
+        undo.append(((x0, y0, x1, y1), region.copy()))
+    v = region.astype(np.float32)
+    if mode == 'raise':
+        v += weight * BRUSH_STEP
+    elif mode == 'lower':
+        v -= weight * BRUSH_STEP
+    elif mode == 'flatten':
+        if target is None:
+            target = arr[min(max(int(round(cy)), 0), height - 1), min(max(int(round(cx)), 0), width - 1)]
+        v += (float(target) - v) * weight
+    else:
+        # 3x3 box mean, with one cell of edge-clamped context around the dab
+        py0, py1 = max(y0 - 1, 0), min(y1 + 1, height)
+        px0, px1 = max(x0 - 1, 0), min(x1 + 1, width)
+        ctx = np.pad(arr[py0:py1, px0:px1].astype(np.float32),
+                     ((1 - (y0 - py0), 1 - (py1 - y1)), (1 - (x0 - px0), 1 - (px1 - x1))), mode='edge')
+        h, w = y1 - y0, x1 - x0
+        mean = sum(ctx[dy:dy + h, dx:dx + w] for dy in range(3) for dx in range(3)) / 9.0
+        v += (mean - v) * weight
+    touched = weight > 0
+    region[touched] = np.clip(np.rint(v), 0, 255).astype(np.uint8)[touched]
+    return x0, y0, x1, y1
+
+
+def _undo_box(box, after, dabs):
+    # Values of box before a stroke, from its current values and the per-dab copies
+    # brush_dab(undo=...) kept; replayed newest first so each cell ends up with
+    # the value from before the first dab that touched it
+    before = after.copy()
+    bx, by = box[0], box[1]
+    for (x0, y0, x1, y1), prev in reversed(dabs):
+        before[y0 - by:y1 - by, x0 - bx:x1 - bx] = prev
+    return before
+
+
+class EditHistory:
+    # Undo/redo of layer edits. Each step keeps only the before/after copies of the
+    # box it changed; the oldest steps are dropped past max_bytes.
+    def __init__(self, max_bytes=64 << 20):
+        self.max_bytes = max_bytes
+        self._undo = []
+        self._redo = []
+        self._bytes = 0
+
+    def __len__(self):
+        return len(self._undo)
+
+    def push(self, which, box, before, after):
+        self._undo.append((which, box, before, after))
+        self._bytes += before.nbytes + after.nbytes
+        for _w, _b, old_before, old_after in self._redo:
+            self._bytes -= old_before.nbytes + old_after.nbytes
+        self._redo.clear()
+        while self._bytes > self.max_bytes and len(self._undo) > 1:
+            _w, _b, old_before, old_after = self._undo.pop(0)
+            self._bytes -= old_before.nbytes + old_after.nbytes
+
+    def clear(self):
+        self._undo.clear()
+        self._redo.clear()
+        self._bytes = 0
+
+    def undo(self, layers):
+        # Restore the last step into layers (dict of name -> array); returns (which, box) or None
+        return self._step(layers, self._undo, self._redo, 2)
+
+    def redo(self, layers):
+        return self._step(layers, self._redo, self._undo, 3)
+
+    def _step(self, layers, source, dest, field):
+        if not source:
+            return None
+        entry = source.pop()
+        dest.append(entry)
+        which, (x0, y0, x1, y1) = entry[0], entry[1]
+        layers[which][y0:y1, x0:x1] = entry[field]
+        return which, entry[1]
+
+
+def _normalize_lut(mn, mx):
+    # 256-entry table with the same float32 rounding as normalizing a float32 copy.
+    # Values outside mn..mx (after edits) saturate instead of wrapping.
+    if mx <= mn:
+        return np.zeros(256, dtype=np.uint8)
+    return np.clip((np.arange(256, dtype=np.float32) - mn) / (mx - mn) * 255.0, 0, 255).astype(np.uint8)
+
+
+def _normalize_to_uint8(arr, flip=False):
+    # Stretch a layer to 0..255. uint8 layers go through a lookup table, so the
+    # result is the only allocation; flip writes it in preview row order.
+    # Other dtypes are converted in row blocks to bound the float temporaries.
+    with _tracer.span('normalize'):
+        if arr.size == 0:
+            return np.zeros(arr.shape, dtype=np.uint8)
+        src = arr[::-1] if flip else arr
+        if arr.dtype == np.uint8:
+            return _normalize_lut(int(arr.min()), int(arr.max()))[src]
+        out = np.zeros(arr.shape, dtype=np.uint8)
+        mn = float(np.float32(arr.min()))
+        mx = float(np.float32(arr.max()))
+        if mx > mn:
+            for y0, y1 in _row_chunks(0, arr.shape[0], arr.shape[1]):
+                a = src[y0:y1].astype(np.float32)
+                out[y0:y1] = ((a - mn) / (mx - mn) * 255.0).astype(np.uint8)
+        return out
+
+
+def hex_to_png(in_path, out_path, width_override=None, scale=1):
+    from PIL import Image
+    # Row width comes from the first line unless overridden
+    arr = parse_hex_file(in_path, width_override)
+    img = Image.fromarray(arr, mode='L')
+    if scale and int(scale) > 1:
+        img = img.resize((img.width * int(scale), img.height * int(scale)), Image.NEAREST)
+    img.save(out_path)
+
+
+def png_to_hex(in_path, out_path, width_override=None, height_override=None, scale=1, leading_spaces=True, uppercase=True):
+    from PIL import Image
+    with _tracer.span('png read'):
+        img = Image.open(in_path).convert('L')
+    # The image keeps its own size unless a target size is given
+    size = (width_override or img.width, height_override or img.height)
+    if scale and int(scale) > 1:
+        size = (size[0] * int(scale), size[1] * int(scale))
+    if size != img.size:
+        with _tracer.span('resize'):
+            img = img.resize(size, Image.Resampling.BICUBIC)
+    _save_array_as_hex(np.asarray(img, dtype=np.uint8), out_path, leading_spaces, uppercase)
+
+
+# HEX writing: three output bytes ("XX ") per value, looked up per byte
+_HEX_UPPER = np.frombuffer(b''.join(b'%02X ' % i for i in range(256)), dtype=np.uint8).reshape(256, 3)
+_HEX_LOWER = np.frombuffer(b''.join(b'%02x ' % i for i in range(256)), dtype=np.uint8).reshape(256, 3)
+
+
+def _format_hex_rows(arr, leading_spaces=True, uppercase=True):
+    # One text line per row, built in a single vectorized pass.
+    # Lines end with os.linesep to match what text-mode writes produced.
+    lut = _HEX_UPPER if uppercase else _HEX_LOWER
+    h, w = arr.shape
+    lead = 2 if leading_spaces else 0
+    nl = np.frombuffer(os.linesep.encode(), dtype=np.uint8)
+    body = max(3 * w - 1, 0)
+    out = np.empty((h, lead + body + len(nl)), dtype=np.uint8)
+    out[:, :lead] = ord(' ')
+    if w:
+        out[:, lead:lead + body] = lut[arr].reshape(h, 3 * w)[:, :body]
+    out[:, lead + body:] = nl
+    return out
+
+
+def _save_array_as_hex(arr, path, leading_spaces=True, uppercase=True):
+    arr = np.asarray(arr, dtype=np.uint8)
+    rows = max(1, _HEX_CHUNK // (3 * arr.shape[1] + 4))
+    with open(path, 'wb') as f:
+        for y in range(0, arr.shape[0], rows):
+            with _tracer.span('hex format'):
+                text = _format_hex_rows(arr[y:y + rows], leading_spaces, uppercase)
+            with _tracer.span('hex write'):
+                f.write(text)
+
+
+def _write_png(img, path):
+    with _tracer.span('png write'):
+        img.save(path)
+
+
+def _preview_image(arr):
+    # Normalized layer in preview orientation, as shown and exported by the GUI.
+    # rotate(180) followed by FLIP_LEFT_RIGHT is a vertical flip, which the
+    # normalize gather applies for free.
+    from PIL import Image
+    return Image.fromarray(_normalize_to_uint8(arr, flip=True), mode='L')
+
+
+def _load_edited_png(path, apply_inverse=True, shape=None):
+    # Edited layer file back to a raw layer; apply_inverse undoes the preview
+    # orientation. Any format load_layer reads is accepted; shape is the
+    # (height, width) of the .dat it goes into.
+    return load_layer(path, shape, apply_inverse=apply_inverse)
+
+
+# Exact layer files, in preview orientation like the PNG exports: .npy, raw uint8
+# rows, or 16-bit greyscale PNG holding byte * 257
+LAYER_FORMATS = ('.npy', '.raw', '.png')
+
+
+def save_layer(arr, path):
+    # Write a layer losslessly; the format follows the extension
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in LAYER_FORMATS:
+        raise ValueError(f"Unsupported layer format {ext or path}; use {', '.join(LAYER_FORMATS)}")
+    vis = np.asarray(arr, dtype=np.uint8)[::-1]
+    height, width = vis.shape
+    with _tracer.span('layer write'):
+        if ext == '.npy':
+            out = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=vis.shape)
+            for y0, y1 in _row_chunks(0, height, width):
+                out[y0:y1] = vis[y0:y1]
+            out.flush()
+            del out
+        elif ext == '.raw':
+            with open(path, 'wb') as f:
+                for y0, y1 in _row_chunks(0, height, width):
+                    f.write(np.ascontiguousarray(vis[y0:y1]).tobytes())
+        else:
+            from PIL import Image
+            wide = vis.astype(np.uint16)
+            wide *= 257
+            Image.fromarray(wide).save(path)
+
+
+def load_layer(path, shape=None, apply_inverse=True):
+    # Layer from .npy (memory-mapped), .raw or PNG. 16-bit PNGs are rounded back
+    # to bytes; 8-bit PNGs of another size are resampled (bicubic) to shape,
+    # while .npy / .raw must match it exactly. Without shape a file keeps its own
+    # size; .raw has no header, so it needs one.
+    ext = os.path.splitext(path)[1].lower()
+    if shape is None and ext == '.raw':
+        raise ValueError(f'{path}: a .raw layer needs the (height, width) of its .dat')
+    height, width = shape or (None, None)
+    if ext == '.npy':
+        arr = np.load(path, mmap_mode='r')
+        if arr.dtype != np.uint8 or arr.ndim != 2 or (shape and arr.shape != (height, width)):
+            want = f'({height}, {width})' if shape else '2D'
+            raise ValueError(f'{path} holds {arr.dtype} {arr.shape}, expected uint8 {want}')
+    elif ext == '.raw':
+        if os.path.getsize(path) != width * height:
+            raise ValueError(f'{path} is {os.path.getsize(path)} bytes, expected {width * height} for {width}x{height}')
+        arr = np.memmap(path, dtype=np.uint8, mode='r', shape=(height, width))
+    else:
+        from PIL import Image
+        with _tracer.span('png read'):
+            img = Image.open(path)
+            img.load()
+        if img.mode in ('I;16', 'I;16B', 'I;16L', 'I'):
+            if shape and img.size != (width, height):
+                raise ValueError(f'{path} is {img.width}x{img.height}, expected {width}x{height}')
+            wide = np.asarray(img)
+            arr = np.empty(wide.shape, dtype=np.uint8)
+            for y0, y1 in _row_chunks(0, wide.shape[0], wide.shape[1]):
+                arr[y0:y1] = np.clip((wide[y0:y1].astype(np.int64) + 128) // 257, 0, 255)
+        else:
+            img = img.convert('L')
+            if shape and img.size != (width, height):
+                with _tracer.span('resize'):
+                    img = img.resize((width, height), Image.Resampling.BICUBIC)
+            arr = np.array(img, dtype=np.uint8)
+    # The preview orientation is a vertical flip, so undoing it is a view
+    return arr[::-1] if apply_inverse else arr
@@ -0,0 +1,185 @@
+# Heightmap diffs: one baseline .dat against many variants. Every row is first
+# reduced to a digest of its span and stored bytes, so rows whose bytes match are
+# skipped without decoding; only the remaining rows are decoded and compared.
+import hashlib
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import hmap_core as hm
+
+LAYERS = ('max', 'min')
+# Changed rows closer than this are reported as one band
+BAND_GAP = 4
+# Header fields that change the meaning of the cell bytes
+HEADER_FIELDS = ('compressed', 'bbmin', 'bbmax')
+
+
+def row_digests(layout):
+    # (height, 16) uint8 digests of each row's (start, count) span and its Max and
+    # Min bytes. Row offsets are left out, so a repacked but equal row still matches.
+    # The lengths of both slices go in first: slices clipped at the blob end would
+    # otherwise run together and let different rows hash alike.
+    blob = layout.blob
+    out = np.empty((layout.height, 16), dtype=np.uint8)
+    with hm._tracer.span('row hash'):
+        if layout.compressed > 0:
+            half = layout.dlen // 2
+            for y, (start, count, offset) in enumerate(layout.rows.tolist()):
+                first = max(offset + start, 0)
+                hi = blob[first:max(offset + start + count, first)]
+                lo = blob[first + half:max(offset + start + count + half, first + half)]
+                h = hashlib.blake2b(struct.pack('<HHII', start, count, len(hi), len(lo)), digest_size=16)
+                h.update(hi)
+                h.update(lo)
+                out[y] = np.frombuffer(h.digest(), dtype=np.uint8)
+        else:
+            width, flat_len = layout.width, layout.width * layout.height
+            for y in range(layout.height):
+                hi = blob[y * width:(y + 1) * width]
+                lo = blob[flat_len + y * width:flat_len + (y + 1) * width]
+                h = hashlib.blake2b(struct.pack('<II', len(hi), len(lo)), digest_size=16)
+                h.update(hi)
+                h.update(lo)
+                out[y] = np.frombuffer(h.digest(), dtype=np.uint8)
+    return out
+
+
+def _decode_rows(reader, index):
+    # (max, min) of the listed rows only, shaped (len(index), width); each run of
+    # consecutive rows is one HmapReader.rows call
+    out = [np.zeros((len(index), reader.width), dtype=np.uint8) for _ in LAYERS]
+    breaks = np.flatnonzero(np.diff(index) != 1) + 1
+    for a, b in zip(np.concatenate(([0], breaks)).tolist(), np.concatenate((breaks, [len(index)])).tolist()):
+        if a < b:
+            for arr, part in zip(out, reader.rows(int(index[a]), int(index[b - 1]) + 1)):
+                arr[a:b] = part
+    return out
+
+
+def _bands(rows, xs_lo, xs_hi, gap=BAND_GAP):
+    # Merge changed rows (sorted) into [x0, y0, x1, y1) boxes; rows within gap share a box
+    bands = []
+    for y, lo, hi in zip(rows.tolist(), xs_lo.tolist(), xs_hi.tolist()):
+        if bands and y - bands[-1][3] < gap:
+            b = bands[-1]
+            b[0], b[2], b[3] = min(b[0], lo), max(b[2], hi), y + 1
+        else:
+            bands.append([lo, y, hi, y + 1])
+    return bands
+
+
+def _layer_stats(old, new, rows):
+    # Cell statistics of one layer over the decoded rows, plus its changed bands
+    delta = new.astype(np.int16) - old
+    mask = delta != 0
+    changed = int(np.count_nonzero(mask))
+    st = {'changed_cells': changed, 'added_cells': int(np.count_nonzero(mask & (old == 0))),
+          'removed_cells': int(np.count_nonzero(mask & (new == 0))), 'raised_cells': 0, 'lowered_cells': 0,
+          'mean_delta': 0.0, 'mean_abs_delta': 0.0, 'min_delta': 0, 'max_delta': 0, 'bbox': None, 'bands': []}
+    if not changed:
+        return st, delta
+    d = delta[mask]
+    st.update(raised_cells=int(np.count_nonzero(d > 0)), lowered_cells=int(np.count_nonzero(d < 0)),
+              mean_delta=float(d.mean()), mean_abs_delta=float(np.abs(d).mean()),
+              min_delta=int(d.min()), max_delta=int(d.max()))
+    hit = mask.any(axis=1)
+    m = mask[hit]
+    width = mask.shape[1]
+    lo = m.argmax(axis=1)
+    hi = width - m[:, ::-1].argmax(axis=1)
+    st['bands'] = _bands(rows[hit], lo, hi)
+    st['bbox'] = [int(lo.min()), int(rows[hit][0]), int(hi.max()), int(rows[hit][-1]) + 1]
+    return st, delta
+
+
+def heatmap_image(base, delta, rows):
+    # RGB preview of one layer: the baseline in dim gray, raised cells in red and
+    # lowered cells in blue, brighter for larger changes
+    from PIL import Image
+    gray = hm._normalize_to_uint8(base) // 3
+    rgb = np.repeat(gray[:, :, None], 3, axis=2)
+    if len(rows):
+        scale = max(int(np.abs(delta).max()), 1)
+        level = (64 + np.abs(delta).astype(np.int32) * 191 // scale).astype(np.uint8)
+        band = rgb[rows]
+        band[delta != 0] = 0
+        band[..., 0] = np.where(delta > 0, level, band[..., 0])
+        band[..., 2] = np.where(delta < 0, level, band[..., 2])
+        rgb[rows] = band
+    return Image.fromarray(np.ascontiguousarray(rgb[::-1]), mode='RGB')
+
+
+def diff_files(base_path, path, base_digests=None, heatmap=None, heatmap_layer='max'):
+    # Compare path against base_path. base_digests (from row_digests) saves
+    # rehashing the baseline per variant. heatmap is an optional PNG path.
+    with hm.HmapReader(base_path) as a, hm.HmapReader(path) as b:
+        ha, hb = a.layout.header(), b.layout.header()
+        if (ha['width'], ha['height']) != (hb['width'], hb['height']):
+            raise ValueError(f"{path}: {hb['width']}x{hb['height']} does not match the baseline "
+                             f"{ha['width']}x{ha['height']}")
+        if base_digests is None:
+            base_digests = row_digests(a.layout)
+        digests = row_digests(b.layout)
+        rows = np.flatnonzero((digests != base_digests).any(axis=1))
+        with hm._tracer.span('row decode'):
+            old = _decode_rows(a, rows)
+            new = _decode_rows(b, rows)
+        result = {'path': path, 'width': ha['width'], 'height': ha['height'],
+                  'header_changes': [k for k in HEADER_FIELDS if ha[k] != hb[k]],
+                  'rows_hashed': ha['height'], 'rows_compared': len(rows), 'layers': {}}
+        deltas = {}
+        with hm._tracer.span('row diff'):
+            for which, o, n in zip(LAYERS, old, new):
+                result['layers'][which], deltas[which] = _layer_stats(o, n, rows)
+        if heatmap:
+            with hm._tracer.span('heatmap'):
+                heatmap_image(a.layer(heatmap_layer), deltas[heatmap_layer], rows).save(heatmap)
+            result['heatmap'] = heatmap
+    result['identical'] = not result['header_changes'] and not any(
+        st['changed_cells'] for st in result['layers'].values())
+    return result
+
+
+def _diff_task(base_path, path, base_digests, heatmap, heatmap_layer):
+    # Worker entry: failures become result entries so one bad variant does not stop the batch
+    try:
+        return dict(diff_files(base_path, path, base_digests, heatmap, heatmap_layer), ok=True)
+    except Exception as e:
+        return {'path': path, 'ok': False, 'error': f'{type(e).__name__}: {e}'}
+
+
+def diff_many(base_path, paths, heatmap_dir=None, heatmap_layer='max', jobs=None, progress=None):
+    # Diff every variant against one baseline on a process pool. The baseline is
+    # hashed once. Heatmaps go to heatmap_dir/<stem>_diff.png when it is given.
+    # progress(result, done, total) is called as results arrive, in completion order.
+    if heatmap_layer not in LAYERS:
+        raise ValueError("heatmap_layer must be 'min' or 'max'")
+    with hm.HmapReader(base_path) as a:
+        base_digests = row_digests(a.layout)
+
+    def target(path):
+        if not heatmap_dir:
+            return None
+        return os.path.join(heatmap_dir, os.path.splitext(os.path.basename(path))[0] + '_diff.png')
+
+    results = []
+
+    def done(res):
+        results.append(res)
+        if progress:
+            progress(res, len(results), len(paths))
+
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(paths) <= 1:
+        for path in paths:
+            done(_diff_task(base_path, path, base_digests, target(path), heatmap_layer))
+    else:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(paths))) as pool:
+            futures = [pool.submit(_diff_task, base_path, path, base_digests, target(path), heatmap_layer)
+                       for path in paths]
+            for fut in as_completed(futures):
+                done(fut.result())
+    return results
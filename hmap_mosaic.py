@@ -0,0 +1,133 @@
+# Georeferenced mosaics: many HMAP tiles placed on one world grid by their
+# BBMin/BBMax. Heights are requantized onto the Z range shared by all tiles and
+# the combined layers are written as .npy memmaps next to a JSON description.
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import hmap_core as hm
+
+OVERLAPS = ('max', 'min')
+
+
+def read_tile_headers(paths):
+    # Header fields of every tile plus its path; only the headers are read
+    headers = []
+    for path in paths:
+        with hm.HmapReader(path) as r:
+            headers.append(dict(r.layout.header(), path=path))
+    return headers
+
+
+def plan_grid(headers, cell=None):
+    # World grid covering every tile, as a header-like dict. cell defaults to the
+    # finest tile resolution on each axis.
+    if not headers:
+        raise ValueError('No tiles to place')
+    for h in headers:
+        if not (h['bbmax'][0] > h['bbmin'][0] and h['bbmax'][1] > h['bbmin'][1]) or h['width'] <= 0 or h['height'] <= 0:
+            raise ValueError(f"{h.get('path', 'tile')}: empty bounding box or grid")
+    if cell is None:
+        sizes = [hm._cell_size(h) for h in headers]
+        dx, dy = min(s[0] for s in sizes), min(s[1] for s in sizes)
+    else:
+        dx = dy = float(cell)
+        if dx <= 0:
+            raise ValueError('Cell size must be positive')
+    x0 = min(h['bbmin'][0] for h in headers)
+    y0 = min(h['bbmin'][1] for h in headers)
+    # Small tolerance so float bounds that land on a cell edge do not add a column
+    width = math.ceil((max(h['bbmax'][0] for h in headers) - x0) / dx - 1e-6)
+    height = math.ceil((max(h['bbmax'][1] for h in headers) - y0) / dy - 1e-6)
+    z_min = min(h['bbmin'][2] for h in headers)
+    z_max = max(h['bbmax'][2] for h in headers)
+    return {'width': width, 'height': height, 'cell': (dx, dy),
+            'bbmin': (x0, y0, z_min), 'bbmax': (x0 + width * dx, y0 + height * dy, z_max)}
+
+
+def _grid_span(lo, hi, origin, step, n):
+    # Grid cells [first, last) whose centres fall inside [lo, hi)
+    first = math.ceil((lo - origin) / step - 0.5)
+    last = math.ceil((hi - origin) / step - 0.5)
+    return max(first, 0), min(last, n)
+
+
+def _place_tile(path, grid):
+    # Decode one tile and resample it (nearest) onto its window of the grid.
+    # Returns (path, col0, row0, max window, min window) in grid bytes.
+    with hm.HmapReader(path) as r:
+        header = r.layout.header()
+        max_arr, min_arr = r.rows(0, r.height)
+    (gx, gy, z_min), (dx, dy) = grid['bbmin'], grid['cell']
+    c0, c1 = _grid_span(header['bbmin'][0], header['bbmax'][0], gx, dx, grid['width'])
+    r0, r1 = _grid_span(header['bbmin'][1], header['bbmax'][1], gy, dy, grid['height'])
+    cols, rows = hm._world_to_grid(header, gx + (np.arange(c0, c1) + 0.5) * dx, gy + (np.arange(r0, r1) + 0.5) * dy)
+    cols = np.clip(np.floor(cols).astype(np.int64), 0, header['width'] - 1)
+    rows = np.clip(np.floor(rows).astype(np.int64), 0, header['height'] - 1)
+    lut = hm._requantize_lut(header, z_min, grid['bbmax'][2])
+    window = np.ix_(rows, cols)
+    return path, c0, r0, lut[max_arr[window]], lut[min_arr[window]]
+
+
+def _merge(dst, win, overlap):
+    # Combine a tile window into the mosaic; 0 (no data) never wins
+    if overlap == 'max':
+        np.maximum(dst, win, out=dst)
+    else:
+        both = (dst != 0) & (win != 0)
+        dst[...] = np.where(both, np.minimum(dst, win), dst | win)
+
+
+def build_mosaic(paths, out_prefix, overlap='max', cell=None, jobs=None, write_hmap=False, progress=None):
+    # Place every tile on a shared grid and write <out_prefix>_max.npy, _min.npy and
+    # .json (plus .dat with write_hmap). Tiles are decoded on a process pool and
+    # merged as they finish; overlaps keep the higher or lower height.
+    # progress(path, done, total) is called after each tile. Returns the description.
+    if overlap not in OVERLAPS:
+        raise ValueError(f"overlap must be one of {', '.join(OVERLAPS)}")
+    headers = read_tile_headers(paths)
+    grid = plan_grid(headers, cell)
+    shape = (grid['height'], grid['width'])
+    out_max = np.lib.format.open_memmap(out_prefix + '_max.npy', mode='w+', dtype=np.uint8, shape=shape)
+    out_min = np.lib.format.open_memmap(out_prefix + '_min.npy', mode='w+', dtype=np.uint8, shape=shape)
+    placed = {}
+
+    def merge(result):
+        path, c0, r0, win_max, win_min = result
+        h, w = win_max.shape
+        with hm._tracer.span('mosaic merge'):
+            _merge(out_max[r0:r0 + h, c0:c0 + w], win_max, overlap)
+            _merge(out_min[r0:r0 + h, c0:c0 + w], win_min, overlap)
+        placed[path] = (c0, r0, c0 + w, r0 + h)
+        if progress:
+            progress(path, len(placed), len(paths))
+
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(paths) == 1:
+        for path in paths:
+            merge(_place_tile(path, grid))
+    else:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(paths))) as pool:
+            for fut in as_completed([pool.submit(_place_tile, path, grid) for path in paths]):
+                merge(fut.result())
+    out_max.flush()
+    out_min.flush()
+
+    desc = dict(grid, overlap=overlap, layers={'max': out_prefix + '_max.npy', 'min': out_prefix + '_min.npy'},
+                tiles=[{'path': h['path'], 'width': h['width'], 'height': h['height'], 'bbmin': h['bbmin'],
+                        'bbmax': h['bbmax'], 'window': placed[h['path']]} for h in headers])
+    if write_hmap:
+        if max(shape) > 0xFFFF:
+            raise ValueError(f'Mosaic {shape[1]}x{shape[0]} exceeds the HMAP size limit')
+        first = headers[0]
+        header = {'endian': first['endian'], 'ver_major': first['ver_major'], 'ver_minor': first['ver_minor'],
+                  'pad': 0, 'compressed': 1, 'bbmin': grid['bbmin'], 'bbmax': grid['bbmax']}
+        with open(out_prefix + '.dat', 'wb') as f:
+            f.write(hm._encode_hmap(out_max, out_min, header))
+        desc['hmap'] = out_prefix + '.dat'
+    with open(out_prefix + '.json', 'w') as f:
+        json.dump(desc, f, indent=2)
+    return desc
@@ -0,0 +1,375 @@
+# Local HTTP service for heightmap data: .dat files are decoded once and served as
+# PNG tiles, raw layer slices and world-coordinate height lookups. Plain asyncio
+# with a minimal HTTP/1.1 parser (keep-alive, GET/POST), so it needs nothing
+# beyond the codec dependencies. Files are reloaded when they change on disk.
+#
+#   GET  /maps                                      loaded maps and their headers
+#   GET  /maps/<name>/tile/<layer>/<z>/<tx>/<ty>.png  256px tile, 2**z pixels per cell
+#   GET  /maps/<name>/slice/<layer>?x0=&y0=&x1=&y1=[&format=npy]  raw bytes
+#   GET  /maps/<name>/height?x=1,2&y=3,4[&layer=max&method=bilinear]
+#   POST /maps/<name>/height  {"x": [...], "y": [...], "layer": ..., "method": ...}
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import sys
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs, unquote
+
+import numpy as np
+
+import hmap_core as hm
+
+TILE_SIZE = 256
+MAX_ZOOM = 4
+# Largest slice served in one response, in cells
+MAX_SLICE_CELLS = 16 << 20
+MAX_BODY = 16 << 20
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class TileCache:
+    # Rendered responses in an LRU bounded by max_bytes. Keys carry the map's
+    # version, so entries of a reloaded file simply age out.
+    def __init__(self, max_bytes=64 << 20):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            body = self._entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key, body):
+        with self._lock:
+            if key in self._entries or len(body) > self.max_bytes:
+                return
+            self._entries[key] = body
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                _k, old = self._entries.popitem(last=False)
+                self._bytes -= len(old)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes, 'hits': self.hits, 'misses': self.misses}
+
+
+class MapEntry:
+    # One loaded .dat: decoded layers, height lookups and the preview tables
+    __slots__ = ('name', 'path', 'state', 'version', 'field', 'luts')
+
+    def __init__(self, name, path, version=0):
+        self.name = name
+        self.path = path
+        self.version = version
+        self.state = _file_state(path)
+        self.field = hm.HeightField.open(path)
+        # Whole-layer normalization so neighbouring tiles match
+        self.luts = {which: hm._normalize_lut(int(arr.min()), int(arr.max())) if arr.size else np.zeros(256, np.uint8)
+                     for which, arr in self.field.layers.items()}
+
+    def info(self):
+        h = self.field.header
+        return {'name': self.name, 'path': self.path, 'version': self.version, 'width': h['width'],
+                'height': h['height'], 'bbmin': h['bbmin'], 'bbmax': h['bbmax'], 'tile_size': TILE_SIZE,
+                'max_zoom': MAX_ZOOM}
+
+
+def _file_state(path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def render_tile(entry, which, z, tx, ty):
+    # PNG bytes of one tile in preview orientation (rows bottom-up, like the GUI)
+    from PIL import Image
+    arr = entry.field.layers[which]
+    height, width = arr.shape
+    scale = 1 << z
+    cells = TILE_SIZE // scale
+    x0, y0 = tx * cells, ty * cells
+    if tx < 0 or ty < 0 or x0 >= width or y0 >= height:
+        raise HttpError(404, f'Tile {z}/{tx}/{ty} is outside the map')
+    x1, y1 = min(x0 + cells, width), min(y0 + cells, height)
+    # Preview rows y0..y1 are raw rows height-y1..height-y0, reversed
+    vis = entry.luts[which][arr[height - y1:height - y0, x0:x1][::-1]]
+    if scale > 1:
+        vis = vis.repeat(scale, axis=0).repeat(scale, axis=1)
+    out = io.BytesIO()
+    with hm._tracer.span('tile render'):
+        Image.fromarray(vis, mode='L').save(out, format='PNG', compress_level=1)
+    return out.getvalue()
+
+
+def render_slice(entry, which, x0, y0, x1, y1, fmt):
+    # Raw layer bytes for columns x0..x1, rows y0..y1 (raw orientation), plus
+    # headers carrying the shape so clients can reshape them
+    if fmt not in ('raw', 'npy'):
+        raise HttpError(400, "Format must be 'raw' or 'npy'")
+    arr = entry.field.layers[which]
+    height, width = arr.shape
+    if not (0 <= x0 < x1 <= width and 0 <= y0 < y1 <= height):
+        raise HttpError(400, f'Slice ({x0}, {y0})-({x1}, {y1}) outside {width}x{height}')
+    if (x1 - x0) * (y1 - y0) > MAX_SLICE_CELLS:
+        raise HttpError(413, f'Slice larger than {MAX_SLICE_CELLS} cells')
+    part = np.ascontiguousarray(arr[y0:y1, x0:x1])
+    shape = {'X-Width': x1 - x0, 'X-Height': y1 - y0}
+    if fmt == 'npy':
+        out = io.BytesIO()
+        np.save(out, part)
+        return out.getvalue(), 'application/octet-stream', shape
+    return part.tobytes(), 'application/octet-stream', shape
+
+
+def query_heights(entry, xs, ys, which, method):
+    try:
+        x = np.asarray(xs, dtype=np.float64)
+        y = np.asarray(ys, dtype=np.float64)
+    except (TypeError, ValueError):
+        raise HttpError(400, 'x and y must be numbers') from None
+    if x.ndim != 1 or x.shape != y.shape:
+        raise HttpError(400, 'x and y must be lists of the same length')
+    try:
+        z = entry.field.heights(x, y, which, method)
+    except ValueError as e:
+        raise HttpError(400, str(e)) from None
+    # NaN (outside / no data) becomes null
+    return {'layer': which, 'method': method, 'z': [None if math.isnan(v) else v for v in z.tolist()]}
+
+
+class HeightmapService:
+    def __init__(self, paths, cache_bytes=64 << 20, reload_interval=1.0):
+        self.entries = {}
+        for path in paths:
+            name = os.path.splitext(os.path.basename(path))[0]
+            if name in self.entries:
+                raise ValueError(f'Two maps are named {name}')
+            self.entries[name] = MapEntry(name, path)
+        self.cache = TileCache(cache_bytes)
+        self.reload_interval = reload_interval
+
+    async def watch(self):
+        # Reload files whose mtime or size changed; a failed reload keeps the old data
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            for name, entry in list(self.entries.items()):
+                try:
+                    state = _file_state(entry.path)
+                except OSError:
+                    # Being replaced; look again next time
+                    continue
+                if state == entry.state:
+                    continue
+                # A failed reload keeps the old data and is retried on the next change
+                entry.state = state
+                try:
+                    self.entries[name] = await loop.run_in_executor(None, MapEntry, name, entry.path, entry.version + 1)
+                    hm.log.info('Reloaded %s (version %d)', entry.path, entry.version + 1)
+                except (OSError, ValueError) as e:
+                    hm.log.warning('Reload of %s failed: %s', entry.path, e)
+
+    def _entry(self, name):
+        entry = self.entries.get(unquote(name))
+        if entry is None:
+            raise HttpError(404, f'No map named {name}')
+        return entry
+
+    async def handle(self, method, target, body):
+        # Returns (status, content type, body bytes, extra headers)
+        url = urlsplit(target)
+        parts = [p for p in url.path.split('/') if p]
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        loop = asyncio.get_running_loop()
+        if parts == ['maps']:
+            return 200, 'application/json', _json({'maps': [e.info() for e in self.entries.values()],
+                                                   'cache': self.cache.stats()}), {}
+        if len(parts) < 3 or parts[0] != 'maps':
+            raise HttpError(404, 'Unknown path')
+        entry = self._entry(parts[1])
+        kind = parts[2]
+        if kind == 'height':
+            if method == 'POST':
+                try:
+                    req = json.loads(body or b'{}')
+                    xs, ys = req['x'], req['y']
+                except (ValueError, KeyError, TypeError):
+                    raise HttpError(400, 'Body must be JSON with x and y lists') from None
+                which, how = req.get('layer', 'max'), req.get('method', 'nearest')
+            else:
+                try:
+                    xs = [float(v) for v in query['x'].split(',')]
+                    ys = [float(v) for v in query['y'].split(',')]
+                except (KeyError, ValueError):
+                    raise HttpError(400, 'x and y are required comma separated numbers') from None
+                which, how = query.get('layer', 'max'), query.get('method', 'nearest')
+            return 200, 'application/json', _json(query_heights(entry, xs, ys, which, how)), {}
+        if method != 'GET':
+            raise HttpError(405, 'Only GET is supported here')
+        if kind == 'tile' and len(parts) == 7 and parts[6].endswith('.png'):
+            which = _layer_name(parts[3])
+            try:
+                z, tx, ty = int(parts[4]), int(parts[5]), int(parts[6][:-4])
+            except ValueError:
+                raise HttpError(400, 'Tile coordinates must be integers') from None
+            if not 0 <= z <= MAX_ZOOM:
+                raise HttpError(400, f'Zoom must be 0..{MAX_ZOOM}')
+            key = (entry.name, entry.version, which, z, tx, ty)
+            png = self.cache.get(key)
+            if png is None:
+                png = await loop.run_in_executor(None, render_tile, entry, which, z, tx, ty)
+                self.cache.put(key, png)
+            return 200, 'image/png', png, {}
+        if kind == 'slice' and len(parts) == 4:
+            which = _layer_name(parts[3])
+            height, width = entry.field.layers[which].shape
+            try:
+                box = [int(query.get(k, d)) for k, d in (('x0', 0), ('y0', 0), ('x1', width), ('y1', height))]
+            except ValueError:
+                raise HttpError(400, 'Slice bounds must be integers') from None
+            data, ctype, shape = await loop.run_in_executor(None, render_slice, entry, which, *box,
+                                                            query.get('format', 'raw'))
+            return 200, ctype, data, shape
+        raise HttpError(404, 'Unknown path')
+
+    async def serve_client(self, reader, writer):
+        # One connection; requests are answered in order until the client closes
+        try:
+            while True:
+                request = await _read_request(reader)
+                if request is None:
+                    break
+                method, target, headers, body = request
+                try:
+                    status, ctype, payload, extra = await self.handle(method, target, body)
+                except HttpError as e:
+                    status, ctype, payload, extra = e.status, 'application/json', _json({'error': str(e)}), {}
+                except Exception as e:
+                    hm.log.exception('Request %s failed', target)
+                    status, ctype, payload, extra = 500, 'application/json', _json({'error': f'{type(e).__name__}: {e}'}), {}
+                keep = headers.get('connection', '').lower() != 'close'
+                head = [f'HTTP/1.1 {status} {REASONS.get(status, "")}', f'Content-Type: {ctype}',
+                        f'Content-Length: {len(payload)}', 'Connection: ' + ('keep-alive' if keep else 'close')]
+                head += [f'{k}: {v}' for k, v in extra.items()]
+                writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + payload)
+                await writer.drain()
+                if not keep:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except HttpError as e:
+            body = _json({'error': str(e)})
+            writer.write(f'HTTP/1.1 {e.status} {REASONS.get(e.status, "")}\r\nContent-Type: application/json\r\n'
+                         f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode('latin-1') + body)
+        finally:
+            writer.close()
+
+
+def _layer_name(name):
+    if name not in ('min', 'max'):
+        raise HttpError(400, "Layer must be 'min' or 'max'")
+    return name
+
+
+def _json(obj):
+    return json.dumps(obj).encode()
+
+
+async def _read_request(reader):
+    # (method, target, headers, body), or None when the client closed the connection
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, _version = line.decode('latin-1').split()
+    except ValueError:
+        raise HttpError(400, 'Malformed request line') from None
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        key, _, value = line.decode('latin-1').partition(':')
+        headers[key.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get('content-length', 0) or 0)
+    except ValueError:
+        raise HttpError(400, 'Malformed Content-Length header') from None
+    if length < 0:
+        raise HttpError(400, 'Malformed Content-Length header')
+    if length > MAX_BODY:
+        raise HttpError(413, 'Request body too large')
+    body = await reader.readexactly(length) if length else b''
+    return method.upper(), target, headers, body
+
+
+async def serve(paths, host='127.0.0.1', port=8765, cache_bytes=64 << 20, reload_interval=1.0, ready=None):
+    service = HeightmapService(paths, cache_bytes, reload_interval)
+    server = await asyncio.start_server(service.serve_client, host, port)
+    watcher = asyncio.create_task(service.watch())
+    addr = server.sockets[0].getsockname()
+    print(f"Serving {', '.join(service.entries)} on http://{addr[0]}:{addr[1]}", flush=True)
+    if ready:
+        ready(addr)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        watcher.cancel()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Serve heightmap tiles, slices and height lookups over HTTP')
+    parser.add_argument('inputs', nargs='+', help='.dat files or directories')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--cache-mb', type=int, default=64, help='Tile cache size (default: 64 MB)')
+    parser.add_argument('--reload-interval', type=float, default=1.0, help='Seconds between file change checks')
+    parser.add_argument('-v', '--verbose', action='count', default=0, help='Log info messages (-vv: debug)')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    hm._setup_logging(args.verbose)
+    paths = []
+    for p in args.inputs:
+        if os.path.isdir(p):
+            paths += [os.path.join(p, n) for n in sorted(os.listdir(p)) if n.lower().endswith('.dat')]
+        else:
+            paths.append(p)
+    if not paths:
+        print('No input files found', file=sys.stderr)
+        return 3
+    try:
+        asyncio.run(serve(paths, args.host, args.port, args.cache_mb << 20, args.reload_interval))
+    except KeyboardInterrupt:
+        pass
+    except (OSError, ValueError) as e:
+        print(f'Cannot serve: {e}', file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Tests import the modules from the repository root, like the scripts do
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
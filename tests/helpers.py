@@ -0,0 +1,39 @@
+import struct
+
+import numpy as np
+
+
+def build_hmap(width, height, rows=None, blob=b'', endian='>', length=None):
+    # Raw HMAP bytes from explicit (start, count, data_offset) rows and blob, so
+    # tests can describe layouts the encoder would never write
+    magic = b'HMAP' if endian == '>' else b'PAMH'
+    compressed = int(rows is not None)
+    head = struct.pack(endian + '4sBBHIHH3f3fI', magic, 1, 1, 0, compressed, width, height,
+                       0.0, 0.0, 0.0, float(width), float(height), 255.0,
+                       len(blob) if length is None else length)
+    body = b''.join(struct.pack(endian + 'HHi', *r) for r in rows) if compressed else b''
+    return head + body + bytes(blob)
+
+
+def random_hmap(rng, width, height, endian='>', compressed=True, shared=False, wild=False):
+    # Random layout: one span per row with its own blob range; shared points some
+    # rows at another row's bytes, wild adds offsets that leave the blob
+    if not compressed:
+        blob = rng.integers(0, 256, 2 * width * height, dtype=np.uint8).tobytes()
+        return build_hmap(width, height, None, blob, endian)
+    rows = []
+    pos = 0
+    for _ in range(height):
+        start = int(rng.integers(0, width))
+        count = int(rng.integers(0, width - start + 1))
+        rows.append([start, count, pos - start])
+        pos += count
+    if shared and height > 1:
+        for y in rng.choice(height, size=max(1, height // 3), replace=False):
+            src = rows[int(rng.integers(0, height))]
+            rows[y] = list(src)
+    if wild:
+        for y in rng.choice(height, size=max(1, height // 4), replace=False):
+            rows[y][2] += int(rng.integers(-3 * width, 3 * width))
+    blob = rng.integers(0, 256, 2 * pos, dtype=np.uint8).tobytes()
+    return build_hmap(width, height, rows, blob, endian)
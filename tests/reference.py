@@ -0,0 +1,97 @@
+# The original per-cell loops from before the codecs were vectorized, kept as
+# the reference the fast paths are compared against
+import re
+import struct
+
+import numpy as np
+
+WIDTH = 183
+
+
+def read_header(data):
+    magic = data[:4]
+    if magic not in (b'HMAP', b'PAMH'):
+        raise ValueError('Not an HMAP file')
+    e = '<' if int.from_bytes(magic, byteorder='little') == 0x484D4150 else '>'
+    compressed, width, height = struct.unpack_from(e + 'IHH', data, 8)
+    length = struct.unpack_from(e + 'I', data, 40)[0]
+    off = 44
+    rows = []
+    if compressed > 0:
+        for _ in range(height):
+            rows.append(struct.unpack_from(e + 'HHi', data, off))
+            off += 8
+    dlen = min(length, len(data) - off)
+    return compressed, width, height, rows, off, dlen
+
+
+def parse_hmap(data):
+    compressed, width, height, rows, off, dlen = read_header(data)
+    blob = data[off:off + dlen]
+    max_arr = np.zeros((height, width), dtype=np.uint8)
+    min_arr = np.zeros((height, width), dtype=np.uint8)
+    if compressed > 0:
+        h2off = dlen // 2
+        for y in range(height):
+            start, count, data_offset = rows[y]
+            for i in range(count):
+                x = start + i
+                o = data_offset + x
+                if 0 <= o < dlen and 0 <= (o + h2off) < dlen:
+                    max_arr[y, x] = blob[o]
+                    min_arr[y, x] = blob[o + h2off]
+    else:
+        flat_len = width * height
+        if len(blob) >= flat_len:
+            max_arr = np.frombuffer(blob[:flat_len], dtype=np.uint8).reshape((height, width))
+        if len(blob) >= 2 * flat_len:
+            min_arr = np.frombuffer(blob[flat_len:flat_len * 2], dtype=np.uint8).reshape((height, width))
+    return max_arr, min_arr, width, height
+
+
+def update_hmap(data, new_arr, which):
+    compressed, width, height, rows, off, dlen = read_header(data)
+    blob = bytearray(data[off:off + dlen])
+    if compressed > 0:
+        half = dlen // 2
+        for y in range(height):
+            start, count, data_offset = rows[y]
+            for i in range(count):
+                x = start + i
+                o = data_offset + x
+                if 0 <= o < dlen and 0 <= (o + half) < dlen:
+                    if which == 'max':
+                        blob[o] = int(new_arr[y, x])
+                    else:
+                        blob[o + half] = int(new_arr[y, x])
+    else:
+        flat_len = width * height
+        if which == 'max':
+            blob[:flat_len] = new_arr.astype(np.uint8).tobytes()
+        else:
+            blob[flat_len:flat_len * 2] = new_arr.astype(np.uint8).tobytes()
+    new_data = bytearray(data)
+    new_data[off:off + dlen] = blob[:dlen]
+    return bytes(new_data)
+
+
+def parse_hex(path, forced_width=None):
+    with open(path, 'r') as f:
+        raw = f.read()
+    tokens = [t for t in re.split(r'[\s,;:]+', raw) if t]
+    try:
+        values = [int(t, 16) for t in tokens]
+    except ValueError:
+        raise ValueError('File contains non-hex tokens')
+    width = int(forced_width) if forced_width else WIDTH
+    height = len(values) // width
+    return np.array(values[:height * width], dtype=np.uint8).reshape((height, width))
+
+
+def normalize(arr):
+    a = arr.astype(np.float32)
+    mn = float(a.min())
+    mx = float(a.max())
+    if mx <= mn:
+        return (a * 0).astype(np.uint8)
+    return ((a - mn) / (mx - mn) * 255.0).astype(np.uint8)
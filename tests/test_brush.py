@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+import hmap_core as hm
+
+
+@pytest.mark.parametrize('mode', hm.BRUSH_MODES)
+def test_undo_box_restores_stroke(mode):
+    rng = np.random.default_rng(70)
+    for _ in range(10):
+        arr = rng.integers(0, 256, (40, 50), dtype=np.uint8)
+        original = arr.copy()
+        dabs, box = [], None
+        for cx, cy in rng.uniform(-5, 55, (12, 2)):
+            b = hm.brush_dab(arr, cx, cy, rng.uniform(0.5, 8), mode, 1.0, 128, undo=dabs)
+            if b is not None:
+                box = b if box is None else (min(box[0], b[0]), min(box[1], b[1]),
+                                             max(box[2], b[2]), max(box[3], b[3]))
+        if box is None:
+            continue
+        x0, y0, x1, y1 = box
+        before = hm._undo_box(box, arr[y0:y1, x0:x1].copy(), dabs)
+        np.testing.assert_array_equal(before, original[y0:y1, x0:x1])
+        outside = np.ones(arr.shape, bool)
+        outside[y0:y1, x0:x1] = False
+        np.testing.assert_array_equal(arr[outside], original[outside])
+
+
+def test_dab_outside_layer_records_nothing():
+    arr = np.zeros((10, 10), np.uint8)
+    dabs = []
+    assert hm.brush_dab(arr, -20, -20, 3, 'raise', undo=dabs) is None
+    assert dabs == []
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+import hmap_core as hm
+import reference
+from helpers import build_hmap, random_hmap
+
+
+def assert_same_decode(data):
+    got = hm._parse_hmap_binary(data)
+    want = reference.parse_hmap(data)
+    assert got[2:] == want[2:]
+    np.testing.assert_array_equal(got[0], want[0])
+    np.testing.assert_array_equal(got[1], want[1])
+
+
+@pytest.mark.parametrize('endian', ['<', '>'])
+@pytest.mark.parametrize('compressed', [True, False])
+def test_random_layouts_match_reference(endian, compressed):
+    rng = np.random.default_rng(1)
+    for _ in range(20):
+        w, h = (int(v) for v in rng.integers(1, 40, 2))
+        assert_same_decode(random_hmap(rng, w, h, endian, compressed))
+
+
+@pytest.mark.parametrize('endian', ['<', '>'])
+def test_offsets_outside_blob_are_skipped(endian):
+    rng = np.random.default_rng(2)
+    for _ in range(20):
+        w, h = (int(v) for v in rng.integers(1, 40, 2))
+        assert_same_decode(random_hmap(rng, w, h, endian, wild=True))
+
+
+@pytest.mark.parametrize('endian', ['<', '>'])
+@pytest.mark.parametrize('compressed', [True, False])
+def test_truncated_blob_matches_reference(endian, compressed):
+    rng = np.random.default_rng(3)
+    for cut in (1, 7, 50):
+        data = random_hmap(rng, 17, 9, endian, compressed)
+        # Header length still claims the full blob; the decoder clamps it
+        assert_same_decode(data[:-cut])
+
+
+def test_shared_offsets_match_reference():
+    rng = np.random.default_rng(4)
+    for _ in range(20):
+        assert_same_decode(random_hmap(rng, 23, 11, shared=True))
+
+
+def test_row_chunks_do_not_change_the_result(monkeypatch):
+    rng = np.random.default_rng(5)
+    data = random_hmap(rng, 31, 40, wild=True)
+    monkeypatch.setattr(hm, '_CHUNK_CELLS', 37)
+    assert_same_decode(data)
+
+
+def test_span_beyond_width_fails_like_reference():
+    data = build_hmap(4, 2, [(2, 5, 0), (0, 0, 0)], bytes(range(20)))
+    with pytest.raises(IndexError):
+        reference.parse_hmap(data)
+    with pytest.raises(IndexError):
+        hm._parse_hmap_binary(data)
+
+
+@pytest.mark.parametrize('chunk', [1 << 20, 5])
+def test_reader_window_matches_reference(tmp_path, monkeypatch, chunk):
+    monkeypatch.setattr(hm, '_CHUNK_CELLS', chunk)
+    rng = np.random.default_rng(6)
+    data = random_hmap(rng, 29, 21, wild=True)
+    path = tmp_path / 'map.dat'
+    path.write_bytes(data)
+    full_max, full_min, _w, _h = reference.parse_hmap(data)
+    with hm.HmapReader(str(path)) as r:
+        win_max, win_min = r.tile(3, 4, 20, 15)
+    np.testing.assert_array_equal(win_max, full_max[4:19, 3:23])
+    np.testing.assert_array_equal(win_min, full_min[4:19, 3:23])
@@ -0,0 +1,77 @@
+import numpy as np
+
+import hmap_core as hm
+import hmap_diff
+from helpers import build_hmap, random_hmap
+
+
+def write(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_decoded_rows_match_full_decode(tmp_path):
+    rng = np.random.default_rng(40)
+    for i in range(10):
+        w, h = (int(v) for v in rng.integers(1, 30, 2))
+        path = write(tmp_path, f'{i}.dat', random_hmap(rng, w, h, wild=True, compressed=bool(i % 3)))
+        index = np.flatnonzero(rng.random(h) < 0.5)
+        full = hm.parse_dat_file(path)
+        with hm.HmapReader(path) as r:
+            got = hmap_diff._decode_rows(r, index)
+        for arr, layer in zip(got, full[:2]):
+            np.testing.assert_array_equal(arr, layer[index])
+
+
+def test_changed_cells_are_counted(tmp_path):
+    rng = np.random.default_rng(41)
+    data = random_hmap(rng, 20, 15, shared=True)
+    base = write(tmp_path, 'base.dat', data)
+    max_arr = hm._parse_hmap_binary(data)[0].copy()
+    max_arr[[2, 3, 9], 4] += 1
+    variant = write(tmp_path, 'v.dat', bytes(hm._rebuild_hmap_binary(data, max_arr, 'max')))
+    res = hmap_diff.diff_files(base, variant)
+    assert res['layers']['max']['changed_cells'] == 3
+    assert res['layers']['min']['changed_cells'] == 0
+
+
+def test_clipped_slices_do_not_hash_alike(tmp_path):
+    # Both rows feed bytes 5, 6 to the digest: the first as one Max and one Min byte
+    # (its first cell sits before the blob), the second as two Max bytes whose Min
+    # bytes lie past the blob end. Only the first stores a cell.
+    a = write(tmp_path, 'a.dat', build_hmap(2, 1, [(0, 2, -1)], bytes([5, 0, 6, 0])))
+    b = write(tmp_path, 'b.dat', build_hmap(2, 1, [(0, 2, 2)], bytes([0, 0, 5, 6])))
+    res = hmap_diff.diff_files(a, b)
+    assert res['rows_compared'] == 1
+    assert res['layers']['max']['changed_cells'] == 1
+    assert not res['identical']
+
+
+def test_span_past_right_edge_is_clipped(tmp_path):
+    # Decoded like HmapReader: the part of row 1 past column 8 is dropped
+    rng = np.random.default_rng(42)
+    base = write(tmp_path, 'base.dat', random_hmap(rng, 8, 4))
+    bad = write(tmp_path, 'bad.dat', build_hmap(8, 4, [(0, 0, 0), (6, 5, 0), (0, 0, 0), (0, 0, 0)],
+                                                bytes(range(1, 23))))
+    res = hmap_diff.diff_files(base, bad)
+    with hm.HmapReader(bad) as r:
+        assert r.rows(1, 2)[0][0, 6:].tolist() == [7, 8]
+    assert res['rows_compared'] == 4
+
+
+def test_failed_variant_does_not_stop_batch(tmp_path, monkeypatch):
+    rng = np.random.default_rng(43)
+    base = write(tmp_path, 'base.dat', random_hmap(rng, 8, 4))
+    real = hmap_diff.diff_files
+
+    def diff_files(base_path, path, *args):
+        if path.endswith('bad.dat'):
+            raise IndexError('span past the row end')
+        return real(base_path, path, *args)
+
+    monkeypatch.setattr(hmap_diff, 'diff_files', diff_files)
+    bad = write(tmp_path, 'bad.dat', b'')
+    results = hmap_diff.diff_many(base, [bad, base], jobs=1)
+    assert [r['ok'] for r in results] == [False, True]
+    assert results[0]['error'].startswith('IndexError')
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+import hmap_core as hm
+import reference
+
+
+def write(tmp_path, text, name='map.txt'):
+    path = tmp_path / name
+    path.write_text(text)
+    return str(path)
+
+
+def random_text(rng, width, height, prefix=False):
+    # Rows of tokens in the shapes int(t, 16) accepts: one or two digits, leading
+    # zeros, either case, optional 0x, mixed separators
+    lines = []
+    for _ in range(height):
+        toks = []
+        for v in rng.integers(0, 256, width).tolist():
+            t = rng.choice([f'{v:02X}', f'{v:x}', f'{v:04x}'])
+            if prefix and rng.random() < 0.3:
+                t = rng.choice(['0x', '0X']) + t
+            toks.append(t)
+        seps = rng.choice([' ', ',', ', ', ';', ':', '\t'], size=width - 1)
+        lines.append(toks[0] + ''.join(s + t for s, t in zip(seps, toks[1:])))
+    return '\n'.join(lines) + '\n'
+
+
+@pytest.mark.parametrize('prefix', [False, True])
+def test_tokens_match_reference(tmp_path, prefix):
+    rng = np.random.default_rng(50)
+    for _ in range(10):
+        w, h = (int(v) for v in rng.integers(1, 40, 2))
+        path = write(tmp_path, random_text(rng, w, h, prefix))
+        np.testing.assert_array_equal(hm.parse_hex_file(path), reference.parse_hex(path, w))
+        np.testing.assert_array_equal(hm.parse_hex_file(path, w), reference.parse_hex(path, w))
+
+
+def test_tokens_split_across_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(hm, '_HEX_CHUNK', 7)
+    rng = np.random.default_rng(51)
+    path = write(tmp_path, random_text(rng, 13, 11, prefix=True))
+    np.testing.assert_array_equal(hm.parse_hex_file(path), reference.parse_hex(path, 13))
+
+
+@pytest.mark.parametrize('text', ['', '\n\n', ' , ;\n'])
+def test_empty_file_is_an_empty_map(tmp_path, text):
+    path = write(tmp_path, text)
+    want = reference.parse_hex(path)
+    got = hm.parse_hex_file(path)
+    assert got.shape == want.shape == (0, hm.WIDTH)
+
+
+@pytest.mark.parametrize('text', ['0x', '1x2', '00x1f', 'x1f', '0xx1', 'zz', '1ff'])
+def test_bad_tokens_are_rejected(tmp_path, text):
+    path = write(tmp_path, f'01 {text} 02\n')
+    with pytest.raises(ValueError):
+        hm.parse_hex_file(path)
+
+
+@pytest.mark.parametrize('chunk', [7, 1 << 22])
+def test_single_line_uses_default_width(tmp_path, monkeypatch, chunk):
+    monkeypatch.setattr(hm, '_HEX_CHUNK', chunk)
+    rng = np.random.default_rng(52)
+    values = rng.integers(0, 256, 3 * hm.WIDTH)
+    path = write(tmp_path, ' '.join(f'{v:02x}' for v in values.tolist()) + '\n')
+    got = hm.parse_hex_file(path)
+    assert got.shape == (3, hm.WIDTH)
+    np.testing.assert_array_equal(got, reference.parse_hex(path))
+    assert hm.parse_hex_file(path, 9).shape == (61, 9)
+
+
+def test_row_width_skips_leading_blank_lines(tmp_path, monkeypatch):
+    monkeypatch.setattr(hm, '_HEX_CHUNK', 5)
+    path = write(tmp_path, '\n \n0a 0b 0c\n0d 0e 0f\n')
+    np.testing.assert_array_equal(hm.parse_hex_file(path), [[10, 11, 12], [13, 14, 15]])
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+import hmap_core as hm
+
+HEADER = {'endian': '>', 'ver_major': 1, 'ver_minor': 1, 'pad': 0, 'compressed': 1,
+          'bbmin': (0.0, 0.0, 0.0), 'bbmax': (1.0, 1.0, 1.0)}
+
+
+def random_layers(rng, width, height):
+    # Sparse layers with empty rows and repeated rows, like real maps
+    max_arr = rng.integers(0, 256, (height, width), dtype=np.uint8)
+    max_arr[rng.random((height, width)) < 0.4] = 0
+    max_arr[rng.random(height) < 0.2] = 0
+    if height > 2:
+        max_arr[1] = max_arr[0]
+    return max_arr, max_arr // 2
+
+
+@pytest.mark.parametrize('endian', ['<', '>'])
+@pytest.mark.parametrize('compressed', [True, False])
+def test_encode_is_independent_of_row_blocks(monkeypatch, endian, compressed):
+    rng = np.random.default_rng(80)
+    for _ in range(10):
+        w, h = (int(v) for v in rng.integers(1, 40, 2))
+        max_arr, min_arr = random_layers(rng, w, h)
+        want = hm._encode_hmap(max_arr, min_arr, HEADER, compressed, endian)
+        with monkeypatch.context() as m:
+            m.setattr(hm, '_CHUNK_CELLS', 37)
+            got = hm._encode_hmap(max_arr, min_arr, HEADER, compressed, endian)
+        assert got == want
+        decoded = hm._parse_hmap_binary(bytes(got))
+        np.testing.assert_array_equal(decoded[0], max_arr)
+        np.testing.assert_array_equal(decoded[1], min_arr)
+
+
+@pytest.mark.parametrize('ext', ['.npy', '.raw', '.png'])
+def test_layer_files_round_trip_across_row_blocks(tmp_path, monkeypatch, ext):
+    monkeypatch.setattr(hm, '_CHUNK_CELLS', 37)
+    rng = np.random.default_rng(81)
+    arr = rng.integers(0, 256, (23, 17), dtype=np.uint8)
+    path = str(tmp_path / f'layer{ext}')
+    hm.save_layer(arr, path)
+    np.testing.assert_array_equal(hm.load_layer(path, arr.shape), arr)
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+import hmap_core as hm
+import reference
+
+
+@pytest.mark.parametrize('flip', [False, True])
+def test_uint8_matches_reference(flip):
+    rng = np.random.default_rng(60)
+    for _ in range(30):
+        h, w = (int(v) for v in rng.integers(1, 50, 2))
+        lo, hi = sorted(int(v) for v in rng.integers(0, 256, 2))
+        arr = rng.integers(lo, hi + 1, (h, w), dtype=np.uint8)
+        want = reference.normalize(arr)
+        np.testing.assert_array_equal(hm._normalize_to_uint8(arr, flip), want[::-1] if flip else want)
+
+
+@pytest.mark.parametrize('dtype', [np.uint16, np.int16, np.float32, np.float64])
+def test_other_dtypes_match_reference_across_row_blocks(monkeypatch, dtype):
+    monkeypatch.setattr(hm, '_CHUNK_CELLS', 37)
+    rng = np.random.default_rng(61)
+    for _ in range(10):
+        h, w = (int(v) for v in rng.integers(1, 40, 2))
+        arr = (rng.random((h, w)) * 5000 - 1000).astype(dtype)
+        np.testing.assert_array_equal(hm._normalize_to_uint8(arr), reference.normalize(arr))
+        np.testing.assert_array_equal(hm._normalize_to_uint8(arr, True), reference.normalize(arr)[::-1])
+
+
+@pytest.mark.parametrize('arr', [np.full((4, 5), 9, np.uint8), np.full((3, 3), 7.5, np.float32),
+                                 np.zeros((0, 183), np.uint8)])
+def test_flat_and_empty_layers(arr):
+    np.testing.assert_array_equal(hm._normalize_to_uint8(arr), np.zeros(arr.shape, np.uint8))
+
+
+def test_lut_saturates_outside_range():
+    lut = hm._normalize_lut(10, 20)
+    assert lut[:11].tolist() == [0] * 11 and lut[20:].tolist() == [255] * 236
@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+
+import hmap_core as hm
+from helpers import random_hmap
+
+HEADER = {'endian': '>', 'ver_major': 1, 'ver_minor': 1, 'pad': 0, 'compressed': 1,
+          'bbmin': (0.0, 0.0, 0.0), 'bbmax': (8.0, 5.0, 1.0)}
+
+
+def layers(data):
+    max_arr, min_arr, _w, _h = hm._parse_hmap_binary(data)
+    return {'max': max_arr, 'min': min_arr}
+
+
+def shared_file():
+    # Rows 0, 2 and 4 are identical, so the encoder stores them once
+    max_arr = np.arange(1, 41, dtype=np.uint8).reshape(5, 8)
+    max_arr[2] = max_arr[4] = max_arr[0]
+    return bytes(hm._encode_hmap(max_arr, max_arr // 2 + 1, HEADER))
+
+
+@pytest.mark.parametrize('which', ['max', 'min'])
+def test_patch_into_shared_bytes_is_refused(tmp_path, which):
+    data = shared_file()
+    old = layers(data)
+    new = {which: old[which].copy()}
+    new[which][2, 3] += 1
+    patch = hm.make_patch({which: old[which]}, new)
+    with pytest.raises(hm.SharedSpanError, match='applypatch --rebuild'):
+        hm._apply_patch_binary(data, patch)
+    path = tmp_path / 'map.dat'
+    path.write_bytes(data)
+    with pytest.raises(hm.SharedSpanError):
+        hm._apply_patch_file_inplace(str(path), patch)
+    assert path.read_bytes() == data
+    got = layers(bytes(hm._apply_patch_rebuild(data, patch)))
+    np.testing.assert_array_equal(got[which], new[which])
+
+
+@pytest.mark.parametrize('which', ['max', 'min'])
+def test_consistent_patch_into_shared_bytes_is_written(tmp_path, which):
+    # The same edit to every row sharing the bytes, which _update_hmap_binary accepts too
+    data = shared_file()
+    old = layers(data)
+    new = {which: old[which].copy()}
+    new[which][[0, 2, 4], 3] += 1
+    new[which][1, 6] = 99
+    patch = hm.make_patch({which: old[which]}, new)
+    want = layers(bytes(hm._update_hmap_binary(data, new[which], which)))
+    np.testing.assert_array_equal(want[which], new[which])
+    out = layers(bytes(hm._apply_patch_binary(data, patch)))
+    np.testing.assert_array_equal(out[which], new[which])
+    path = tmp_path / 'map.dat'
+    path.write_bytes(data)
+    hm._apply_patch_file_inplace(str(path), patch)
+    np.testing.assert_array_equal(layers(path.read_bytes())[which], new[which])
+
+
+def test_patch_outside_shared_rows_is_written():
+    data = shared_file()
+    old = layers(data)
+    new = old['max'].copy()
+    new[1, 5] = 200
+    out = hm._apply_patch_binary(data, hm.make_patch({'max': old['max']}, {'max': new}))
+    np.testing.assert_array_equal(layers(bytes(out))['max'], new)
+
+
+def test_rebuild_matches_span_patch():
+    rng = np.random.default_rng(20)
+    for _ in range(10):
+        w, h = (int(v) for v in rng.integers(1, 30, 2))
+        data = random_hmap(rng, w, h)
+        old = layers(data)
+        # Only cells inside the stored spans, so the span patch accepts it
+        stored = layers(bytes(hm._update_hmap_binary(data, np.full((h, w), 1, np.uint8), 'max')))['max'] == 1
+        new = {k: np.where(stored & (rng.random((h, w)) < 0.3), rng.integers(0, 256, (h, w)), v).astype(np.uint8)
+               for k, v in old.items()}
+        patch = hm.make_patch(old, new)
+        a = layers(bytes(hm._apply_patch_binary(data, patch)))
+        b = layers(bytes(hm._apply_patch_rebuild(data, patch)))
+        for k in a:
+            np.testing.assert_array_equal(a[k], b[k])
+
+
+def test_rebuild_checks_patch_source():
+    data = shared_file()
+    old = layers(data)
+    new = old['max'].copy()
+    new[0, 0] = 99
+    stale = {'max': old['max'].copy()}
+    stale['max'][0, 0] = 7
+    with pytest.raises(ValueError, match='no longer match'):
+        hm._apply_patch_rebuild(data, hm.make_patch(stale, {'max': new}))
+
+
+def test_patch_and_update_share_the_shared_span_rule():
+    rng = np.random.default_rng(21)
+    outcomes = set()
+    for _ in range(60):
+        w, h = (int(v) for v in rng.integers(2, 12, 2))
+        data = random_hmap(rng, w, h, shared=True)
+        old = layers(data)
+        # Only cells inside the stored spans, so the span patch accepts it
+        stored = layers(bytes(hm._update_hmap_binary(data, np.full((h, w), 1, np.uint8), 'max')))['max'] == 1
+        new = old['max'].copy()
+        # Half the time one value for a whole column, so shared rows can agree
+        if rng.integers(2):
+            new = np.where(stored & (rng.random(w) < 0.3), rng.integers(1, 256, w), new).astype(np.uint8)
+        else:
+            new = np.where(stored & (rng.random((h, w)) < 0.1), rng.integers(1, 256, (h, w)), new).astype(np.uint8)
+        patch = hm.make_patch({'max': old['max']}, {'max': new})
+        try:
+            want = bytes(hm._update_hmap_binary(data, new, 'max'))
+        except hm.SharedSpanError:
+            with pytest.raises(hm.SharedSpanError):
+                hm._apply_patch_binary(data, patch)
+            outcomes.add('refused')
+            continue
+        assert bytes(hm._apply_patch_binary(data, patch)) == want
+        outcomes.add('written')
+    assert outcomes == {'refused', 'written'}
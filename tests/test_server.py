@@ -0,0 +1,65 @@
+import asyncio
+import json
+
+import numpy as np
+import pytest
+
+import hmap_core as hm
+import hmap_server
+
+HEADER = {'endian': '>', 'ver_major': 1, 'ver_minor': 1, 'pad': 0, 'compressed': 1,
+          'bbmin': (0.0, 0.0, 0.0), 'bbmax': (8.0, 6.0, 1.0)}
+
+
+class Writer:
+    def __init__(self):
+        self.data = b''
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def exchange(tmp_path, request):
+    # Status and JSON body of the first response to the raw request bytes
+    max_arr = np.arange(1, 49, dtype=np.uint8).reshape(6, 8)
+    path = tmp_path / 'map.dat'
+    path.write_bytes(bytes(hm._encode_hmap(max_arr, max_arr // 2, HEADER)))
+    service = hmap_server.HeightmapService([str(path)])
+
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(request)
+        reader.feed_eof()
+        writer = Writer()
+        await service.serve_client(reader, writer)
+        return writer.data
+
+    head, _, body = asyncio.run(run()).partition(b'\r\n\r\n')
+    return int(head.split()[1]), body
+
+
+@pytest.mark.parametrize('length', ['abc', '-5', '1.5'])
+def test_malformed_content_length_is_rejected(tmp_path, length):
+    status, body = exchange(tmp_path, f'POST /maps/map/height HTTP/1.1\r\nContent-Length: {length}\r\n\r\n'.encode())
+    assert status == 400
+    assert 'Content-Length' in json.loads(body)['error']
+
+
+def test_unknown_slice_format_is_rejected(tmp_path):
+    status, body = exchange(tmp_path, b'GET /maps/map/slice/max?format=png HTTP/1.1\r\nConnection: close\r\n\r\n')
+    assert status == 400
+    assert 'Format' in json.loads(body)['error']
+
+
+@pytest.mark.parametrize('fmt', ['raw', 'npy'])
+def test_slice_formats(tmp_path, fmt):
+    status, body = exchange(tmp_path, f'GET /maps/map/slice/max?x1=3&y1=2&format={fmt} HTTP/1.1\r\n'
+                                      f'Connection: close\r\n\r\n'.encode())
+    assert status == 200
+    assert body.endswith(bytes([1, 2, 3, 9, 10, 11]))
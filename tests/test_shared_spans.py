@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+
+import hmap_core as hm
+from helpers import random_hmap
+
+HEADER = {'endian': '>', 'ver_major': 1, 'ver_minor': 1, 'pad': 0, 'compressed': 1,
+          'bbmin': (0.0, 0.0, 0.0), 'bbmax': (4.0, 6.0, 1.0)}
+
+
+def repeated_rows():
+    # Every row identical, so the encoder stores one span for all of them
+    max_arr = np.full((6, 4), 9, dtype=np.uint8)
+    max_arr[:, 0] = 0
+    return max_arr, max_arr // 2
+
+
+def test_encoder_shares_identical_rows():
+    data = bytes(hm._encode_hmap(*repeated_rows(), HEADER))
+    layout = hm.HmapLayout(data)
+    assert len(set(layout.rows['data_offset'].tolist())) == 1
+    assert hm._shared_ranges(layout) is not None
+
+
+def test_unshared_layout_has_no_shared_ranges():
+    max_arr, min_arr = repeated_rows()
+    max_arr[np.arange(6), 2] = np.arange(6)
+    assert hm._shared_ranges(hm.HmapLayout(bytes(hm._encode_hmap(max_arr, min_arr, HEADER)))) is None
+
+
+@pytest.mark.parametrize('which', ['max', 'min'])
+def test_edit_to_one_shared_row_is_refused(tmp_path, which):
+    data = bytes(hm._encode_hmap(*repeated_rows(), HEADER))
+    edit = repeated_rows()[0 if which == 'max' else 1].copy()
+    edit[2, 2] = 50
+    with pytest.raises(hm.SharedSpanError):
+        hm._update_hmap_binary(data, edit, which)
+    path = tmp_path / 'map.dat'
+    path.write_bytes(data)
+    with pytest.raises(hm.SharedSpanError):
+        hm._update_hmap_file_inplace(str(path), edit, which)
+    # Refused before anything was written
+    assert path.read_bytes() == data
+
+
+def test_same_edit_to_every_shared_row_is_written():
+    data = bytes(hm._encode_hmap(*repeated_rows(), HEADER))
+    edit = repeated_rows()[0].copy()
+    edit[:, 2] = 50
+    out = hm._update_hmap_binary(data, edit, 'max')
+    np.testing.assert_array_equal(hm._parse_hmap_binary(bytes(out))[0], edit)
+
+
+def test_rebuild_writes_any_edit():
+    data = bytes(hm._encode_hmap(*repeated_rows(), HEADER))
+    edit = repeated_rows()[0].copy()
+    edit[2, 2] = 50
+    out = hm._rebuild_hmap_binary(data, edit, 'max')
+    np.testing.assert_array_equal(hm._parse_hmap_binary(bytes(out))[0], edit)
+
+
+def test_shared_ranges_match_span_overlap():
+    rng = np.random.default_rng(90)
+    for _ in range(50):
+        w, h = (int(v) for v in rng.integers(1, 30, 2))
+        layout = hm.HmapLayout(random_hmap(rng, w, h, shared=bool(rng.integers(2)), wild=bool(rng.integers(2))))
+        rows = layout.rows.tolist()
+        lo = min([off + s for s, c, off in rows if c] + [0])
+        refs = np.zeros(max([off + s + c for s, c, off in rows] + [0]) - lo + 1, dtype=int)
+        for s, c, off in rows:
+            if c:
+                refs[off + s - lo:off + s + c - lo] += 1
+        want = np.flatnonzero(refs > 1) + lo
+        ranges = hm._shared_ranges(layout)
+        got = np.concatenate([np.arange(a, b) for a, b in zip(*ranges)]) if ranges else np.zeros(0, int)
+        np.testing.assert_array_equal(got, want)
+        if ranges:
+            aliased = [y for y, (s, c, off) in enumerate(rows) if c and (refs[off + s - lo:off + s + c - lo] > 1).any()]
+            assert hm._aliased_rows(layout, ranges).tolist() == aliased
+
+
+def test_shared_conflicts_match_brute_force():
+    rng = np.random.default_rng(91)
+    for _ in range(200):
+        w, h = (int(v) for v in rng.integers(1, 12, 2))
+        data = random_hmap(rng, w, h, shared=True, wild=bool(rng.integers(2)))
+        layout = hm.HmapLayout(data)
+        ranges = hm._shared_ranges(layout)
+        if ranges is None:
+            continue
+        aliased = hm._aliased_rows(layout, ranges)
+        edit = hm._parse_hmap_binary(data)[0].copy()
+        if rng.integers(2):
+            y = int(rng.choice(aliased))
+            s, c, _ = layout.rows[y].tolist()
+            edit[y, rng.integers(s, s + c)] ^= 7
+        seen, conflict = {}, False
+        for y in aliased.tolist():
+            s, c, off = layout.rows[y].tolist()
+            for x in range(s, s + c):
+                if 0 <= off + x < layout.dlen - layout.dlen // 2:
+                    conflict |= seen.setdefault(off + x, edit[y, x]) != edit[y, x]
+        try:
+            hm._shared_targets(layout, edit, 'max', ranges, aliased)
+        except hm.SharedSpanError:
+            assert conflict
+        else:
+            assert not conflict
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+import hmap_core as hm
+import reference
+from helpers import random_hmap
+
+
+def edited(data, which, rng):
+    # A random remap of the current layer: rows that share bytes read the same
+    # values there, so they also agree on the edit
+    arr = hm._parse_hmap_binary(data)[0 if which == 'max' else 1]
+    return rng.permutation(256).astype(np.uint8)[arr]
+
+
+def inplace(tmp_path, data, new_arr, which):
+    path = tmp_path / 'map.dat'
+    path.write_bytes(data)
+    written = hm._update_hmap_file_inplace(str(path), new_arr, which)
+    return path.read_bytes(), written
+
+
+@pytest.mark.parametrize('endian', ['<', '>'])
+@pytest.mark.parametrize('compressed', [True, False])
+@pytest.mark.parametrize('which', ['max', 'min'])
+def test_binary_matches_reference(endian, compressed, which):
+    rng = np.random.default_rng(10)
+    for _ in range(15):
+        w, h = (int(v) for v in rng.integers(1, 30, 2))
+        data = random_hmap(rng, w, h, endian, compressed)
+        new_arr = rng.integers(0, 256, (h, w), dtype=np.uint8)
+        assert bytes(hm._update_hmap_binary(data, new_arr, which)) == reference.update_hmap(data, new_arr, which)
+
+
+@pytest.mark.parametrize('endian', ['<', '>'])
+@pytest.mark.parametrize('which', ['max', 'min'])
+@pytest.mark.parametrize('shared', [False, True])
+def test_inplace_matches_binary(tmp_path, endian, which, shared):
+    rng = np.random.default_rng(11)
+    for _ in range(15):
+        w, h = (int(v) for v in rng.integers(1, 30, 2))
+        data = random_hmap(rng, w, h, endian, shared=shared, wild=True)
+        new_arr = edited(data, which, rng)
+        want = bytes(hm._update_hmap_binary(data, new_arr, which))
+        got, written = inplace(tmp_path, data, new_arr, which)
+        assert got == want
+        assert written == sum(a != b for a, b in zip(data, want))
+
+
+def test_inplace_matches_binary_across_row_blocks(tmp_path, monkeypatch):
+    monkeypatch.setattr(hm, '_CHUNK_CELLS', 37)
+    rng = np.random.default_rng(12)
+    data = random_hmap(rng, 23, 31, shared=True)
+    new_arr = edited(data, 'max', rng)
+    assert inplace(tmp_path, data, new_arr, 'max')[0] == bytes(hm._update_hmap_binary(data, new_arr, 'max'))
+
+
+def test_conflicting_shared_edit_fails_in_both_paths(tmp_path):
+    rng = np.random.default_rng(13)
+    while True:
+        data = random_hmap(rng, 12, 9, shared=True)
+        layout = hm.HmapLayout(data)
+        shared = hm._shared_ranges(layout)
+        if shared is not None:
+            break
+    y = int(hm._aliased_rows(layout, shared)[0])
+    new_arr = edited(data, 'max', rng)
+    start, count, _off = layout.rows[y].tolist()
+    new_arr[y, start:start + count] ^= 0xFF
+    with pytest.raises(hm.SharedSpanError):
+        hm._update_hmap_binary(data, new_arr, 'max')
+    with pytest.raises(hm.SharedSpanError):
+        inplace(tmp_path, data, new_arr, 'max')
+    assert (tmp_path / 'map.dat').read_bytes() == data
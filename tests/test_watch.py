@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+import hmap_core as hm
+import height_tool_cli as cli
+from helpers import random_hmap
+
+HEADER = {'endian': '>', 'ver_major': 1, 'ver_minor': 1, 'pad': 0, 'compressed': 1,
+          'bbmin': (0.0, 0.0, 0.0), 'bbmax': (6.0, 4.0, 1.0)}
+
+
+@pytest.mark.parametrize('compressed', [True, False])
+@pytest.mark.parametrize('which', ['max', 'min'])
+def test_row_update_matches_full_update(tmp_path, compressed, which):
+    rng = np.random.default_rng(30)
+    path = tmp_path / 'map.dat'
+    for _ in range(10):
+        w, h = (int(v) for v in rng.integers(1, 30, 2))
+        data = random_hmap(rng, w, h, compressed=compressed, shared=True)
+        arr = hm._parse_hmap_binary(data)[0 if which == 'max' else 1]
+        new_arr = rng.permutation(256).astype(np.uint8)[arr]
+        rows = np.flatnonzero((new_arr != arr).any(axis=1))
+        path.write_bytes(data)
+        hm._update_hmap_file_inplace(str(path), new_arr, which, rows)
+        assert path.read_bytes() == bytes(hm._update_hmap_binary(data, new_arr, which))
+
+
+def test_row_update_leaves_other_rows(tmp_path):
+    rng = np.random.default_rng(31)
+    data = random_hmap(rng, 9, 12)
+    path = tmp_path / 'map.dat'
+    path.write_bytes(data)
+    hm._update_hmap_file_inplace(str(path), np.full((12, 9), 77, np.uint8), 'max', [3])
+    new_arr = hm._parse_hmap_binary(data)[0].copy()
+    new_arr[3] = 77
+    assert path.read_bytes() == bytes(hm._update_hmap_binary(data, new_arr, 'max'))
+
+
+def test_watch_rebuilds_when_shared_rows_split(tmp_path):
+    max_arr = np.arange(1, 25, dtype=np.uint8).reshape(4, 6)
+    max_arr[3] = max_arr[1]
+    path = tmp_path / 'map.dat'
+    path.write_bytes(bytes(hm._encode_hmap(max_arr, max_arr, HEADER)))
+    edited = max_arr.copy()
+    edited[1, 2] = 200
+    with pytest.raises(hm.SharedSpanError):
+        hm._update_hmap_file_inplace(str(path), edited, 'max', [1])
+    png = tmp_path / 'map_max.png'
+    Image.fromarray(edited).save(png)
+    applied = {'max': max_arr, 'min': max_arr}
+    res = cli._watch_apply(str(path), 'max', str(png), applied, False)
+    assert res['rebuilt'] and res['rows'] == 1
+    np.testing.assert_array_equal(hm.parse_dat_file(str(path))[0], edited)
+
+
+def test_watch_creates_the_output_directory(tmp_path):
+    max_arr = np.arange(1, 25, dtype=np.uint8).reshape(4, 6)
+    path = tmp_path / 'map.dat'
+    path.write_bytes(bytes(hm._encode_hmap(max_arr, max_arr, HEADER)))
+    edited = max_arr.copy()
+    edited[2, 4] = 200
+    Image.fromarray(edited).save(tmp_path / 'map_max.png')
+    out = tmp_path / 'new' / 'dir' / 'map.dat'
+    assert cli.main(['watch', str(path), '-o', str(out), '--once', '--no-inverse']) == cli.EXIT_OK
+    np.testing.assert_array_equal(hm.parse_dat_file(str(out))[0], edited)
+
+
+def test_watch_reports_an_unwritable_output(tmp_path, capsys):
+    max_arr = np.arange(1, 25, dtype=np.uint8).reshape(4, 6)
+    path = tmp_path / 'map.dat'
+    path.write_bytes(bytes(hm._encode_hmap(max_arr, max_arr, HEADER)))
+    (tmp_path / 'file').write_text('')
+    assert cli.main(['watch', str(path), '-o', str(tmp_path / 'file' / 'map.dat'), '--once']) == cli.EXIT_FAILED
+    assert 'Watch failed' in capsys.readouterr().err